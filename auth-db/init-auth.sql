@@ -11,5 +11,29 @@ CREATE TABLE IF NOT EXISTS users (
 CREATE TABLE IF NOT EXISTS transactions (
     transaction_id VARCHAR(36) PRIMARY KEY,
     status VARCHAR(10) NOT NULL, -- 'pending', 'prepared', 'committed', 'aborted'
-    data JSONB -- Storing the data to commit in JSON format (for simplicity)
-);
\ No newline at end of file
+    data JSONB, -- Storing the data to commit in JSON format (for simplicity)
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- For databases created before transactions were timestamped
+ALTER TABLE transactions ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE transactions ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+
+-- Only transactions still waiting for a decision are indexed; maintenance.py
+-- times out old prepared ones through it
+CREATE INDEX IF NOT EXISTS ix_transactions_open ON transactions (created_at)
+    WHERE status IN ('pending', 'prepared');
+
+-- Committed transactions are moved here in batches by maintenance.py
+CREATE TABLE IF NOT EXISTS transactions_archive (
+    transaction_id VARCHAR(36) PRIMARY KEY,
+    status VARCHAR(10) NOT NULL,
+    data JSONB,
+    created_at TIMESTAMP,
+    updated_at TIMESTAMP,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Registration relies on ON CONFLICT for both unique columns
+CREATE UNIQUE INDEX IF NOT EXISTS users_username_key ON users (username);
@@ -0,0 +1,94 @@
+# Login throughput by password-hashing pool size.
+#
+#   python bench_login.py --workers 0 1 2 4 8 --concurrency 16
+#
+# Seeds --users users, then for each pool size runs --concurrency client
+# threads logging in for --seconds and reports logins per second. Pool size 0
+# hashes in the request thread, which is what every login paid before the pool.
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask
+from flask_jwt_extended import JWTManager
+from sqlalchemy import insert
+from db import db
+from models.user import User
+from passwords import PasswordHasher, hash_password
+import routes
+
+
+def create_app(db_uri):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = db_uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['JWT_SECRET_KEY'] = 'super-secret'
+    db.init_app(app)
+    JWTManager(app)
+    app.register_blueprint(routes.auth_bp)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def seed(app, users):
+    # Every user shares one hash; verification cost doesn't depend on the salt
+    stored = hash_password('password123')
+    with app.app_context():
+        db.session.execute(insert(User), [
+            {"username": f"user{i}", "email": f"user{i}@example.com", "password": stored} for i in range(users)
+        ])
+        db.session.commit()
+
+
+def run(app, users, concurrency, seconds):
+    deadline = time.perf_counter() + seconds
+    counts = [0] * concurrency
+
+    def client_loop(index):
+        client = app.test_client()
+        i = index
+        while time.perf_counter() < deadline:
+            response = client.post('/api/auth/login', json={
+                'email': f"user{i % users}@example.com", 'password': 'password123'
+            })
+            assert response.status_code in (200, 503), response.status_code
+            if response.status_code == 200:
+                counts[index] += 1
+            i += concurrency
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(client_loop, range(concurrency)))
+    return sum(counts) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db-uri')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    args = parser.parse_args()
+
+    db_uri = args.db_uri or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'login.db')}"
+    app = create_app(db_uri)
+    seed(app, args.users)
+    # Let the pool, not the adaptive limiter, be the bottleneck
+    routes.concurrency_limiter.current_limit = routes.concurrency_limiter.max_limit = max(64, args.concurrency)
+
+    print(f"{os.cpu_count()} cores, {args.concurrency} concurrent clients")
+    for workers in args.workers:
+        routes.password_hasher = PasswordHasher(workers=workers)
+        # Start the worker processes before timing
+        routes.password_hasher.hash('warm-up')
+        rate = run(app, args.users, args.concurrency, args.seconds)
+        routes.password_hasher.shutdown()
+        label = "inline" if workers == 0 else f"{workers} workers"
+        print(f"{label:<12} {rate:8.1f} logins/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# Overhead of token revocation on @jwt_required requests.
+#
+#   python bench_revocation.py --revoked 10000 --redis-url redis://localhost:6379/0
+#
+# Times --requests authenticated GETs of a trivial route with no blocklist
+# loader, with the local denylist holding --revoked entries, and (when
+# --redis-url is given) with a Redis lookup per request for comparison.
+import argparse
+import statistics
+import time
+import uuid
+import redis
+from flask import Flask, jsonify
+from flask_jwt_extended import JWTManager, create_access_token, jwt_required
+from revocation import TokenDenylist
+
+
+def create_app(setup):
+    app = Flask(__name__)
+    app.config['JWT_SECRET_KEY'] = 'super-secret'
+    jwt = JWTManager(app)
+    setup(jwt)
+
+    @app.route('/protected')
+    @jwt_required()
+    def protected():
+        return jsonify({}), 200
+
+    return app
+
+
+def run(label, app, requests):
+    client = app.test_client()
+    with app.app_context():
+        headers = {'Authorization': f'Bearer {create_access_token(identity=1)}'}
+    client.get('/protected', headers=headers)
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = client.get('/protected', headers=headers)
+        timings.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.status_code
+    timings.sort()
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    print(f"{label:<20} mean {statistics.mean(timings):7.3f} ms   p50 {statistics.median(timings):7.3f} ms   "
+          f"p99 {p99:7.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--revoked', type=int, default=10000)
+    parser.add_argument('--redis-url')
+    args = parser.parse_args()
+
+    run("no revocation", create_app(lambda jwt: None), args.requests)
+
+    denylist = TokenDenylist()
+    for _ in range(args.revoked):
+        denylist.revoke({'jti': str(uuid.uuid4()), 'exp': time.time() + 900})
+    run("local denylist", create_app(denylist.init_app), args.requests)
+
+    if args.redis_url:
+        client = redis.Redis.from_url(args.redis_url)
+
+        def redis_loader(jwt):
+            @jwt.token_in_blocklist_loader
+            def check(jwt_header, jwt_payload):
+                return client.exists('revoked_jti:' + jwt_payload['jti']) == 1
+
+        run("redis per request", create_app(redis_loader), args.requests)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# Throughput of the service in this directory under each way of running it:
+# today's single-process launch (app.py) and serve.py with each worker class.
+#
+#   python bench_server.py --duration 15 --concurrency 64
+#
+# Run it inside the service's container (or anywhere its database and Redis
+# resolve). Each mode gets its own server on --port, started and stopped by
+# the script; load comes from --concurrency client processes, each holding one
+# keep-alive connection. Every request carries a different X-Forwarded-For so
+# the per-client rate limit doesn't turn the run into a 429 benchmark.
+import argparse
+import http.client
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+SERVICE = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+# How each service runs without serve.py: Werkzeug for auth-service, one
+# eventlet process for flashcards-service
+DEV_SERVERS = {
+    'auth-service': "from app import app; app.run(host='127.0.0.1', port={port})",
+    'flashcards-service': "from app import app, socketio; socketio.run(app, host='127.0.0.1', port={port})",
+}
+DEFAULT_PATHS = {'auth-service': '/api/auth/status', 'flashcards-service': '/api/flashcards/status'}
+# flashcards-service patches the standard library for eventlet on import, so
+# only the eventlet worker class suits it
+DEFAULT_MODES = {'auth-service': 'dev,sync,gthread', 'flashcards-service': 'dev,eventlet'}
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return float('nan')
+    return sorted_values[min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))]
+
+
+def server_command(mode, port, workers, threads):
+    if mode == 'dev':
+        return [sys.executable, '-c', DEV_SERVERS[SERVICE].format(port=port)]
+    return [sys.executable, 'serve.py', '--bind', f'127.0.0.1:{port}', '--workers', str(workers),
+            '--worker-class', mode, '--threads', str(threads), '--max-requests', '0', '--no-register']
+
+
+def wait_until_up(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/')
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server on port {port} didn't start")
+
+
+def client(args):
+    port, path, duration, index = args
+    latencies, failures = [], 0
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    deadline = time.time() + duration
+    i = 0
+    while time.time() < deadline:
+        i += 1
+        address = f"10.{index % 256}.{i // 256 % 256}.{i % 256}"
+        start = time.perf_counter()
+        try:
+            connection.request('GET', path, headers={'X-Forwarded-For': address})
+            connection.getresponse().read()
+            latencies.append(time.perf_counter() - start)
+        except (OSError, http.client.HTTPException):
+            failures += 1
+            connection.close()
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    return latencies, failures
+
+
+def run_mode(mode, args):
+    env = dict(os.environ, SERVER_REGISTER='0')
+    server = subprocess.Popen(server_command(mode, args.port, args.workers, args.threads), env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_up(args.port)
+        with multiprocessing.Pool(args.concurrency) as pool:
+            results = pool.map(client, [(args.port, args.path, args.duration, i) for i in range(args.concurrency)])
+    finally:
+        server.terminate()
+        server.wait()
+    latencies = sorted(latency for result, _ in results for latency in result)
+    failures = sum(failed for _, failed in results)
+    print(f"{mode:<10} {len(latencies) / args.duration:9.1f} req/s   "
+          f"p50 {percentile(latencies, 50) * 1000:7.1f} ms   p99 {percentile(latencies, 99) * 1000:7.1f} ms   "
+          f"{failures} failed")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', default=DEFAULT_PATHS[SERVICE])
+    parser.add_argument('--modes', default=DEFAULT_MODES[SERVICE],
+                        help="dev is today's launch; the others are serve.py worker classes")
+    parser.add_argument('--port', type=int, default=5900)
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=15)
+    args = parser.parse_args()
+
+    print(f"GET {args.path}, {args.concurrency} clients, {args.workers} workers, {args.duration:.0f}s per mode")
+    for mode in args.modes.split(','):
+        run_mode(mode, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
+from read_replicas import RoutingSession
 
-db = SQLAlchemy()
+# RoutingSession sends read-only route handlers to a replica when there is one
+db = SQLAlchemy(session_options={"class_": RoutingSession})
@@ -0,0 +1,122 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# scrypt cost, tunable per deployment. Changing any of these makes the next
+# successful login rehash the user's password with the new parameters.
+SCRYPT_N = int(os.getenv("PASSWORD_SCRYPT_N", 2 ** 14))
+SCRYPT_R = int(os.getenv("PASSWORD_SCRYPT_R", 8))
+SCRYPT_P = int(os.getenv("PASSWORD_SCRYPT_P", 1))
+# Size of the process pool; 0 hashes in the request thread
+HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+# Hashes waiting for a worker, per worker, before callers block
+QUEUE_PER_WORKER = 2
+
+PREFIX = "scrypt"
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+
+def _b64(data):
+    return base64.b64encode(data).decode("ascii")
+
+
+def _scrypt(password, salt, n, r, p):
+    # maxmem must cover 128 * n * r * p bytes or OpenSSL refuses the parameters
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r * p, dklen=KEY_BYTES)
+
+
+def hash_password(password, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+    # Stored as scrypt$n$r$p$salt$hash
+    salt = secrets.token_bytes(SALT_BYTES)
+    return "$".join([PREFIX, str(n), str(r), str(p), _b64(salt), _b64(_scrypt(password, salt, n, r, p))])
+
+
+def verify_password(password, stored, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+    # Returns (matches, new_hash). new_hash is set when the password matched
+    # but was stored with other parameters (or in plaintext) and should be
+    # replaced.
+    parts = stored.split("$")
+    if len(parts) != 6 or parts[0] != PREFIX:
+        # Passwords stored before hashing was introduced
+        matches = hmac.compare_digest(stored.encode("utf-8"), password.encode("utf-8"))
+        return matches, hash_password(password, n, r, p) if matches else None
+    stored_n, stored_r, stored_p = int(parts[1]), int(parts[2]), int(parts[3])
+    expected = base64.b64decode(parts[5])
+    matches = hmac.compare_digest(_scrypt(password, base64.b64decode(parts[4]), stored_n, stored_r, stored_p),
+                                  expected)
+    if matches and (stored_n, stored_r, stored_p) != (n, r, p):
+        return True, hash_password(password, n, r, p)
+    return matches, None
+
+
+class PasswordHasher:
+    # Runs hashing and verification in a bounded process pool so a login
+    # doesn't hold the GIL for the length of a scrypt call. At most
+    # QUEUE_PER_WORKER hashes per worker are outstanding; further callers wait.
+    # Bulk hashing takes the same slots, but never more than one per worker,
+    # so logins and registrations don't queue behind a whole upload.
+
+    def __init__(self, workers=HASH_WORKERS, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+        self.workers = workers
+        self.n, self.r, self.p = n, r, p
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(1, workers) * QUEUE_PER_WORKER)
+        self._bulk_slots = threading.BoundedSemaphore(max(1, workers))
+        # Verified against when the user doesn't exist, so a miss takes as long as a hit
+        self._dummy_hash = hash_password(secrets.token_hex(8), n, r, p)
+
+    def _executor(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+    def _run(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+        with self._slots:
+            return self._executor().submit(fn, *args).result()
+
+    def hash(self, password):
+        return self._run(hash_password, password, self.n, self.r, self.p)
+
+    def hash_many(self, passwords):
+        # For bulk provisioning: each hash holds a bulk slot and a shared slot
+        # until it finishes
+        if self.workers <= 0:
+            return [hash_password(password, self.n, self.r, self.p) for password in passwords]
+        futures = []
+        for password in passwords:
+            self._bulk_slots.acquire()
+            self._slots.acquire()
+            try:
+                future = self._executor().submit(hash_password, password, self.n, self.r, self.p)
+            except BaseException:
+                self._release_bulk_slot(None)
+                raise
+            future.add_done_callback(self._release_bulk_slot)
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def _release_bulk_slot(self, future):
+        self._slots.release()
+        self._bulk_slots.release()
+
+    def verify(self, password, stored):
+        if stored is None:
+            self._run(verify_password, password, self._dummy_hash, self.n, self.r, self.p)
+            return False, None
+        return self._run(verify_password, password, stored, self.n, self.r, self.p)
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
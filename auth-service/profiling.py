@@ -0,0 +1,220 @@
+import functools
+import hmac
+import importlib
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import uuid
+from flask import Flask, g, request, has_request_context
+from sqlalchemy import event
+from prometheus_client import Counter
+from sql_metrics import current_endpoint
+
+# Requests carrying this header with PROFILE_TOKEN as its value are profiled;
+# without a token only sampling can start the profiler
+PROFILE_HEADER = 'X-Profile'
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+# Fraction of all requests to profile, e.g. 0.001
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "profiles"))
+# Statements of one shape run this many times in one request are reported as a likely N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", 5))
+
+PROFILED = Counter('profiled_requests_total', 'Requests run under the sampling profiler', ['endpoint', 'trigger'])
+N_PLUS_ONE = Counter('sql_repeated_statements_total',
+                     'Requests that ran one statement N_PLUS_ONE_THRESHOLD times or more (likely N+1)',
+                     ['endpoint'])
+
+# Samples taken while another green thread had the OS thread
+SWITCHED_OUT = '[switched out]'
+
+
+def _native(name):
+    # The sampler needs a real OS thread even when eventlet patched the standard library
+    if 'eventlet' in sys.modules:
+        from eventlet import patcher
+        return patcher.original(name)
+    return importlib.import_module(name)
+
+
+@functools.lru_cache(maxsize=1024)
+def statement_shape(statement):
+    # Literals become ?, and IN lists of any length look the same
+    shape = " ".join(statement.split())
+    shape = re.sub(r"'(?:[^']|'')*'", "?", shape)
+    shape = re.sub(r"%\(\w+\)s|\$\d+|:\w+|\b\d+(?:\.\d+)?\b", "?", shape)
+    return re.sub(r"\(\?(?:, \?)+\)", "(?, ...)", shape)
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _request_root():
+    # The request's Flask.wsgi_app frame; samples whose stack doesn't reach it
+    # belong to something else running on the same OS thread
+    frame = sys._getframe()
+    while frame is not None and frame.f_code is not Flask.wsgi_app.__code__:
+        frame = frame.f_back
+    return frame
+
+
+class Sampler:
+    # Samples the stack of one request every `interval` seconds from a
+    # background OS thread and counts identical stacks (collapsed format)
+
+    def __init__(self, root, interval):
+        self.root = root
+        self.interval = interval
+        self.thread_id = _native('_thread').get_ident()
+        self.stacks = {}
+        self._stopped = _native('threading').Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = _native('threading').Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        frames = []
+        while frame is not None and frame is not self.root:
+            frames.append(frame)
+            frame = frame.f_back
+        if frame is None:
+            stack = SWITCHED_OUT
+        else:
+            stack = ";".join(_frame_label(f) for f in [self.root, *reversed(frames)])
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def collapsed(self):
+        # One "frame;frame;frame count" line per stack, as flamegraph.pl and speedscope read it
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+
+class RequestProfiler:
+    # Profiles a request when it carries the profile header with the right
+    # token, or when it is sampled at sample_rate. The profile goes to
+    # <profile_dir>/<time>-<endpoint>-<id>.collapsed, the statements it ran
+    # to the same name with .sql, and the response carries the id in
+    # X-Profile-Id. One request per process is profiled at a time.
+    #
+    # Every request, profiled or not, counts the statements it runs by shape,
+    # so a loop inlining a different literal each time still counts as one.
+    # Any shape run threshold times or more is logged as a likely N+1 and
+    # counted in sql_repeated_statements_total.
+
+    def __init__(self, token=PROFILE_TOKEN, sample_rate=PROFILE_SAMPLE_RATE, interval_ms=PROFILE_INTERVAL_MS,
+                 profile_dir=PROFILE_DIR, threshold=N_PLUS_ONE_THRESHOLD):
+        self.token = token
+        self.sample_rate = sample_rate
+        self.interval = interval_ms / 1000
+        self.profile_dir = profile_dir
+        self.threshold = threshold
+        self._busy = _native('threading').Lock()
+
+    def init_app(self, app, db):
+        with app.app_context():
+            for engine in db.engines.values():
+                self.instrument(engine)
+        app.before_request(self._start)
+        app.after_request(self._add_header)
+        app.teardown_request(self._finish)
+
+    def instrument(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _trigger(self):
+        header = request.headers.get(PROFILE_HEADER)
+        if header and self.token and hmac.compare_digest(header, self.token):
+            return 'header'
+        if self.sample_rate and random.random() < self.sample_rate:
+            return 'sampled'
+        return None
+
+    def _start(self):
+        trigger = self._trigger()
+        if trigger is None or not self._busy.acquire(blocking=False):
+            return
+        g.profile_id = uuid.uuid4().hex[:12]
+        g.profile_trigger = trigger
+        g.profile_statements = []
+        g.profile_started = time.perf_counter()
+        g.profile_sampler = Sampler(_request_root(), self.interval)
+        g.profile_sampler.start()
+
+    def _add_header(self, response):
+        if 'profile_id' in g:
+            response.headers['X-Profile-Id'] = g.profile_id
+        return response
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context._profiling_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if not has_request_context():
+            return
+        counts = g.get('sql_statement_counts')
+        if counts is None:
+            counts = g.sql_statement_counts = {}
+        shape = statement_shape(statement)
+        counts[shape] = counts.get(shape, 0) + 1
+        if 'profile_statements' in g:
+            g.profile_statements.append((statement, time.perf_counter() - context._profiling_start))
+
+    def _finish(self, exc):
+        endpoint = current_endpoint()
+        self._report_repeats(endpoint, g.get('sql_statement_counts', {}))
+        sampler = g.get('profile_sampler')
+        if sampler is None:
+            return
+        try:
+            sampler.stop()
+            elapsed = time.perf_counter() - g.profile_started
+            PROFILED.labels(endpoint=endpoint, trigger=g.profile_trigger).inc()
+            path = self._write(endpoint, sampler, g.profile_statements)
+            print(f"Profiled {endpoint} ({g.profile_trigger}, {elapsed * 1000:.0f} ms, "
+                  f"{len(g.profile_statements)} statements): {path}.collapsed")
+        except OSError as e:
+            print(f"Profile of {endpoint} not saved: {e}")
+        finally:
+            self._busy.release()
+
+    def _report_repeats(self, endpoint, counts):
+        repeated = [(count, shape) for shape, count in counts.items() if count >= self.threshold]
+        if not repeated:
+            return
+        N_PLUS_ONE.labels(endpoint=endpoint).inc()
+        for count, shape in sorted(repeated, reverse=True):
+            print(f"Likely N+1 in {endpoint}: {count} x {shape}")
+
+    def _write(self, endpoint, sampler, statements):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{endpoint}-{g.profile_id}"
+        path = os.path.join(self.profile_dir, name)
+        with open(path + ".collapsed", "w") as f:
+            f.write(sampler.collapsed())
+        # Statement shapes by how often they ran, with their total time
+        shapes = {}
+        for statement, seconds in statements:
+            shape = statement_shape(statement)
+            count, total = shapes.get(shape, (0, 0.0))
+            shapes[shape] = (count + 1, total + seconds)
+        with open(path + ".sql", "w") as f:
+            for shape, (count, total) in sorted(shapes.items(), key=lambda item: -item[1][0]):
+                f.write(f"{count:6d} {total * 1000:10.2f} ms  {shape}\n")
+        return path
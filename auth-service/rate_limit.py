@@ -0,0 +1,162 @@
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+import redis
+from flask import request, jsonify, current_app
+from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+
+# GCRA in one round trip. Grants up to ARGV[3] requests at once (the local lease)
+# and returns {granted, retry_after_ms}. Uses the Redis clock so every replica
+# agrees on time.
+GCRA_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + tonumber(now_parts[2]) / 1000
+local interval = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local wanted = tonumber(ARGV[3])
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then
+    tat = now
+end
+local available = math.floor((now + period - tat) / interval)
+local granted = math.min(wanted, available)
+if granted <= 0 then
+    return {0, math.ceil(tat + interval - period - now)}
+end
+local new_tat = tat + granted * interval
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil(new_tat - now))
+return {granted, 0}
+"""
+
+RULE_RE = re.compile(r"^\s*(\d+)\s*(?:/|per)\s*(\d+)?\s*(second|minute|hour|day)s?\s*$", re.IGNORECASE)
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+def parse_rule(rule):
+    # "5 per minute", "100/hour", "10 per 30 seconds" -> (count, period_seconds)
+    match = RULE_RE.match(rule)
+    if not match:
+        raise ValueError(f"Invalid rate limit: {rule!r}")
+    count, multiplier, unit = match.groups()
+    return int(count), int(multiplier or 1) * PERIODS[unit.lower()]
+
+
+def get_ip_from_forwarded():
+    if request.headers.getlist("X-Forwarded-For"):
+        return request.headers.getlist("X-Forwarded-For")[0]
+    return request.remote_addr
+
+
+def get_rate_limit_identity():
+    # Authenticated requests are limited per user, everything else per client IP
+    try:
+        verify_jwt_in_request(optional=True)
+        identity = get_jwt_identity()
+    except Exception:
+        identity = None
+    if identity is not None:
+        return f"user:{identity}"
+    return f"ip:{get_ip_from_forwarded()}"
+
+
+class _Lease:
+    def __init__(self, tokens, expires_at):
+        self.tokens = tokens
+        self.expires_at = expires_at
+
+
+class RateLimiter:
+    # Rate limits shared by every replica through Redis. Each request is checked
+    # once, against its route's own limit if it has one, or the default limit.
+    #
+    # To keep Redis off the hot path, a check may lease a few tokens at once and
+    # spend the rest locally. Leased tokens are already counted in Redis and
+    # expire after `lease_ttl` seconds, so leasing can only make a limit
+    # stricter, never looser. Limits too small to lease from still hit Redis on
+    # every request.
+
+    def __init__(self, redis_client=None, prefix='ratelimit', lease_fraction=0.05, max_lease=20,
+                 lease_ttl=1.0, max_local_keys=10000):
+        self.redis = redis_client
+        self.prefix = prefix
+        self.lease_fraction = lease_fraction
+        self.max_lease = max_lease
+        self.lease_ttl = lease_ttl
+        self.max_local_keys = max_local_keys
+        self.default_limit = None
+        self._script = None
+        self._leases = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app, redis_client=None, default_limits=None):
+        if redis_client is not None:
+            self.redis = redis_client
+        if default_limits:
+            self.default_limit = parse_rule(default_limits[0])
+        if self.redis is not None:
+            self._script = self.redis.register_script(GCRA_SCRIPT)
+        app.before_request(self._check_request)
+
+    def limit(self, rule):
+        # Marks the view; the check itself runs once in before_request
+        parsed = parse_rule(rule)
+
+        def decorator(fn):
+            fn._rate_limit = parsed
+            return fn
+        return decorator
+
+    def _take_local(self, key):
+        with self._lock:
+            lease = self._leases.get(key)
+            if lease is None:
+                return False
+            if lease.tokens <= 0 or lease.expires_at <= time.monotonic():
+                del self._leases[key]
+                return False
+            lease.tokens -= 1
+            return True
+
+    def _store_lease(self, key, tokens):
+        with self._lock:
+            self._leases[key] = _Lease(tokens, time.monotonic() + self.lease_ttl)
+            self._leases.move_to_end(key)
+            while len(self._leases) > self.max_local_keys:
+                self._leases.popitem(last=False)
+
+    def hit(self, key, count, period):
+        # Returns 0 when allowed, otherwise the number of seconds to wait
+        if self._take_local(key):
+            return 0
+        lease = max(1, min(self.max_lease, int(count * self.lease_fraction)))
+        interval_ms = period * 1000.0 / count
+        try:
+            granted, retry_after_ms = self._script(keys=[key], args=[interval_ms, period * 1000, lease])
+        except redis.RedisError:
+            # Fail open: a Redis outage should not take the API down with it
+            return 0
+        if int(granted) <= 0:
+            return max(1, math.ceil(int(retry_after_ms) / 1000.0))
+        if int(granted) > 1:
+            self._store_lease(key, int(granted) - 1)
+        return 0
+
+    def _check_request(self):
+        if self._script is None or request.endpoint is None:
+            return None
+        view = current_app.view_functions.get(request.endpoint)
+        rule = getattr(view, '_rate_limit', None)
+        if rule is None:
+            if self.default_limit is None:
+                return None
+            rule = self.default_limit
+        count, period = rule
+        key = f"{self.prefix}:{request.endpoint}:{count}/{period}:{get_rate_limit_identity()}"
+        retry_after = self.hit(key, count, period)
+        if retry_after:
+            response = jsonify({"error": f"Rate limit exceeded: {count} per {period} seconds"})
+            response.headers['Retry-After'] = str(retry_after)
+            return response, 429
+        return None
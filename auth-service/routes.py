@@ -1,36 +1,78 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import create_access_token, jwt_required
+import csv
+import json
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt
 from models.user import User
-from sqlalchemy import text
+from sqlalchemy import text, select, or_
+from sqlalchemy.dialects import postgresql, sqlite
 from db import db 
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
-import threading
-import time
-from models.transaction import Transaction
-import uuid
+import two_phase
+from two_phase import GroupCommitter
+from rate_limit import RateLimiter
+from concurrency import AdaptiveLimiter, Overloaded
+from passwords import PasswordHasher
+from revocation import TokenDenylist
+from username_cache import UsernameCache
+from uploads import text_reader
+from read_replicas import read_only
 
 auth_bp = Blueprint('auth', __name__)
 
-limiter = Limiter(get_remote_address)
+limiter = RateLimiter()
 
 max_concurrent_tasks = 10
-semaphore = threading.BoundedSemaphore(value=max_concurrent_tasks)
+# Starts at max_concurrent_tasks and adapts to observed latency; see concurrency.py
+concurrency_limiter = AdaptiveLimiter(initial_limit=max_concurrent_tasks)
 
+# Shares database commits between concurrent prepare/commit/abort calls
+group_committer = GroupCommitter()
+
+# scrypt runs in a process pool; cost and pool size come from the environment (see passwords.py)
+password_hasher = PasswordHasher()
+
+# Revoked tokens; app.py connects it to Redis and registers it with the JWTManager
+denylist = TokenDenylist()
+
+# Id -> username projection for other services; app.py connects it to Redis
+username_cache = UsernameCache()
+
+PROVISION_BATCH_SIZE = 1000
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+MAX_BATCH_IDS = 500
+
+# Insert one user, and in the same statement check which unique columns were
+# already taken. The EXISTS subqueries see the table as it was before the
+# INSERT, so they only report conflicts with existing users.
+REGISTER_SQL = text("""
+    WITH new_user AS (
+        INSERT INTO users (username, email, password, created_at)
+        VALUES (:username, :email, :password, now())
+        ON CONFLICT DO NOTHING
+        RETURNING id
+    )
+    SELECT (SELECT id FROM new_user) AS id,
+           EXISTS (SELECT 1 FROM users WHERE username = :username) AS username_taken,
+           EXISTS (SELECT 1 FROM users WHERE email = :email) AS email_taken
+""")
+
+# Two-phase commit participant. Single-transaction calls from concurrent
+# requests share database commits through the group committer; the batch
+# variants apply all their transactions in one database transaction.
 @auth_bp.route("/api/auth/prepare", methods=["POST"])
 def prepare():
     transaction_id = request.json.get("transaction_id")
     data = request.json.get("data")
+    if not isinstance(transaction_id, str) or not transaction_id:
+        return jsonify({"error": "transaction_id is required"}), 400
 
     try:
-        # Create and save transaction as "prepared"
-        transaction = Transaction(transaction_id=transaction_id, status="prepared", data=data)
-        db.session.add(transaction)
-        db.session.commit()
-
-        return jsonify({"transaction_id": transaction_id, "status": "prepared"}), 200
+        # Preparing again returns the state the transaction is already in
+        status = group_committer.submit("prepare", transaction_id, data)
+        return jsonify({"transaction_id": transaction_id, "status": status}), 200
+    except two_phase.InvalidOperation as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
 @auth_bp.route("/api/auth/commit", methods=["POST"])
@@ -38,16 +80,14 @@ def commit():
     transaction_id = request.json.get("transaction_id")
 
     try:
-        transaction = Transaction.query.get(transaction_id)
-        if transaction and transaction.status == "prepared":
-            # Update status to "committed"
-            transaction.status = "committed"
-            db.session.commit()
+        status = group_committer.submit("commit", transaction_id)
+        if status == "committed":
             return jsonify({"status": "committed"}), 200
         else:
             return jsonify({"error": "Transaction not found or not prepared"}), 404
+    except two_phase.InvalidOperation as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
 @auth_bp.route("/api/auth/abort", methods=["POST"])
@@ -55,136 +95,358 @@ def abort():
     transaction_id = request.json.get("transaction_id")
 
     try:
-        # Retrieve the transaction by ID
-        transaction = Transaction.query.get(transaction_id)
-        if transaction:
-            # Update status to "aborted" and commit
-            transaction.status = "aborted"
-            db.session.commit()
-
-            # Delete the transaction entry from the table
-            Transaction.query.filter_by(transaction_id=transaction_id).delete()
-            db.session.commit()
-
+        # The row is deleted in the same statement that aborts it
+        status = group_committer.submit("abort", transaction_id)
+        if status == "aborted":
             return jsonify({"status": "aborted and deleted"}), 200
+        elif status == "committed":
+            return jsonify({"error": "Transaction already committed"}), 409
         else:
             return jsonify({"error": "Transaction not found"}), 404
+    except two_phase.InvalidOperation as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
+def transaction_ids_from_request():
+    transaction_ids = (request.get_json(silent=True) or {}).get("transaction_ids")
+    if not isinstance(transaction_ids, list) or not all(isinstance(t, str) and t for t in transaction_ids):
+        return None
+    return list(dict.fromkeys(transaction_ids))
+
+@auth_bp.route("/api/auth/prepare/batch", methods=["POST"])
+def prepare_batch():
+    transactions = (request.get_json(silent=True) or {}).get("transactions")
+    if not isinstance(transactions, list) or not all(
+            isinstance(t, dict) and isinstance(t.get("transaction_id"), str) and t["transaction_id"]
+            for t in transactions):
+        return jsonify({"error": "transactions must be a list of {transaction_id, data} objects"}), 400
+    if len(transactions) > two_phase.MAX_BATCH_IDS:
+        return jsonify({"error": f"At most {two_phase.MAX_BATCH_IDS} transactions per request"}), 400
+
+    operations = [("prepare", t["transaction_id"], t.get("data")) for t in transactions]
+    try:
+        statuses = two_phase.apply_batch(operations)
+    except two_phase.InvalidOperation as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    return jsonify({"results": {op[1]: status for op, status in zip(operations, statuses)}}), 200
+
+@auth_bp.route("/api/auth/commit/batch", methods=["POST"])
+def commit_batch():
+    return apply_transaction_batch("commit")
+
+@auth_bp.route("/api/auth/abort/batch", methods=["POST"])
+def abort_batch():
+    return apply_transaction_batch("abort")
+
+def apply_transaction_batch(kind):
+    transaction_ids = transaction_ids_from_request()
+    if transaction_ids is None:
+        return jsonify({"error": "transaction_ids must be a list of strings"}), 400
+    if len(transaction_ids) > two_phase.MAX_BATCH_IDS:
+        return jsonify({"error": f"At most {two_phase.MAX_BATCH_IDS} transactions per request"}), 400
+
+    try:
+        statuses = two_phase.apply_batch([(kind, t, None) for t in transaction_ids])
+    except two_phase.InvalidOperation as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    return jsonify({"results": dict(zip(transaction_ids, statuses))}), 200
+
+def insert_users(rows):
+    # INSERT ... ON CONFLICT DO NOTHING; returns {email: id} for the rows that went in
+    dialect_insert = postgresql.insert if db.engine.dialect.name == 'postgresql' else sqlite.insert
+    statement = dialect_insert(User).values(rows).on_conflict_do_nothing().returning(User.id, User.email)
+    return {row.email: row.id for row in db.session.execute(statement)}
+
+def taken_fields(rows):
+    # (usernames, emails) of the given rows that already belong to a user
+    usernames = [row['username'] for row in rows]
+    emails = [row['email'] for row in rows]
+    taken = db.session.execute(
+        select(User.username, User.email).where(or_(User.username.in_(usernames), User.email.in_(emails)))
+    ).all()
+    return {username for username, _ in taken}, {email for _, email in taken}
+
+def conflict_message(row, taken_usernames, taken_emails):
+    if row['username'] in taken_usernames:
+        return 'Username already exists'
+    if row['email'] in taken_emails:
+        return 'Email already exists'
+    return 'User already exists'
+
+def validate_user(username, email, password):
+    if not isinstance(username, str) or not username or not isinstance(email, str) or not email:
+        return 'Username and email are required'
+    if not isinstance(password, str) or not password:
+        return 'Password is required'
+    return None
+
 # Register a user
 @auth_bp.route('/api/auth/register', methods=['POST'])
 @limiter.limit("5 per minute")
+@concurrency_limiter.limit("write")
 def register():
+    data = request.get_json()
+    username = data.get('username')
+    email = data.get('email')
+    password = data.get('password') 
+
+    error = validate_user(username, email, password)
+    if error:
+        return jsonify({'message': error}), 400
+
+    row = {'username': username, 'email': email, 'password': password_hasher.hash(password)}
+    # One statement, so concurrent registrations cannot both pass a check and then
+    # collide; the unique constraints decide
+    if db.engine.dialect.name == 'postgresql':
+        result = db.session.execute(REGISTER_SQL, row).one()
+        user_id = result.id
+        taken_usernames = {username} if result.username_taken else set()
+        taken_emails = {email} if result.email_taken else set()
+    else:
+        user_id = insert_users([row]).get(email)
+        taken_usernames, taken_emails = set(), set()
+    if user_id is None and not taken_usernames and not taken_emails:
+        # Lost a race with a registration that committed after our snapshot, or no
+        # single-statement check on this database
+        taken_usernames, taken_emails = taken_fields([row])
+    db.session.commit()
+
+    if user_id is None:
+        return jsonify({'message': conflict_message(row, taken_usernames, taken_emails)}), 400
+    return jsonify({'message': 'User registered successfully'}), 201
+
+def parse_user_rows(stream, content_type, delimiter):
+    # Yields (line_number, user dict or None if the line is malformed) without
+    # reading the whole upload into memory
+    text_stream = text_reader(stream)
+    if content_type in ('application/x-ndjson', 'application/jsonl', 'application/json-lines'):
+        for line_number, line in enumerate(text_stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                user = json.loads(line)
+            except ValueError:
+                user = None
+            yield line_number, user if isinstance(user, dict) else None
+    else:
+        for line_number, row in enumerate(csv.reader(text_stream, delimiter=delimiter), start=1):
+            if not row:
+                continue
+            # Skip an optional header row
+            if line_number == 1 and [col.strip().lower() for col in row[:3]] == ['username', 'email', 'password']:
+                continue
+            yield line_number, dict(zip(('username', 'email', 'password'), row)) if len(row) >= 3 else None
+
+def provision_batch(batch):
+    # batch is [(line_number, user, error)]; yields one result per line, in order
+    results = {}
+    rows = []
+    seen_usernames, seen_emails = set(), set()
+    for line_number, user, error in batch:
+        if error:
+            results[line_number] = {"line": line_number, "status": "invalid", "message": error}
+            continue
+        if user['username'] in seen_usernames or user['email'] in seen_emails:
+            results[line_number] = {"line": line_number, "status": "conflict", "message": "Duplicate in upload"}
+            continue
+        seen_usernames.add(user['username'])
+        seen_emails.add(user['email'])
+        rows.append((line_number, user))
+
+    hashes = password_hasher.hash_many([user['password'] for _, user in rows])
+    values = [{'username': user['username'], 'email': user['email'], 'password': password_hash}
+              for (_, user), password_hash in zip(rows, hashes)]
+    inserted = insert_users(values) if values else {}
+    rejected = [row for row in values if row['email'] not in inserted]
+    taken_usernames, taken_emails = taken_fields(rejected) if rejected else (set(), set())
+    db.session.commit()
+
+    for (line_number, _), row in zip(rows, values):
+        if row['email'] in inserted:
+            results[line_number] = {"line": line_number, "status": "created", "id": inserted[row['email']]}
+        else:
+            results[line_number] = {"line": line_number, "status": "conflict",
+                                    "message": conflict_message(row, taken_usernames, taken_emails)}
+    for line_number, _, _ in batch:
+        yield results[line_number]
+
+# Create many users from a CSV (username,email,password) or JSON-lines upload.
+# Streams one NDJSON result per input line, then a summary line.
+@auth_bp.route('/api/auth/users/bulk', methods=['POST'])
+@limiter.limit("5 per minute")
+@jwt_required()
+def provision_users():
+    # Like other bulk work, holds a bulk-class slot until the stream is done
     try:
-        semaphore.acquire()
-        data = request.get_json()
-        username = data.get('username')
-        email = data.get('email')
-        password = data.get('password') 
-
-        # data = request.get_json()
-        # if data.get("email") == "test500error@example.com":
-        #     raise Exception("Simulated server error for testing")
-        # Check if username or email already exists
-        if User.query.filter_by(username=username).first():
-            return jsonify({'message': 'Username already exists'}), 400
-        if User.query.filter_by(email=email).first():
-            return jsonify({'message': 'Email already exists'}), 400
-
-        # Create new user
-        new_user = User(username=username, email=email, password=password)
-        db.session.add(new_user)
-        db.session.commit()
-
-        return jsonify({'message': 'User registered successfully'}), 201
-    finally:
-        semaphore.release() 
+        token = concurrency_limiter.acquire('bulk', blocking=False)
+    except Overloaded:
+        return jsonify({"error": "Too many bulk jobs in progress, try again later"}), 503
+
+    upload = request.files.get('file')
+    if upload:
+        stream, content_type = upload.stream, upload.mimetype
+    else:
+        stream, content_type = request.stream, request.mimetype
+    delimiter = '\t' if content_type == 'text/tab-separated-values' else request.args.get('delimiter', ',')
+
+    def generate():
+        counts = {"created": 0, "conflict": 0, "invalid": 0}
+        batch = []
+
+        def flush():
+            for result in provision_batch(batch):
+                counts[result["status"]] += 1
+                yield json.dumps(result) + "\n"
+            batch.clear()
+
+        try:
+            for line_number, user in parse_user_rows(stream, content_type, delimiter):
+                error = 'Malformed line' if user is None else validate_user(
+                    user.get('username'), user.get('email'), user.get('password'))
+                batch.append((line_number, user, error))
+                if len(batch) >= PROVISION_BATCH_SIZE:
+                    yield from flush()
+            if batch:
+                yield from flush()
+        except (csv.Error, UnicodeDecodeError) as e:
+            db.session.rollback()
+            yield json.dumps({"error": f"Could not parse upload: {e}"}) + "\n"
+        finally:
+            db.session.close()
+        yield json.dumps({"summary": counts}) + "\n"
+
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.call_on_close(lambda: concurrency_limiter.release(token))
+    return response, 200
 
 # Log in a user
 @auth_bp.route('/api/auth/login', methods=['POST'])
 @limiter.limit("5 per minute")
+@concurrency_limiter.limit("read")
 def login():
-    try:
-        semaphore.acquire()
-        data = request.get_json()
-        email = data.get('email')
-        password = data.get('password')
+    data = request.get_json()
+    email = data.get('email')
+    password = data.get('password')
 
-        user = User.query.filter_by(email=email).first()
+    if not isinstance(password, str):
+        return jsonify({'message': 'Invalid email or password'}), 401
 
-        if user and user.password == password:
-            # Create JWT token
-            access_token = create_access_token(identity=user.id)
-            return jsonify({'message': 'Login successful', 'access_token': access_token, 'user': user.username}), 200
-        else:
-            return jsonify({'message': 'Invalid email or password'}), 401
-    finally:
-        semaphore.release()
+    user = User.query.filter_by(email=email).first()
+    matches, new_hash = password_hasher.verify(password, user.password if user else None)
+
+    if matches:
+        if new_hash:
+            # Cost parameters changed (or the password predates hashing): upgrade it now
+            user.password = new_hash
+            db.session.commit()
+        # Create JWT token
+        access_token = create_access_token(identity=user.id)
+        return jsonify({'message': 'Login successful', 'access_token': access_token, 'user': user.username}), 200
+    else:
+        return jsonify({'message': 'Invalid email or password'}), 401
 
-# Log out a user (dummy route, no JWT revocation here)
+# Log out a user: the token is revoked in both services until it expires
 @auth_bp.route('/api/auth/logout', methods=['POST'])
 @limiter.limit("5 per minute")
 @jwt_required()
+@concurrency_limiter.limit("read")
 def logout():
-    try:
-        semaphore.acquire()
-        return jsonify({'message': 'User logged out'}), 200
-    finally:
-        semaphore.release()
+    denylist.revoke(get_jwt())
+    return jsonify({'message': 'User logged out'}), 200
 
 # Status endpoint
 @auth_bp.route('/api/auth/status', methods=['GET'])
 @limiter.limit("5 per minute")
+@concurrency_limiter.limit("critical")
 def status():
     try:
-        semaphore.acquire()
-        try:
-            # time.sleep(4)
-            db.session.execute(text('SELECT 1'))  
-            return jsonify({'servise': 'auth','status': 'running'}), 200
-        except Exception as e:
-            return jsonify({'status': 'ERROR', 'database': 'Not connected', 'error': str(e)}), 500
-    finally:
-        semaphore.release()
-
-# Get all users
+        # time.sleep(4)
+        db.session.execute(text('SELECT 1'))  
+        return jsonify({'servise': 'auth','status': 'running'}), 200
+    except Exception as e:
+        return jsonify({'status': 'ERROR', 'database': 'Not connected', 'error': str(e)}), 500
+
+# Get a page of users, ordered by id (keyset pagination). The body stays a
+# plain list; the cursor for the next page is in the X-Next-Cursor header.
 @auth_bp.route('/api/auth/users', methods=['GET'])
 @limiter.limit("5 per minute")
+@concurrency_limiter.limit("read")
+@read_only
 def get_all_users():
-    try:
-        semaphore.acquire()
-        users = User.query.all()
-        user_list = [{'id': user.id, 'username': user.username, 'email': user.email} for user in users]
-        return jsonify(user_list), 200
-    finally:
-        semaphore.release()
+    cursor = request.args.get('cursor', type=int)
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    query = select(User.id, User.username, User.email).order_by(User.id)
+    if cursor is not None:
+        query = query.where(User.id > cursor)
+    # Fetch one extra row to know whether there is a next page
+    users = db.session.execute(query.limit(limit + 1)).all()
+
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = users[-1].id
+
+    user_list = [{'id': user.id, 'username': user.username, 'email': user.email} for user in users]
+    response = jsonify(user_list)
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+    return response, 200
+
+# Resolve many user ids to usernames in one call, e.g. the creators of a page of sets
+@auth_bp.route('/api/auth/users/batch', methods=['POST'])
+@limiter.limit("5 per minute")
+@concurrency_limiter.limit("read")
+def get_usernames_batch():
+    data = request.get_json(silent=True) or {}
+    requested = data.get('ids')
+    if not isinstance(requested, list) or not all(isinstance(user_id, int) for user_id in requested):
+        return jsonify({"error": "ids must be a list of integers"}), 400
+    if len(requested) > MAX_BATCH_IDS:
+        return jsonify({"error": f"At most {MAX_BATCH_IDS} ids per request"}), 400
+
+    def load_usernames(missing_ids):
+        rows = db.session.execute(select(User.id, User.username).where(User.id.in_(missing_ids)))
+        return {row.id: row.username for row in rows}
+
+    unique_ids = list(dict.fromkeys(requested))
+    usernames = username_cache.get_many(unique_ids, load_usernames)
+    return jsonify({
+        "usernames": {str(user_id): usernames[user_id] for user_id in unique_ids if user_id in usernames},
+        "notFound": [user_id for user_id in unique_ids if user_id not in usernames]
+    }), 200
 
 # Update a user
 @auth_bp.route('/api/auth/users/<int:id>', methods=['PUT'])
 @limiter.limit("5 per minute")
 @jwt_required()
+@concurrency_limiter.limit("write")
 def update_user(id):
-    try:
-        semaphore.acquire()
-        data = request.get_json()
-        user = User.query.get(id)
-
-        if not user:
-            return jsonify({'message': 'User not found'}), 404
-
-        if 'username' in data:
-            user.username = data['username']
-        if 'email' in data:
-            user.email = data['email']
-        if 'password' in data:
-            user.password = data['password']  # In a real-world app, hash this
-
-        db.session.commit()
-        return jsonify({'message': 'User updated successfully'}), 200
-    finally:
-        semaphore.release()
+    data = request.get_json()
+    user = User.query.get(id)
+
+    if not user:
+        return jsonify({'message': 'User not found'}), 404
+
+    if 'username' in data:
+        user.username = data['username']
+    if 'email' in data:
+        user.email = data['email']
+    if 'password' in data:
+        if not isinstance(data['password'], str) or not data['password']:
+            return jsonify({'message': 'Password is required'}), 400
+        user.password = password_hasher.hash(data['password'])
+
+    db.session.commit()
+    # After the commit, so a reload can't put the old name back
+    username_cache.invalidate(id)
+    return jsonify({'message': 'User updated successfully'}), 200
 
 
 
@@ -0,0 +1,127 @@
+import os
+import time
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+from prometheus_client import Counter, Gauge, Histogram
+
+# Statements slower than this are printed, with their parameters redacted
+SLOW_QUERY_MS = int(os.getenv("DB_SLOW_QUERY_MS", 500))
+
+REQUEST_QUERIES = Histogram('sql_queries_per_request', 'SQL statements run while handling a request',
+                            ['endpoint'], buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 200))
+REQUEST_SQL_SECONDS = Histogram('sql_seconds_per_request', 'Time spent in SQL statements while handling a request',
+                                ['endpoint'])
+SLOW_QUERIES = Counter('sql_slow_queries_total', 'Statements slower than DB_SLOW_QUERY_MS', ['endpoint'])
+POOL_SIZE = Gauge('db_pool_size', 'Connections the pool keeps open', ['engine'])
+POOL_CHECKED_OUT = Gauge('db_pool_checked_out', 'Connections in use', ['engine'])
+POOL_OVERFLOW = Gauge('db_pool_overflow', 'Connections open beyond pool_size', ['engine'])
+POOL_CHECKOUTS = Counter('db_pool_checkouts_total', 'Connections taken from the pool', ['engine'])
+POOL_WAIT = Histogram('db_pool_wait_seconds', 'Time to get a connection from the pool, including opening one',
+                      ['engine'], buckets=(.0005, .001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30))
+
+
+class TimedQueuePool(QueuePool):
+    # QueuePool that records how long each checkout waits for a connection
+    # and updates the pool gauges whenever a connection leaves or returns
+    name = 'default'
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_WAIT.labels(engine=self.name).observe(time.perf_counter() - start)
+            self.update_gauges()
+
+    def _do_return_conn(self, record):
+        super()._do_return_conn(record)
+        self.update_gauges()
+
+    def recreate(self):
+        # engine.dispose() replaces the pool; keep reporting under the same name
+        pool = super().recreate()
+        pool.name = self.name
+        return pool
+
+    def update_gauges(self):
+        POOL_SIZE.labels(engine=self.name).set(self.size())
+        POOL_CHECKED_OUT.labels(engine=self.name).set(self.checkedout())
+        POOL_OVERFLOW.labels(engine=self.name).set(max(0, self.overflow()))
+
+
+def engine_options():
+    # SQLALCHEMY_ENGINE_OPTIONS from DB_* environment variables (Postgres)
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_size': int(os.getenv("DB_POOL_SIZE", 5)),
+        'max_overflow': int(os.getenv("DB_MAX_OVERFLOW", 10)),
+        'pool_timeout': int(os.getenv("DB_POOL_TIMEOUT", 30)),
+        # Reconnect before Postgres or a proxy drops idle connections
+        'pool_recycle': int(os.getenv("DB_POOL_RECYCLE", 1800)),
+        'pool_pre_ping': os.getenv("DB_POOL_PRE_PING", "1") != "0",
+    }
+    statement_timeout = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 0))
+    if statement_timeout:
+        options['connect_args'] = {'options': f"-c statement_timeout={statement_timeout}"}
+    return options
+
+
+def redact(parameters):
+    # Keeps the shape (names, row count) and drops the values
+    if isinstance(parameters, dict):
+        return {name: '?' for name in parameters}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            return f"<{len(parameters)} rows of {redact(parameters[0])}>"
+        return ['?'] * len(parameters)
+    return '?'
+
+
+def current_endpoint():
+    return request.endpoint or 'unmatched'
+
+
+class SqlMetrics:
+    # Counts and times the SQL statements behind each request, labelled by
+    # the Flask endpoint (blueprint.view). Pool gauges come from TimedQueuePool.
+    # Statements outside a request (background jobs) are only checked for
+    # slowness.
+
+    def __init__(self, slow_query_ms=SLOW_QUERY_MS):
+        self.slow_query_ms = slow_query_ms
+
+    def init_app(self, app, db):
+        with app.app_context():
+            for bind, engine in db.engines.items():
+                self.instrument(engine, bind or 'default')
+        app.teardown_request(self._observe_request)
+
+    def instrument(self, engine, name):
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        pool = engine.pool
+        if isinstance(pool, TimedQueuePool):
+            pool.name = name
+            pool.update_gauges()
+        event.listen(pool, 'checkout', lambda *args: POOL_CHECKOUTS.labels(engine=name).inc())
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context._sql_metrics_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._sql_metrics_start
+        in_request = has_request_context()
+        if in_request:
+            g.sql_queries = g.get('sql_queries', 0) + 1
+            g.sql_seconds = g.get('sql_seconds', 0.0) + elapsed
+        if elapsed * 1000 >= self.slow_query_ms:
+            endpoint = current_endpoint() if in_request else 'background'
+            SLOW_QUERIES.labels(endpoint=endpoint).inc()
+            print(f"Slow query ({elapsed * 1000:.0f} ms, {endpoint}): {' '.join(statement.split())} "
+                  f"params={redact(parameters)}")
+
+    def _observe_request(self, exc):
+        endpoint = current_endpoint()
+        REQUEST_QUERIES.labels(endpoint=endpoint).observe(g.get('sql_queries', 0))
+        REQUEST_SQL_SECONDS.labels(endpoint=endpoint).observe(g.get('sql_seconds', 0.0))
@@ -1,8 +1,28 @@
+import io
 import pytest
-from flask import Flask
-from flask_jwt_extended import JWTManager
+from flask import Flask, Request
+from flask_jwt_extended import JWTManager, create_access_token
 from db import db
+import routes
 from routes import auth_bp
+from models.user import User
+from passwords import PasswordHasher, QUEUE_PER_WORKER, verify_password
+from revocation import TokenDenylist
+from username_cache import UsernameCache
+import two_phase
+from two_phase import GroupCommitter
+from maintenance import TransactionMaintenance, utc_now
+from models.transaction import Transaction, TransactionArchive
+from sql_metrics import SqlMetrics, redact
+from read_replicas import ReplicaRouter, postgres_lag
+from profiling import RequestProfiler, statement_shape
+from prometheus_client import REGISTRY
+from sqlalchemy import update
+from datetime import timedelta
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Define a test configuration for the Flask app
 @pytest.fixture
@@ -176,3 +196,544 @@ def test_update_user(client):
     assert users[0]['username'] == 'updateduser'
     assert users[0]['email'] == 'updateduser@example.com'
 
+def register_and_login(client, password='password123'):
+    client.post('/api/auth/register', json={
+        'username': 'testuser',
+        'email': 'testuser@example.com',
+        'password': password
+    })
+    return client.post('/api/auth/login', json={'email': 'testuser@example.com', 'password': password})
+
+def stored_password(app):
+    with app.app_context():
+        return db.session.get(User, 1).password
+
+def test_passwords_are_stored_hashed(app, client):
+    assert register_and_login(client).status_code == 200
+    stored = stored_password(app)
+    assert stored.startswith('scrypt$')
+    assert 'password123' not in stored
+
+def test_login_rehashes_when_cost_changes(app, client, monkeypatch):
+    monkeypatch.setattr(routes, 'password_hasher', PasswordHasher(workers=0, n=2 ** 10))
+    register_and_login(client)
+    assert stored_password(app).startswith('scrypt$1024$')
+
+    monkeypatch.setattr(routes, 'password_hasher', PasswordHasher(workers=0, n=2 ** 11))
+    response = client.post('/api/auth/login', json={'email': 'testuser@example.com', 'password': 'password123'})
+    assert response.status_code == 200
+    assert stored_password(app).startswith('scrypt$2048$')
+
+def test_login_upgrades_plaintext_password(app, client, monkeypatch):
+    monkeypatch.setattr(routes, 'password_hasher', PasswordHasher(workers=0, n=2 ** 10))
+    with app.app_context():
+        db.session.add(User(username='legacy', email='legacy@example.com', password='password123'))
+        db.session.commit()
+
+    response = client.post('/api/auth/login', json={'email': 'legacy@example.com', 'password': 'wrongpassword'})
+    assert response.status_code == 401
+    assert stored_password(app) == 'password123'
+
+    response = client.post('/api/auth/login', json={'email': 'legacy@example.com', 'password': 'password123'})
+    assert response.status_code == 200
+    assert stored_password(app).startswith('scrypt$1024$')
+
+def test_logout_revokes_token(app, client, monkeypatch):
+    denylist = TokenDenylist()
+    monkeypatch.setattr(routes, 'denylist', denylist)
+    denylist.init_app(app.extensions['flask-jwt-extended'])
+    access_token = register_and_login(client).get_json()['access_token']
+    headers = {'Authorization': f'Bearer {access_token}'}
+
+    assert client.post('/api/auth/logout', headers=headers).status_code == 200
+    response = client.put('/api/auth/users/1', json={'username': 'other'}, headers=headers)
+    assert response.status_code == 401
+
+    # A fresh login gets a new token that is not revoked
+    access_token = client.post('/api/auth/login', json={
+        'email': 'testuser@example.com', 'password': 'password123'
+    }).get_json()['access_token']
+    assert client.post('/api/auth/logout', headers={'Authorization': f'Bearer {access_token}'}).status_code == 200
+
+def test_denylist_forgets_expired_tokens():
+    denylist = TokenDenylist(sweep_interval=0)
+    denylist.revoke({'jti': 'live', 'exp': time.time() + 60})
+    denylist.revoke({'jti': 'expired', 'exp': time.time() - 1})
+    denylist._add('expiring', time.time() + 0.01)
+    time.sleep(0.02)
+    assert denylist.is_revoked('live')
+    assert not denylist.is_revoked('expired')
+    assert not denylist.is_revoked('expiring')
+    assert set(denylist._revoked) == {'live'}
+
+class UnsyncedRedis:
+    # Holds revocations made by other replicas; the pub/sub connection never
+    # comes up, so the denylist's first resync never finishes
+    def __init__(self, data):
+        self.data = data
+        self.gets = 0
+
+    def get(self, key):
+        self.gets += 1
+        return self.data.get(key)
+
+    def pubsub(self, **kwargs):
+        threading.Event().wait()
+
+def test_denylist_checks_redis_until_its_first_resync():
+    fake_redis = UnsyncedRedis({'revoked_jti:old': str(time.time() + 60).encode()})
+    denylist = TokenDenylist(fake_redis)
+    assert denylist.is_revoked('old')
+    assert not denylist.is_revoked('other')
+    # Found once, the revocation is kept locally
+    assert denylist.is_revoked('old') and fake_redis.gets == 2
+
+    denylist._synced.set()
+    assert not denylist.is_revoked('another') and fake_redis.gets == 2
+
+class CountingExecutor(ThreadPoolExecutor):
+    # Records the most hashes that were submitted and not yet finished at once
+    def __init__(self, workers):
+        super().__init__(workers)
+        self.outstanding = self.most_outstanding = 0
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            self.outstanding += 1
+            self.most_outstanding = max(self.most_outstanding, self.outstanding)
+        future = super().submit(fn, *args, **kwargs)
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, future):
+        with self._lock:
+            self.outstanding -= 1
+
+def test_hash_many_leaves_slots_for_interactive_hashing(monkeypatch):
+    hasher = PasswordHasher(workers=2, n=2 ** 10)
+    executor = CountingExecutor(2)
+    monkeypatch.setattr(hasher, '_executor', lambda: executor)
+
+    hashes = hasher.hash_many([f'pw{i}' for i in range(20)])
+    assert len(hashes) == 20 and verify_password('pw7', hashes[7], n=2 ** 10) == (True, None)
+    # One bulk hash per worker at most; the rest of the queue stays free for logins
+    assert executor.most_outstanding <= hasher.workers
+    executor.shutdown()
+    assert hasher._slots._value == hasher.workers * QUEUE_PER_WORKER
+
+def test_provision_users_streams_results(app, client, monkeypatch):
+    monkeypatch.setattr(routes, 'password_hasher', PasswordHasher(workers=0, n=2 ** 10))
+    access_token = register_and_login(client).get_json()['access_token']
+    upload = "\n".join(json.dumps(user) for user in [
+        {'username': 'alice', 'email': 'alice@example.com', 'password': 'secret1'},
+        {'username': 'testuser', 'email': 'new@example.com', 'password': 'secret2'},
+        {'username': 'bob', 'email': 'bob@example.com', 'password': 'secret3'},
+        {'username': 'bob', 'email': 'bob2@example.com', 'password': 'secret4'},
+        {'username': 'carol', 'email': 'carol@example.com'},
+    ]) + "\nnot json\n"
+
+    response = client.post('/api/auth/users/bulk', data=upload, content_type='application/x-ndjson',
+                           headers={'Authorization': f'Bearer {access_token}'})
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [line.get('status') for line in lines[:-1]] == [
+        'created', 'conflict', 'created', 'conflict', 'invalid', 'invalid'
+    ]
+    assert lines[1]['message'] == 'Username already exists'
+    assert lines[3]['message'] == 'Duplicate in upload'
+    assert lines[-1] == {'summary': {'created': 2, 'conflict': 2, 'invalid': 2}}
+
+    response = client.post('/api/auth/login', json={'email': 'bob@example.com', 'password': 'secret3'})
+    assert response.status_code == 200
+
+def test_provision_users_from_csv(app, client, monkeypatch):
+    monkeypatch.setattr(routes, 'password_hasher', PasswordHasher(workers=0, n=2 ** 10))
+    access_token = register_and_login(client).get_json()['access_token']
+    upload = "username,email,password\n" + "".join(f"user{i},user{i}@example.com,pw{i}\n" for i in range(25))
+    routes.PROVISION_BATCH_SIZE, batch_size = 10, routes.PROVISION_BATCH_SIZE
+    try:
+        response = client.post('/api/auth/users/bulk', data=upload, content_type='text/csv',
+                               headers={'Authorization': f'Bearer {access_token}'})
+    finally:
+        routes.PROVISION_BATCH_SIZE = batch_size
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines[-1] == {'summary': {'created': 25, 'conflict': 0, 'invalid': 0}}
+    assert [line['line'] for line in lines[:-1]] == list(range(2, 27))
+    assert len(client.get('/api/auth/users').get_json()) == 26
+
+class UnreadableSpool:
+    # Like tempfile.SpooledTemporaryFile before Python 3.11, which Werkzeug
+    # spools multipart parts to: no readable(), so io.TextIOWrapper rejects it
+    def __init__(self):
+        self._file = io.BytesIO()
+
+    def write(self, data):
+        return self._file.write(data)
+
+    def seek(self, *args):
+        return self._file.seek(*args)
+
+    def read(self, *args):
+        return self._file.read(*args)
+
+    def readline(self, *args):
+        return self._file.readline(*args)
+
+    def close(self):
+        self._file.close()
+
+def test_provision_users_from_multipart_upload(app, client, monkeypatch):
+    monkeypatch.setattr(routes, 'password_hasher', PasswordHasher(workers=0, n=2 ** 10))
+    monkeypatch.setattr(Request, '_get_file_stream', lambda self, *args, **kwargs: UnreadableSpool())
+    access_token = register_and_login(client).get_json()['access_token']
+    upload = "username,email,password\n" + "".join(f"user{i},user{i}@example.com,pw{i}\n" for i in range(3))
+
+    response = client.post('/api/auth/users/bulk', data={'file': (io.BytesIO(upload.encode()), 'users.csv', 'text/csv')},
+                           content_type='multipart/form-data', headers={'Authorization': f'Bearer {access_token}'})
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines[-1] == {'summary': {'created': 3, 'conflict': 0, 'invalid': 0}}
+
+class DictRedis:
+    # Just enough of the redis client for UsernameCache
+    def __init__(self):
+        self.data = {}
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def setex(self, key, ttl, value):
+        self.data[key] = value
+
+    def execute(self):
+        pass
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+def seed_users(app, count):
+    with app.app_context():
+        for i in range(count):
+            db.session.add(User(username=f'user{i}', email=f'user{i}@example.com', password='x'))
+        db.session.commit()
+
+def test_get_all_users_paginates(app, client):
+    seed_users(app, 7)
+    seen = []
+    cursor = None
+    while True:
+        query = '?limit=3' + (f'&cursor={cursor}' if cursor else '')
+        response = client.get('/api/auth/users' + query)
+        assert response.status_code == 200
+        seen += [user['id'] for user in response.get_json()]
+        cursor = response.headers.get('X-Next-Cursor')
+        if cursor is None:
+            break
+    assert seen == list(range(1, 8))
+
+def test_get_usernames_batch_uses_cache(app, client, monkeypatch):
+    cache = UsernameCache(DictRedis())
+    monkeypatch.setattr(routes, 'username_cache', cache)
+    seed_users(app, 3)
+
+    response = client.post('/api/auth/users/batch', json={'ids': [3, 1, 99, 1]})
+    assert response.status_code == 200
+    assert response.get_json() == {'usernames': {'3': 'user2', '1': 'user0'}, 'notFound': [99]}
+    assert cache.redis.data == {'username:1': 'user0', 'username:3': 'user2'}
+
+    # Served from the projection even if the database disagrees...
+    with app.app_context():
+        db.session.get(User, 1).username = 'renamed-behind-our-back'
+        db.session.commit()
+    assert client.post('/api/auth/users/batch', json={'ids': [1]}).get_json()['usernames'] == {'1': 'user0'}
+
+    # ...until update_user invalidates it
+    with app.app_context():
+        access_token = create_access_token(identity=1)
+    response = client.put('/api/auth/users/1', json={'username': 'renamed'},
+                          headers={'Authorization': f'Bearer {access_token}'})
+    assert response.status_code == 200
+    assert client.post('/api/auth/users/batch', json={'ids': [1]}).get_json()['usernames'] == {'1': 'renamed'}
+
+    assert client.post('/api/auth/users/batch', json={'ids': ['1']}).status_code == 400
+
+def test_two_phase_commit_is_idempotent(client):
+    response = client.post('/api/auth/prepare', json={'transaction_id': 't1', 'data': {'x': 1}})
+    assert response.get_json() == {'transaction_id': 't1', 'status': 'prepared'}
+    assert client.post('/api/auth/prepare', json={'transaction_id': 't1'}).get_json()['status'] == 'prepared'
+
+    assert client.post('/api/auth/commit', json={'transaction_id': 't1'}).get_json() == {'status': 'committed'}
+    assert client.post('/api/auth/commit', json={'transaction_id': 't1'}).status_code == 200
+    assert client.post('/api/auth/prepare', json={'transaction_id': 't1'}).get_json()['status'] == 'committed'
+    assert client.post('/api/auth/abort', json={'transaction_id': 't1'}).status_code == 409
+    assert client.post('/api/auth/commit', json={'transaction_id': 'missing'}).status_code == 404
+
+    client.post('/api/auth/prepare', json={'transaction_id': 't2'})
+    assert client.post('/api/auth/abort', json={'transaction_id': 't2'}).get_json() == {'status': 'aborted and deleted'}
+    assert client.post('/api/auth/abort', json={'transaction_id': 't2'}).status_code == 404
+
+def test_two_phase_commit_batches(client):
+    response = client.post('/api/auth/prepare/batch', json={'transactions': [
+        {'transaction_id': f't{i}', 'data': {'i': i}} for i in range(5)
+    ]})
+    assert response.get_json()['results'] == {f't{i}': 'prepared' for i in range(5)}
+
+    response = client.post('/api/auth/commit/batch', json={'transaction_ids': ['t0', 't1', 't1', 'nope']})
+    assert response.get_json()['results'] == {'t0': 'committed', 't1': 'committed', 'nope': 'not_found'}
+
+    response = client.post('/api/auth/abort/batch', json={'transaction_ids': ['t0', 't2', 't3']})
+    assert response.get_json()['results'] == {'t0': 'committed', 't2': 'aborted', 't3': 'aborted'}
+
+    response = client.post('/api/auth/commit/batch', json={'transaction_ids': ['t2', 't4']})
+    assert response.get_json()['results'] == {'t2': 'not_found', 't4': 'committed'}
+    assert client.post('/api/auth/commit/batch', json={'transaction_ids': 't4'}).status_code == 400
+
+def test_group_committer_shares_commits(monkeypatch):
+    batches = []
+    first_batch_started = threading.Event()
+    release_first_batch = threading.Event()
+
+    def fake_apply_batch(operations):
+        batches.append([transaction_id for _, transaction_id, _ in operations])
+        if len(batches) == 1:
+            first_batch_started.set()
+            release_first_batch.wait(5)
+        return ['prepared'] * len(operations)
+
+    monkeypatch.setattr(two_phase, 'apply_batch', fake_apply_batch)
+    committer = GroupCommitter()
+    results = {}
+
+    def submit(transaction_id):
+        results[transaction_id] = committer.submit('prepare', transaction_id)
+
+    leader = threading.Thread(target=submit, args=('leader',))
+    leader.start()
+    first_batch_started.wait(5)
+    # These queue up while the leader's batch is in the database
+    followers = [threading.Thread(target=submit, args=(f't{i}',)) for i in range(10)]
+    for thread in followers:
+        thread.start()
+    while len(committer._queue) < 10:
+        time.sleep(0.001)
+    release_first_batch.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    assert batches[0] == ['leader']
+    assert sorted(batches[1]) == sorted(f't{i}' for i in range(10))
+    assert len(results) == 11 and set(results.values()) == {'prepared'}
+
+def test_group_committer_fails_only_the_bad_operation(monkeypatch):
+    batches = []
+    first_batch_started = threading.Event()
+    release_first_batch = threading.Event()
+
+    def fake_apply_batch(operations):
+        batches.append([transaction_id for _, transaction_id, _ in operations])
+        if len(batches) == 1:
+            first_batch_started.set()
+            release_first_batch.wait(5)
+        if 'bad' in batches[-1]:
+            raise RuntimeError('value too long')
+        return ['prepared'] * len(operations)
+
+    monkeypatch.setattr(two_phase, 'apply_batch', fake_apply_batch)
+    committer = GroupCommitter()
+    results = {}
+
+    def submit(transaction_id):
+        try:
+            results[transaction_id] = committer.submit('prepare', transaction_id)
+        except RuntimeError as e:
+            results[transaction_id] = str(e)
+
+    leader = threading.Thread(target=submit, args=('leader',))
+    leader.start()
+    first_batch_started.wait(5)
+    followers = [threading.Thread(target=submit, args=(t,)) for t in ('t0', 'bad', 't1')]
+    for thread in followers:
+        thread.start()
+    while len(committer._queue) < 3:
+        time.sleep(0.001)
+    release_first_batch.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    # The shared batch failed, so each of its operations was retried on its own
+    assert sorted(batches[1]) == ['bad', 't0', 't1']
+    assert sorted(batches[2:]) == [['bad'], ['t0'], ['t1']]
+    assert results == {'leader': 'prepared', 't0': 'prepared', 't1': 'prepared', 'bad': 'value too long'}
+
+def test_two_phase_rejects_invalid_transaction_ids(app, client):
+    too_long = 'x' * (two_phase.MAX_TRANSACTION_ID_LENGTH + 1)
+    assert client.post('/api/auth/prepare', json={'transaction_id': too_long}).status_code == 400
+    assert client.post('/api/auth/commit', json={'transaction_id': too_long}).status_code == 400
+    response = client.post('/api/auth/prepare/batch', json={'transactions': [
+        {'transaction_id': 't0'}, {'transaction_id': too_long}
+    ]})
+    assert response.status_code == 400
+    assert client.post('/api/auth/abort/batch', json={'transaction_ids': ['t0', too_long]}).status_code == 400
+    with app.app_context():
+        assert db.session.scalars(db.select(Transaction.transaction_id)).all() == []
+    with pytest.raises(two_phase.InvalidOperation):
+        GroupCommitter().submit('prepare', too_long)
+
+def test_two_phase_batch_applies_operations_in_arrival_order(app):
+    with app.app_context():
+        two_phase.apply_batch([('prepare', 'x', None), ('prepare', 'y', None)])
+        # The abort of x was queued first, so the commit after it finds nothing to commit
+        statuses = two_phase.apply_batch([('abort', 'x', None), ('commit', 'x', None), ('commit', 'y', None),
+                                          ('abort', 'y', None)])
+        assert statuses == ['aborted', 'not_found', 'committed', 'committed']
+
+def test_transaction_maintenance_reaps_and_archives(app, client):
+    client.post('/api/auth/prepare/batch', json={'transactions': [
+        {'transaction_id': f't{i}', 'data': {'i': i}} for i in range(8)
+    ]})
+    client.post('/api/auth/commit/batch', json={'transaction_ids': ['t0', 't1', 't2', 't3']})
+    old = utc_now() - timedelta(hours=2)
+    with app.app_context():
+        # t0-t2 committed long ago, t4-t6 prepared long ago; t3 and t7 are recent
+        db.session.execute(update(Transaction).where(Transaction.transaction_id.in_(['t0', 't1', 't2']))
+                           .values(updated_at=old))
+        db.session.execute(update(Transaction).where(Transaction.transaction_id.in_(['t4', 't5', 't6']))
+                           .values(created_at=old))
+        db.session.commit()
+
+    maintenance = TransactionMaintenance(app, prepare_timeout=60, archive_after=60, batch_size=2)
+    assert maintenance.run_once() == {'abort': 3, 'archive': 3}
+    assert maintenance.run_once() == {'abort': 0, 'archive': 0}
+
+    with app.app_context():
+        assert sorted(db.session.scalars(db.select(Transaction.transaction_id))) == ['t3', 't7']
+        archived = db.session.scalars(db.select(TransactionArchive).order_by(TransactionArchive.transaction_id)).all()
+        assert [(t.transaction_id, t.status, t.data) for t in archived] == [
+            ('t0', 'committed', {'i': 0}), ('t1', 'committed', {'i': 1}), ('t2', 'committed', {'i': 2})
+        ]
+
+    # A commit for a transaction that timed out finds nothing to commit
+    assert client.post('/api/auth/commit', json={'transaction_id': 't4'}).status_code == 404
+
+def test_sql_metrics_per_endpoint_and_slow_query_log(app, client, capsys):
+    # Every statement counts as slow here, so each one is logged
+    SqlMetrics(slow_query_ms=0).init_app(app, db)
+    labels = {'endpoint': 'auth.login'}
+    before = REGISTRY.get_sample_value('sql_queries_per_request_count', labels) or 0
+
+    client.post('/api/auth/register', json={'username': 'sql', 'email': 'sql@example.com', 'password': 's3cret'})
+    client.post('/api/auth/login', json={'username': 'sql', 'password': 's3cret'})
+
+    assert REGISTRY.get_sample_value('sql_queries_per_request_count', labels) == before + 1
+    assert REGISTRY.get_sample_value('sql_queries_per_request_sum', labels) > 0
+    logged = capsys.readouterr().out
+    assert 'Slow query' in logged and 'auth.login' in logged
+    assert "'sql'" not in logged and 'sql@example.com' not in logged
+    assert redact({'username': 'sql'}) == {'username': '?'}
+    assert redact([('a', 1), ('b', 2)]) == "<2 rows of ['?', '?']>"
+
+def test_read_only_routes_use_replica_unless_lagging_or_just_written(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'primary.db'}"
+    app.config['SQLALCHEMY_BINDS'] = {'replica': f"sqlite:///{tmp_path / 'replica.db'}"}
+    app.config['JWT_SECRET_KEY'] = 'super-secret'
+    db.init_app(app)
+    JWTManager(app)
+    app.register_blueprint(auth_bp)
+    lag = {'seconds': 0.0}
+    router = ReplicaRouter(max_lag=5, sticky_seconds=60, lag_probe=lambda engine: lag['seconds'])
+    router.init_app(app, db)
+    with app.app_context():
+        db.create_all()
+        db.metadata.create_all(db.engines['replica'])
+        # The replica hasn't caught up with this user yet
+        db.session.add(User(username='on_primary', email='p@example.com', password='x'))
+        db.session.commit()
+    client = app.test_client()
+
+    def usernames():
+        return [user['username'] for user in client.get('/api/auth/users').get_json()]
+
+    router.check_lag()
+    assert usernames() == []
+
+    lag['seconds'] = 30
+    router.check_lag()
+    assert usernames() == ['on_primary']
+
+    lag['seconds'] = 0
+    router.check_lag()
+    client.post('/api/auth/register', json={'username': 'writer', 'email': 'w@example.com', 'password': 'pw'})
+    # The client that just wrote reads its own write from the primary
+    assert usernames() == ['on_primary', 'writer']
+    assert client.get('/api/auth/users', headers={'X-Forwarded-For': '10.9.9.9'}).get_json() == []
+    # init_app gave db a metadata for the bind; other tests' apps don't configure it
+    del db.metadatas['replica']
+
+class StandbyEngine:
+    # Answers the lag query with a fixed value, as a Postgres standby would
+    class dialect:
+        name = 'postgresql'
+
+    def __init__(self, lag):
+        self.lag = lag
+
+    def connect(self):
+        engine = self
+
+        class Connection:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, statement):
+                return type('Result', (), {'scalar': lambda result: engine.lag})()
+        return Connection()
+
+def test_postgres_lag_treats_a_disconnected_standby_as_unhealthy():
+    assert postgres_lag(StandbyEngine(1.5)) == 1.5
+    # No streaming WAL receiver: the query returns NULL
+    assert postgres_lag(StandbyEngine(None)) == float('inf')
+    router = ReplicaRouter(max_lag=5, lag_probe=postgres_lag)
+    router.replicas = {'replica_0': StandbyEngine(None)}
+    router.check_lag()
+    assert router._healthy == []
+
+def test_profiler_runs_for_requests_with_the_token(app, client, tmp_path, capsys):
+    RequestProfiler(token='let-me-in', profile_dir=str(tmp_path), interval_ms=1).init_app(app, db)
+    client.post('/api/auth/register', json={'username': 'p', 'email': 'p@example.com', 'password': 'password123'})
+    labels = {'endpoint': 'auth.login', 'trigger': 'header'}
+    before = REGISTRY.get_sample_value('profiled_requests_total', labels) or 0
+
+    # Without the token (or with a wrong one) nothing is profiled
+    for headers in ({}, {'X-Profile': 'guess'}):
+        response = client.post('/api/auth/login', json={'email': 'p@example.com', 'password': 'password123'},
+                               headers=headers)
+        assert 'X-Profile-Id' not in response.headers
+    assert list(tmp_path.iterdir()) == []
+
+    response = client.post('/api/auth/login', json={'email': 'p@example.com', 'password': 'password123'},
+                           headers={'X-Profile': 'let-me-in'})
+    assert response.status_code == 200
+    profile_id = response.headers['X-Profile-Id']
+    assert REGISTRY.get_sample_value('profiled_requests_total', labels) == before + 1
+    assert sorted(p.suffix for p in tmp_path.iterdir() if profile_id in p.name) == ['.collapsed', '.sql']
+    assert "Profiled auth.login (header" in capsys.readouterr().out
+
+    # Collapsed stacks start at the request's wsgi_app; scrypt keeps the request busy long enough to sample
+    collapsed = next(tmp_path.glob(f"*{profile_id}.collapsed")).read_text()
+    stacks = [line.rsplit(' ', 1) for line in collapsed.splitlines()]
+    assert stacks and all(stack.startswith('wsgi_app (app.py:') for stack, count in stacks)
+    assert 'FROM users WHERE users.email = ?' in next(tmp_path.glob(f"*{profile_id}.sql")).read_text()
+
+def test_statement_shape_ignores_literals_and_list_lengths():
+    assert statement_shape("SELECT * FROM users\n WHERE id IN (?, ?, ?) AND name = 'x'") == \
+        "SELECT * FROM users WHERE id IN (?, ...) AND name = ?"
+    assert statement_shape("SELECT * FROM users WHERE id = %(id_1)s LIMIT 10") == \
+        "SELECT * FROM users WHERE id = ? LIMIT ?"
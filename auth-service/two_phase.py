@@ -0,0 +1,217 @@
+import threading
+from sqlalchemy import select, update, delete
+from sqlalchemy.dialects import postgresql, sqlite
+from db import db
+from models.transaction import Transaction
+from concurrency import new_event
+
+# Participant side of two-phase commit. Every function takes many transaction
+# ids, runs a constant number of statements, and returns {transaction_id: status}
+# where status is 'prepared', 'committed', 'aborted' or 'not_found'. Repeating
+# a call returns the state the transaction is already in. None of them commit;
+# the caller decides what goes into one database transaction.
+
+MAX_BATCH_IDS = 1000
+# transactions.transaction_id is VARCHAR(36) in the init scripts
+MAX_TRANSACTION_ID_LENGTH = 36
+KINDS = ('prepare', 'commit', 'abort')
+
+
+class InvalidOperation(ValueError):
+    pass
+
+
+def validate(kind, transaction_id):
+    # Raises InvalidOperation for anything the database would reject
+    if kind not in KINDS:
+        raise InvalidOperation(f"unknown operation {kind!r}")
+    if not isinstance(transaction_id, str) or not transaction_id:
+        raise InvalidOperation("transaction_id is required")
+    if len(transaction_id) > MAX_TRANSACTION_ID_LENGTH:
+        raise InvalidOperation(f"transaction_id is longer than {MAX_TRANSACTION_ID_LENGTH} characters")
+
+
+def _existing_statuses(transaction_ids):
+    if not transaction_ids:
+        return {}
+    rows = db.session.execute(
+        select(Transaction.transaction_id, Transaction.status)
+        .where(Transaction.transaction_id.in_(transaction_ids))
+    )
+    return {row.transaction_id: row.status for row in rows}
+
+
+def _resolve(transaction_ids, changed, status):
+    results = {transaction_id: status for transaction_id in changed}
+    existing = _existing_statuses([t for t in transaction_ids if t not in results])
+    for transaction_id in transaction_ids:
+        results.setdefault(transaction_id, existing.get(transaction_id, 'not_found'))
+    return results
+
+
+def prepare_many(transactions):
+    # transactions: {transaction_id: data}
+    if not transactions:
+        return {}
+    dialect_insert = postgresql.insert if db.engine.dialect.name == 'postgresql' else sqlite.insert
+    inserted = db.session.scalars(
+        dialect_insert(Transaction)
+        .values([{"transaction_id": t, "status": "prepared", "data": data} for t, data in transactions.items()])
+        .on_conflict_do_nothing()
+        .returning(Transaction.transaction_id)
+    ).all()
+    return _resolve(list(transactions), set(inserted), 'prepared')
+
+
+def commit_many(transaction_ids):
+    if not transaction_ids:
+        return {}
+    committed = db.session.scalars(
+        update(Transaction)
+        .where(Transaction.transaction_id.in_(transaction_ids), Transaction.status == 'prepared')
+        .values(status='committed')
+        .returning(Transaction.transaction_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    return _resolve(transaction_ids, set(committed), 'committed')
+
+
+def abort_many(transaction_ids):
+    # Aborted transactions are deleted in the same statement; committed ones
+    # are left alone
+    if not transaction_ids:
+        return {}
+    aborted = db.session.scalars(
+        delete(Transaction)
+        .where(Transaction.transaction_id.in_(transaction_ids), Transaction.status != 'committed')
+        .returning(Transaction.transaction_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    return _resolve(transaction_ids, set(aborted), 'aborted')
+
+
+def _segments(operations):
+    # Consecutive runs in which no transaction id repeats. Applied one after
+    # the other, they take effect in arrival order for every id (an abort
+    # queued before a commit of the same id wins), in one set of statements
+    # per run; a batch without repeated ids is a single run.
+    segment, seen = [], set()
+    for operation in operations:
+        if operation[1] in seen:
+            yield segment
+            segment, seen = [], set()
+        segment.append(operation)
+        seen.add(operation[1])
+    if segment:
+        yield segment
+
+
+def _apply_segment(operations):
+    prepares, commits, aborts = {}, [], []
+    for kind, transaction_id, data in operations:
+        if kind == 'prepare':
+            prepares[transaction_id] = data
+        elif kind == 'commit':
+            commits.append(transaction_id)
+        else:
+            aborts.append(transaction_id)
+    results = {
+        'prepare': prepare_many(prepares),
+        'commit': commit_many(commits),
+        'abort': abort_many(aborts),
+    }
+    return [results[kind][transaction_id] for kind, transaction_id, _ in operations]
+
+
+def apply_batch(operations):
+    # operations: [(kind, transaction_id, data)] -> one status per operation,
+    # all applied in a single database transaction. Raises InvalidOperation,
+    # before touching the database, if any of them is invalid.
+    for kind, transaction_id, _ in operations:
+        validate(kind, transaction_id)
+    try:
+        statuses = [status for segment in _segments(operations) for status in _apply_segment(segment)]
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return statuses
+
+
+class _Operation:
+    def __init__(self, kind, transaction_id, data):
+        self.kind = kind
+        self.transaction_id = transaction_id
+        self.data = data
+        self.event = new_event()
+        self.status = None
+        self.error = None
+        self.promoted = False
+
+
+class GroupCommitter:
+    # Lets concurrent single-transaction calls share one database commit.
+    # The first caller to find nobody committing becomes the leader: it takes
+    # everything queued so far (up to max_batch), applies it with apply_batch
+    # and wakes the callers with their results. If more work queued up in the
+    # meantime, the oldest waiting caller is promoted to lead the next batch.
+    # Under light load every batch holds one operation and nobody waits.
+
+    def __init__(self, max_batch=500):
+        self.max_batch = max_batch
+        self._queue = []
+        self._leading = False
+        self._lock = threading.Lock()
+
+    def submit(self, kind, transaction_id, data=None):
+        # Invalid operations are refused here, before they can fail a shared batch
+        validate(kind, transaction_id)
+        operation = _Operation(kind, transaction_id, data)
+        with self._lock:
+            self._queue.append(operation)
+            lead = not self._leading
+            self._leading = True
+        if not lead:
+            operation.event.wait()
+            if operation.promoted:
+                self._lead()
+        else:
+            self._lead()
+        if operation.error is not None:
+            raise operation.error
+        return operation.status
+
+    def _lead(self):
+        with self._lock:
+            batch = self._queue[:self.max_batch]
+            del self._queue[:self.max_batch]
+        try:
+            statuses = apply_batch([(op.kind, op.transaction_id, op.data) for op in batch])
+            for op, status in zip(batch, statuses):
+                op.status = status
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0].error = e
+            else:
+                # Whatever failed the shared statements should only fail its own caller
+                self._apply_one_by_one(batch)
+        finally:
+            # Hand over even if this thread is being torn down, or everyone queued would hang
+            with self._lock:
+                if self._queue:
+                    successor = self._queue[0]
+                    successor.promoted = True
+                    successor.event.set()
+                else:
+                    self._leading = False
+            for op in batch:
+                if op.status is None and op.error is None:
+                    op.error = RuntimeError("Group commit was interrupted")
+                op.event.set()
+
+    def _apply_one_by_one(self, batch):
+        for op in batch:
+            try:
+                op.status = apply_batch([(op.kind, op.transaction_id, op.data)])[0]
+            except Exception as e:
+                op.error = e
@@ -0,0 +1,24 @@
+import io
+
+
+class _RawReader(io.RawIOBase):
+    # Werkzeug spools multipart parts to a tempfile.SpooledTemporaryFile, which
+    # has no readable() before Python 3.11 and so can't go into io.TextIOWrapper
+    # itself. Closing the reader leaves the wrapped stream open.
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def text_reader(stream, encoding='utf-8'):
+    # Decodes any binary stream with read() as it is read. Lines keep their
+    # own endings, as the csv module expects.
+    return io.TextIOWrapper(io.BufferedReader(_RawReader(stream)), encoding=encoding, newline='')
@@ -0,0 +1,54 @@
+import redis
+from prometheus_client import Counter
+
+USERNAME_CACHE_HITS = Counter('username_cache_hits_total', 'User ids resolved from the Redis username projection')
+USERNAME_CACHE_MISSES = Counter('username_cache_misses_total', 'User ids loaded from the database')
+
+
+class UsernameCache:
+    # Redis projection of user id -> username, one key per user so each entry
+    # can expire on its own. A lookup is one MGET, then one query and one
+    # pipelined write for whatever was missing. update_user invalidates the
+    # entry; the TTL bounds how long a racing reload could keep an old name.
+
+    def __init__(self, redis_client=None, prefix='username:', ttl=3600):
+        self.redis = redis_client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def get_many(self, user_ids, loader):
+        # loader(missing_ids) -> {id: username}; unknown ids are simply absent
+        found = {}
+        missing = list(user_ids)
+        if self.redis is not None and missing:
+            try:
+                cached = self.redis.mget([self.prefix + str(user_id) for user_id in missing])
+            except redis.RedisError:
+                cached = [None] * len(missing)
+            for user_id, username in zip(missing, cached):
+                if username is not None:
+                    found[user_id] = username.decode('utf-8') if isinstance(username, bytes) else username
+            missing = [user_id for user_id in missing if user_id not in found]
+        USERNAME_CACHE_HITS.inc(len(found))
+
+        if missing:
+            USERNAME_CACHE_MISSES.inc(len(missing))
+            loaded = loader(missing)
+            found.update(loaded)
+            if self.redis is not None and loaded:
+                try:
+                    pipe = self.redis.pipeline(transaction=False)
+                    for user_id, username in loaded.items():
+                        pipe.setex(self.prefix + str(user_id), self.ttl, username)
+                    pipe.execute()
+                except redis.RedisError:
+                    pass
+        return found
+
+    def invalidate(self, user_id):
+        if self.redis is None:
+            return
+        try:
+            self.redis.delete(self.prefix + str(user_id))
+        except redis.RedisError:
+            pass
@@ -0,0 +1 @@
+# Benchmark suite for auth-service and flashcards-service; see __main__.py
@@ -0,0 +1,212 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import results
+from benchmarks.datasets import SCALES, seed_flashcards, seed_users
+from benchmarks.drivers import InProcessDriver, HttpDriver
+from benchmarks.endpoints import ENDPOINTS, Context
+from benchmarks.services import SERVICES, ROOT, NO_REDIS_URL, create_app, benchmarked_endpoints, token_factory
+
+# Examples, from the repository root:
+#   python -m benchmarks run --service all --scale tiny
+#   python -m benchmarks seed --service flashcards --db-uri postgresql://... --scale large
+#   python -m benchmarks run --service flashcards --driver http --url http://localhost:5001 \
+#       --db-uri postgresql://... --scale large --baseline baseline/
+#   python -m benchmarks compare benchmark-results/auth.json baseline/auth.json
+#
+# `run` writes <out>/<service>.json and, with --baseline, compares it with
+# <baseline>/<service>.json and exits 1 on a regression. Runs are only
+# comparable on the same machine, dataset, driver and Redis. In-process runs
+# use no Redis unless --redis-url names one; give it a scratch database, as
+# cache entries from an earlier run on another dataset would be served.
+
+
+def dataset(args):
+    sizes = dict(SCALES[args.scale])
+    for key, override in (('sets', args.sets), ('cards_per_set', args.cards), ('users', args.users)):
+        if override is not None:
+            sizes[key] = override
+    return {"scale": args.scale, "seed": args.seed, **sizes}
+
+
+def seed(app, db, service, data):
+    with app.app_context():
+        if service == 'flashcards':
+            report = seed_flashcards(db, data['sets'], data['cards_per_set'], data['seed'])
+            print(f"seeded {data['sets']} sets x {data['cards_per_set']} cards in {report['seconds']:.1f}s")
+        else:
+            report = seed_users(db, data['users'])
+            print(f"seeded {data['users']} users in {report['seconds']:.1f}s")
+
+
+def seed_command(args):
+    app = create_app(args.service, args.db_uri)
+    seed(app, app.extensions['sqlalchemy'], args.service, dataset(args))
+
+
+def check_coverage(app, service, specs):
+    # Every route of the blueprint needs a spec, or the suite silently stops covering it
+    missing = sorted(set(benchmarked_endpoints(app, service)) - {spec.name for spec in specs})
+    if missing:
+        raise SystemExit(f"no benchmark for {', '.join(missing)}; add it to benchmarks/endpoints.py")
+
+
+def run_service(args):
+    service = args.service
+    data = dataset(args)
+    make_token = token_factory()
+    specs = ENDPOINTS[service]()
+    if args.endpoint:
+        specs = [spec for spec in specs if spec.name in args.endpoint]
+
+    if args.driver == 'http':
+        if not args.url:
+            raise SystemExit("--driver http needs --url")
+        # Only used to list the blueprint's routes
+        app = create_app(service, 'sqlite://')
+        driver = HttpDriver(args.url, args.concurrency, make_token)
+        # Whatever the running service is configured with
+        redis_used = 'service'
+    else:
+        db_uri = args.db_uri
+        if db_uri is None:
+            db_uri = f"sqlite:///{os.path.join(tempfile.mkdtemp(), f'{service}.db')}"
+        app = create_app(service, db_uri, args.redis_url or NO_REDIS_URL)
+        redis_used = args.redis_url or 'none'
+        if args.db_uri is None:
+            seed(app, app.extensions['sqlalchemy'], service, data)
+        driver = InProcessDriver(app, app.extensions['sqlalchemy'], make_token)
+    if not args.endpoint:
+        check_coverage(app, service, specs)
+
+    ctx = Context(data['sets'], data['cards_per_set'], data['users'], data['seed'])
+    endpoints = {}
+    for spec in specs:
+        iterations = min(args.iterations, spec.max_iterations or args.iterations)
+        warmup = min(args.warmup, iterations)
+        if spec.setup is not None:
+            for i in range(warmup + iterations):
+                for req in spec.setup(ctx, i):
+                    status, body = driver.send(req, i)
+                    if spec.on_setup is not None:
+                        spec.on_setup(ctx, i, status, body)
+        # Warm-up requests use their own indexes so writes don't collide with the timed ones
+        for i in range(warmup):
+            driver.send(spec.build(ctx, i), i)
+        timed = [(i, spec.build(ctx, i)) for i in range(warmup, warmup + iterations)]
+        run = driver.run(timed, spec.expect, spec.name)
+        endpoints[spec.name] = results.summarize(run)
+        if run.errors:
+            print(f"{spec.name}: {run.errors} unexpected responses {run.statuses}", file=sys.stderr)
+
+    print(f"{service} ({driver.name}, Redis {redis_used}, {data['scale']}: {data['sets']} sets x "
+          f"{data['cards_per_set']} cards, {data['users']} users)")
+    print(results.table(endpoints))
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"{service}.json")
+    current = results.save(path, service, driver.name, redis_used, data, endpoints)
+    print(f"saved {path}")
+
+    failed = any(summary['errors'] for summary in endpoints.values())
+    if args.baseline:
+        failures = results.compare(current, results.load(os.path.join(args.baseline, f"{service}.json")),
+                                   args.latency_threshold, args.throughput_threshold, args.query_threshold)
+        report(failures)
+        failed = failed or bool(failures)
+    return 1 if failed else 0
+
+
+def run_command(args):
+    if args.service != 'all':
+        return run_service(args)
+    if args.driver == 'http':
+        raise SystemExit("--driver http benchmarks one service at a time")
+    # The services share module names, so each one runs in its own interpreter
+    status = 0
+    for service in SERVICES:
+        # The last --service wins
+        status |= subprocess.call([sys.executable, '-m', 'benchmarks', *sys.argv[1:], '--service', service],
+                                  cwd=ROOT)
+    return status
+
+
+def report(failures):
+    if failures:
+        print(f"{len(failures)} regressions against the baseline:")
+        for failure in failures:
+            print(f"  {failure}")
+    else:
+        print("no regressions against the baseline")
+
+
+def compare_command(args):
+    failures = results.compare(results.load(args.current), results.load(args.baseline),
+                               args.latency_threshold, args.throughput_threshold, args.query_threshold)
+    report(failures)
+    return 1 if failures else 0
+
+
+def add_thresholds(parser):
+    parser.add_argument('--latency-threshold', type=float, default=0.25,
+                        help='fail when a percentile is this fraction slower than the baseline')
+    parser.add_argument('--throughput-threshold', type=float, default=0.25,
+                        help='fail when throughput is this fraction lower than the baseline')
+    parser.add_argument('--query-threshold', type=float, default=0,
+                        help='fail when queries per request grow by more than this')
+
+
+def add_dataset(parser):
+    parser.add_argument('--scale', choices=sorted(SCALES), default='tiny')
+    parser.add_argument('--sets', type=int)
+    parser.add_argument('--cards', type=int, help='cards per set')
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--seed', type=int, default=42)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed', help='fill an empty database with a benchmark dataset')
+    seed_parser.add_argument('--service', choices=sorted(SERVICES), required=True)
+    seed_parser.add_argument('--db-uri', required=True)
+    add_dataset(seed_parser)
+    seed_parser.set_defaults(handler=seed_command)
+
+    run_parser = commands.add_parser('run', help='benchmark every endpoint of a service')
+    run_parser.add_argument('--service', choices=sorted(SERVICES) + ['all'], default='all')
+    run_parser.add_argument('--driver', choices=['inprocess', 'http'], default='inprocess')
+    run_parser.add_argument('--url', help='service base URL for --driver http')
+    run_parser.add_argument('--concurrency', type=int, default=8, help='client threads for --driver http')
+    run_parser.add_argument('--db-uri', help='an already seeded database; default: a fresh SQLite file')
+    run_parser.add_argument('--redis-url', help="Redis for --driver inprocess, e.g. redis://localhost:6379/15; "
+                                                "default: none, so every route takes its no-Redis path")
+    run_parser.add_argument('--iterations', type=int, default=200)
+    run_parser.add_argument('--warmup', type=int, default=10)
+    run_parser.add_argument('--endpoint', action='append', help='only this endpoint (repeatable)')
+    run_parser.add_argument('--out', default='benchmark-results')
+    run_parser.add_argument('--baseline', help='directory of an earlier run to compare against')
+    add_dataset(run_parser)
+    add_thresholds(run_parser)
+    run_parser.set_defaults(handler=run_command)
+
+    compare_parser = commands.add_parser('compare', help='compare a result file with a baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('baseline')
+    add_thresholds(compare_parser)
+    compare_parser.set_defaults(handler=compare_command)
+
+    args = parser.parse_args()
+    start = time.perf_counter()
+    status = args.handler(args)
+    if args.command == 'run' and args.service != 'all':
+        print(f"finished in {time.perf_counter() - start:.1f}s")
+    sys.exit(status)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import random
+import time
+from sqlalchemy import insert, select, func
+
+# Named dataset sizes; --sets/--cards/--users override any of them
+SCALES = {
+    'tiny': {'sets': 200, 'cards_per_set': 10, 'users': 1000},
+    'small': {'sets': 2000, 'cards_per_set': 50, 'users': 20000},
+    'large': {'sets': 100000, 'cards_per_set': 50, 'users': 1000000},
+}
+SUBJECTS = ["Biology", "History", "Chemistry", "Geography", "Literature", "Physics", "French", "Music"]
+# Every seeded user has this password, so the login benchmark can use any of them
+USER_PASSWORD = 'benchmark-password'
+BATCH_SIZE = 10000
+
+
+def make_vocabulary(rng, size=5000):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return sorted({"".join(rng.choice(letters) for _ in range(rng.randint(4, 9))) for _ in range(size)})
+
+
+def sentence(vocabulary, rng, words):
+    return " ".join(rng.choice(vocabulary) for _ in range(words))
+
+
+def username(n):
+    return f"bench_user_{n}"
+
+
+def email(n):
+    return f"bench_user_{n}@example.com"
+
+
+def _require_empty(db, model):
+    if db.session.scalar(select(func.count()).select_from(model)):
+        raise RuntimeError(f"{model.__tablename__} already has rows; seed an empty database")
+
+
+def seed_flashcards(db, sets, cards_per_set, seed=0, batch_size=BATCH_SIZE):
+    # `sets` sets of `cards_per_set` cards, the same for the same seed. Sets
+    # get ids 1..sets on an empty database. Call inside an app context.
+    from models.flashcard_set import FlashcardSet
+    from models.flashcard import Flashcard
+
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(rng)
+    _require_empty(db, FlashcardSet)
+    start = time.perf_counter()
+    for first in range(0, sets, batch_size):
+        count = min(batch_size, sets - first)
+        db.session.execute(insert(FlashcardSet), [
+            {"title": sentence(vocabulary, rng, 3), "subject": rng.choice(SUBJECTS),
+             "creator_id": rng.randint(1, 1000), "version": 1}
+            for _ in range(count)
+        ])
+        set_ids = db.session.scalars(select(FlashcardSet.id).order_by(FlashcardSet.id.desc()).limit(count)).all()
+        cards = [
+            {"set_id": set_id, "question": sentence(vocabulary, rng, 8), "answer": sentence(vocabulary, rng, 4)}
+            for set_id in reversed(set_ids) for _ in range(cards_per_set)
+        ]
+        for card_first in range(0, len(cards), batch_size):
+            db.session.execute(insert(Flashcard), cards[card_first:card_first + batch_size])
+        db.session.commit()
+    return {"sets": sets, "cards_per_set": cards_per_set, "vocabulary": vocabulary,
+            "seconds": time.perf_counter() - start}
+
+
+def seed_users(db, users, batch_size=BATCH_SIZE):
+    # bench_user_1..bench_user_<users> (email bench_user_<n>@example.com),
+    # all with USER_PASSWORD. The password
+    # is hashed once: hashing a million times would take hours and measures
+    # nothing about the routes.
+    from models.user import User
+    from passwords import hash_password
+
+    _require_empty(db, User)
+    password = hash_password(USER_PASSWORD)
+    start = time.perf_counter()
+    for first in range(1, users + 1, batch_size):
+        db.session.execute(insert(User), [
+            {"username": username(n), "email": email(n), "password": password}
+            for n in range(first, min(first + batch_size, users + 1))
+        ])
+        db.session.commit()
+    return {"users": users, "seconds": time.perf_counter() - start}
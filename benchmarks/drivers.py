@@ -0,0 +1,181 @@
+import http.client
+import queue
+import threading
+import time
+from urllib.parse import urlsplit
+from sqlalchemy import event
+from prometheus_client.parser import text_string_to_metric_families
+
+
+def forwarded_for(i):
+    # A distinct client address per request keeps per-client rate limits out of the numbers
+    return f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+
+
+class Run:
+    # Outcome of timing one endpoint
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.statuses = {}
+        self.seconds = 0.0
+        self.sql_queries = None
+
+
+class InProcessDriver:
+    # Sends requests through the Flask test client, one at a time, and counts
+    # the SQL statements each one runs on any of the app's engines
+    name = 'inprocess'
+
+    def __init__(self, app, db, make_token):
+        self.client = app.test_client()
+        self.make_token = make_token
+        self._statements = 0
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self._statements += 1
+
+    def _headers(self, req, i):
+        headers = {'X-Forwarded-For': forwarded_for(i)}
+        if req['identity'] is not None:
+            headers['Authorization'] = f"Bearer {self.make_token(req['identity'])}"
+        return headers
+
+    def _open(self, req, headers):
+        response = self.client.open(req['path'], method=req['method'], data=req['data'],
+                                    content_type=req['content_type'], headers=headers)
+        # Drains streamed responses too
+        body = response.get_data()
+        response.close()
+        return response.status_code, body
+
+    def send(self, req, i):
+        # (status, body) of one untimed request
+        return self._open(req, self._headers(req, i))
+
+    def run(self, requests, expect, endpoint=None):
+        # requests: [(i, request)]; headers are built before the clock starts
+        prepared = [(i, req, self._headers(req, i)) for i, req in requests]
+        run = Run()
+        self._statements = 0
+        start = time.perf_counter()
+        for i, req, headers in prepared:
+            request_start = time.perf_counter()
+            status, _ = self._open(req, headers)
+            run.latencies.append(time.perf_counter() - request_start)
+            record_status(run, status, expect)
+        run.seconds = time.perf_counter() - start
+        run.sql_queries = self._statements / len(prepared) if prepared else 0.0
+        return run
+
+
+class HttpDriver:
+    # Sends requests to a running service with `concurrency` threads, each on
+    # its own keep-alive connection. Queries per request come from the
+    # service's sql_queries_per_request histogram, read from /metrics before
+    # and after, so they are only exact when nothing else uses the service.
+    name = 'http'
+
+    def __init__(self, url, concurrency, make_token, timeout=30):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.concurrency = concurrency
+        self.make_token = make_token
+        self.timeout = timeout
+
+    def _connection(self):
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _headers(self, req, i):
+        headers = {'X-Forwarded-For': forwarded_for(i)}
+        if req['content_type']:
+            headers['Content-Type'] = req['content_type']
+        if req['identity'] is not None:
+            headers['Authorization'] = f"Bearer {self.make_token(req['identity'])}"
+        return headers
+
+    def _send(self, connection, req, headers):
+        connection.request(req['method'], req['path'], body=req['data'], headers=headers)
+        response = connection.getresponse()
+        return response.status, response.read()
+
+    def send(self, req, i):
+        # (status, body) of one untimed request
+        connection = self._connection()
+        try:
+            return self._send(connection, req, self._headers(req, i))
+        finally:
+            connection.close()
+
+    def sql_counters(self, endpoint):
+        # (sum, count) of sql_queries_per_request for the endpoint, or None without metrics
+        connection = self._connection()
+        try:
+            connection.request('GET', '/metrics')
+            response = connection.getresponse()
+            body = response.read().decode('utf-8')
+        except OSError:
+            return None
+        finally:
+            connection.close()
+        if response.status != 200:
+            return None
+        totals = {}
+        for family in text_string_to_metric_families(body):
+            if family.name != 'sql_queries_per_request':
+                continue
+            for sample in family.samples:
+                if sample.labels.get('endpoint') == endpoint and sample.name.endswith(('_sum', '_count')):
+                    totals[sample.name.rsplit('_', 1)[1]] = sample.value
+        return totals.get('sum', 0.0), totals.get('count', 0.0)
+
+    def run(self, requests, expect, endpoint=None):
+        work = queue.Queue()
+        for i, req in requests:
+            work.put((i, req, self._headers(req, i)))
+        run = Run()
+        lock = threading.Lock()
+
+        def worker():
+            connection = self._connection()
+            while True:
+                try:
+                    i, req, headers = work.get_nowait()
+                except queue.Empty:
+                    break
+                start = time.perf_counter()
+                try:
+                    status, _ = self._send(connection, req, headers)
+                except (OSError, http.client.HTTPException):
+                    connection.close()
+                    connection = self._connection()
+                    status = None
+                elapsed = time.perf_counter() - start
+                with lock:
+                    if status is not None:
+                        run.latencies.append(elapsed)
+                    record_status(run, status, expect)
+            connection.close()
+
+        before = self.sql_counters(endpoint) if endpoint else None
+        start = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        run.seconds = time.perf_counter() - start
+        after = self.sql_counters(endpoint) if endpoint else None
+        if before is not None and after is not None and after[1] > before[1]:
+            run.sql_queries = (after[0] - before[0]) / (after[1] - before[1])
+        return run
+
+
+def record_status(run, status, expect):
+    key = str(status) if status is not None else 'failed'
+    run.statuses[key] = run.statuses.get(key, 0) + 1
+    if status not in expect:
+        run.errors += 1
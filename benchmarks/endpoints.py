@@ -0,0 +1,173 @@
+import json
+import random
+import uuid
+from benchmarks.datasets import make_vocabulary, email, USER_PASSWORD, SUBJECTS
+
+BATCH_IDS = 50
+TRANSACTION_BATCH = 50
+
+
+class Context:
+    # What the request builders need to know about the seeded dataset
+    def __init__(self, sets=0, cards_per_set=0, users=0, seed=0):
+        self.sets = sets
+        self.cards_per_set = cards_per_set
+        self.users = users
+        self.seed = seed
+        self.rng = random.Random(seed + 1)
+        self.vocabulary = make_vocabulary(random.Random(seed)) if sets else []
+        # Keeps names and transaction ids from colliding with an earlier run on the same database
+        self.run_id = uuid.uuid4().hex[:8]
+        # Ids of rows that setup requests created, by request index
+        self.created = {}
+
+    def set_id(self):
+        return self.rng.randint(1, self.sets)
+
+    def user_id(self):
+        return self.rng.randint(1, self.users)
+
+
+class Endpoint:
+    # One benchmarked route. build(ctx, i) returns the i-th request; setup,
+    # when given, returns requests sent (untimed) before it, e.g. the prepare
+    # that a commit needs, and on_setup(ctx, i, status, body) sees their
+    # responses. Heavy endpoints cap their iteration count.
+    def __init__(self, name, build, setup=None, on_setup=None, expect=(200,), max_iterations=None):
+        self.name = name
+        self.build = build
+        self.setup = setup
+        self.on_setup = on_setup
+        self.expect = expect
+        self.max_iterations = max_iterations
+
+
+def request(method, path, json_body=None, data=None, content_type=None, identity=None):
+    # identity: user id to send a bearer token for
+    if json_body is not None:
+        data, content_type = json.dumps(json_body).encode('utf-8'), 'application/json'
+    return {"method": method, "path": path, "data": data, "content_type": content_type, "identity": identity}
+
+
+def two_phase_endpoints(blueprint, prefix):
+    def transaction_id(ctx, kind, i):
+        return f"bench-{ctx.run_id}-{kind}-{i}"
+
+    def prepare(ctx, kind, i):
+        return request('POST', f"{prefix}/prepare",
+                       {"transaction_id": transaction_id(ctx, kind, i), "data": {"n": i}})
+
+    def batch_ids(ctx, kind, i):
+        return [f"{transaction_id(ctx, kind, i)}-{n}" for n in range(TRANSACTION_BATCH)]
+
+    def prepare_batch(ctx, kind, i):
+        return request('POST', f"{prefix}/prepare/batch",
+                       {"transactions": [{"transaction_id": t, "data": {}} for t in batch_ids(ctx, kind, i)]})
+
+    return [
+        Endpoint(f"{blueprint}.prepare", lambda ctx, i: prepare(ctx, 'prepare', i)),
+        Endpoint(f"{blueprint}.commit",
+                 lambda ctx, i: request('POST', f"{prefix}/commit", {"transaction_id": transaction_id(ctx, 'commit', i)}),
+                 setup=lambda ctx, i: [prepare(ctx, 'commit', i)]),
+        Endpoint(f"{blueprint}.abort",
+                 lambda ctx, i: request('POST', f"{prefix}/abort", {"transaction_id": transaction_id(ctx, 'abort', i)}),
+                 setup=lambda ctx, i: [prepare(ctx, 'abort', i)]),
+        Endpoint(f"{blueprint}.prepare_batch", lambda ctx, i: prepare_batch(ctx, 'prepare_batch', i)),
+        Endpoint(f"{blueprint}.commit_batch",
+                 lambda ctx, i: request('POST', f"{prefix}/commit/batch",
+                                        {"transaction_ids": batch_ids(ctx, 'commit_batch', i)}),
+                 setup=lambda ctx, i: [prepare_batch(ctx, 'commit_batch', i)]),
+        Endpoint(f"{blueprint}.abort_batch",
+                 lambda ctx, i: request('POST', f"{prefix}/abort/batch",
+                                        {"transaction_ids": batch_ids(ctx, 'abort_batch', i)}),
+                 setup=lambda ctx, i: [prepare_batch(ctx, 'abort_batch', i)]),
+    ]
+
+
+def flashcards_endpoints():
+    # Reads first, then writes. Deletes remove sets their setup imported, so
+    # the seeded sets stay and a database can be reused across runs.
+    def cards(ctx, count):
+        return [{"question": " ".join(ctx.rng.sample(ctx.vocabulary, 8)), "answer": ctx.rng.choice(ctx.vocabulary)}
+                for _ in range(count)]
+
+    def import_body(ctx):
+        lines = ["question,answer"] + [f"{card['question']},{card['answer']}" for card in cards(ctx, ctx.cards_per_set)]
+        return "\n".join(lines).encode('utf-8')
+
+    def import_set(ctx, title):
+        return request('POST', f"/api/flashcards/import?title={title}&subject=Bench",
+                       data=import_body(ctx), content_type='text/csv', identity=1)
+
+    def remember_set(ctx, i, status, body):
+        if status == 201:
+            ctx.created[i] = json.loads(body)['setId']
+
+    return [
+        Endpoint('flashcards_bp.status', lambda ctx, i: request('GET', '/api/flashcards/status')),
+        Endpoint('flashcards_bp.get_flashcard_sets',
+                 lambda ctx, i: request('GET', f"/api/flashcards?cursor={ctx.set_id()}&limit=50")),
+        Endpoint('flashcards_bp.get_flashcard_set', lambda ctx, i: request('GET', f"/api/flashcards/{ctx.set_id()}")),
+        Endpoint('flashcards_bp.get_flashcard_sets_batch',
+                 lambda ctx, i: request('POST', '/api/flashcards/batch',
+                                        {"ids": [ctx.set_id() for _ in range(BATCH_IDS)]})),
+        Endpoint('flashcards_bp.search_flashcard_sets',
+                 lambda ctx, i: request('GET', f"/api/flashcards/search?q={ctx.rng.choice(ctx.vocabulary)}")),
+        Endpoint('flashcards_bp.get_flashcard_set_presence',
+                 lambda ctx, i: request('GET', f"/api/flashcards/{ctx.set_id()}/presence"), expect=(200, 503)),
+        # Streams the whole catalogue
+        Endpoint('flashcards_bp.export_flashcard_sets', lambda ctx, i: request('GET', '/api/flashcards/export'),
+                 max_iterations=5),
+        Endpoint('flashcards_bp.create_flashcard_set',
+                 lambda ctx, i: request('POST', '/api/flashcards',
+                                        {"title": f"Bench {ctx.run_id} {i}", "subject": ctx.rng.choice(SUBJECTS),
+                                         "cards": cards(ctx, 10)}, identity=1),
+                 expect=(201,)),
+        Endpoint('flashcards_bp.import_flashcard_set',
+                 lambda ctx, i: import_set(ctx, f"Import+{ctx.run_id}+{i}"),
+                 expect=(201,)),
+        Endpoint('flashcards_bp.update_flashcard_set',
+                 lambda ctx, i: request('PUT', f"/api/flashcards/{ctx.set_id()}",
+                                        {"title": f"Updated {ctx.run_id} {i}", "cards": cards(ctx, 5)})),
+        *two_phase_endpoints('flashcards_bp', '/api/flashcards'),
+        Endpoint('flashcards_bp.delete_flashcard_set',
+                 lambda ctx, i: request('DELETE', f"/api/flashcards/{ctx.created.get(i, 0)}"),
+                 setup=lambda ctx, i: [import_set(ctx, f"Delete+{ctx.run_id}+{i}")], on_setup=remember_set),
+    ]
+
+
+def auth_endpoints():
+    def bulk_body(ctx, i):
+        return "\n".join(json.dumps({"username": f"bulk_{ctx.run_id}_{i}_{n}",
+                                     "email": f"bulk_{ctx.run_id}_{i}_{n}@example.com",
+                                     "password": USER_PASSWORD}) for n in range(100)).encode('utf-8')
+
+    return [
+        Endpoint('auth.status', lambda ctx, i: request('GET', '/api/auth/status')),
+        Endpoint('auth.get_all_users',
+                 lambda ctx, i: request('GET', f"/api/auth/users?cursor={ctx.user_id()}&limit=100")),
+        Endpoint('auth.get_usernames_batch',
+                 lambda ctx, i: request('POST', '/api/auth/users/batch',
+                                        {"ids": [ctx.user_id() for _ in range(BATCH_IDS)]})),
+        Endpoint('auth.login',
+                 lambda ctx, i: request('POST', '/api/auth/login',
+                                        {"email": email(ctx.user_id()), "password": USER_PASSWORD})),
+        Endpoint('auth.logout', lambda ctx, i: request('POST', '/api/auth/logout', identity=ctx.user_id())),
+        Endpoint('auth.register',
+                 lambda ctx, i: request('POST', '/api/auth/register',
+                                        {"username": f"new_{ctx.run_id}_{i}", "email": f"new_{ctx.run_id}_{i}@example.com",
+                                         "password": USER_PASSWORD}),
+                 expect=(201,)),
+        Endpoint('auth.provision_users',
+                 lambda ctx, i: request('POST', '/api/auth/users/bulk', data=bulk_body(ctx, i),
+                                        content_type='application/x-ndjson', identity=1),
+                 # 100 password hashes per request
+                 max_iterations=10),
+        Endpoint('auth.update_user',
+                 lambda ctx, i: request('PUT', f"/api/auth/users/{ctx.user_id()}",
+                                        {"email": f"updated_{ctx.run_id}_{i}@example.com"}, identity=1)),
+        *two_phase_endpoints('auth', '/api/auth'),
+    ]
+
+
+ENDPOINTS = {'auth': auth_endpoints, 'flashcards': flashcards_endpoints}
@@ -0,0 +1,85 @@
+import json
+import time
+
+# Latency differences below this are noise on any machine
+LATENCY_NOISE_MS = 1.0
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return float('nan')
+    return sorted_values[min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))]
+
+
+def summarize(run):
+    latencies = sorted(seconds * 1000 for seconds in run.latencies)
+    requests = sum(run.statuses.values())
+    return {
+        "requests": requests,
+        "errors": run.errors,
+        "statuses": run.statuses,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "throughput_rps": round(requests / run.seconds, 1) if run.seconds else 0.0,
+        "sql_queries_per_request": round(run.sql_queries, 2) if run.sql_queries is not None else None,
+    }
+
+
+def save(path, service, driver, redis, dataset, endpoints):
+    result = {
+        "service": service,
+        "driver": driver,
+        "redis": redis,
+        "dataset": dataset,
+        "created_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "endpoints": endpoints,
+    }
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+    return result
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(current, baseline, latency_threshold=0.25, throughput_threshold=0.25, query_threshold=0):
+    # Failures of `current` against `baseline`, one line each. Latency and
+    # throughput thresholds are fractions (0.25 = 25% worse); queries per
+    # request may grow by at most query_threshold. An endpoint the baseline
+    # has and the current run lacks is a failure too.
+    failures = []
+    for key in ("service", "driver", "redis", "dataset"):
+        if current.get(key) != baseline.get(key):
+            failures.append(f"runs differ in {key}: {current.get(key)} vs baseline {baseline.get(key)}")
+    for name, before in sorted(baseline["endpoints"].items()):
+        after = current["endpoints"].get(name)
+        if after is None:
+            failures.append(f"{name}: missing from this run")
+            continue
+        if after["errors"] > before["errors"]:
+            failures.append(f"{name}: {after['errors']} errors, baseline had {before['errors']}")
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            limit = max(before[key] * (1 + latency_threshold), before[key] + LATENCY_NOISE_MS)
+            if after[key] > limit:
+                failures.append(f"{name}: {key} {after[key]:.2f} > {limit:.2f} (baseline {before[key]:.2f})")
+        limit = before["throughput_rps"] * (1 - throughput_threshold)
+        if after["throughput_rps"] < limit:
+            failures.append(f"{name}: throughput {after['throughput_rps']:.1f}/s < {limit:.1f}/s "
+                            f"(baseline {before['throughput_rps']:.1f}/s)")
+        queries, baseline_queries = after["sql_queries_per_request"], before["sql_queries_per_request"]
+        if queries is not None and baseline_queries is not None and queries > baseline_queries + query_threshold:
+            failures.append(f"{name}: {queries:.2f} queries/request, baseline {baseline_queries:.2f}")
+    return failures
+
+
+def table(endpoints):
+    lines = [f"{'endpoint':<48} {'reqs':>6} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+             f"{'req/s':>9} {'queries':>8}"]
+    for name, s in sorted(endpoints.items()):
+        queries = f"{s['sql_queries_per_request']:.2f}" if s['sql_queries_per_request'] is not None else '-'
+        lines.append(f"{name:<48} {s['requests']:>6} {s['errors']:>4} {s['p50_ms']:>9.2f} {s['p95_ms']:>9.2f} "
+                     f"{s['p99_ms']:>9.2f} {s['throughput_rps']:>9.1f} {queries:>8}")
+    return "\n".join(lines)
@@ -0,0 +1,96 @@
+import importlib
+import os
+import sys
+import redis
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Both services have top-level modules called db, routes and models, so a
+# process can only import one of them; __main__ runs each in a subprocess.
+SERVICES = {
+    'auth': {'directory': 'auth-service', 'blueprints': [('routes', 'auth_bp')], 'benchmarked': 'auth',
+             'models': ['models.user'],
+             # Redis clients in routes, or objects there holding one as .redis
+             'redis': ['limiter', 'denylist', 'username_cache']},
+    'flashcards': {
+        'directory': 'flashcards-service',
+        'blueprints': [('routes', 'flashcards_bp'), ('review_routes', 'reviews_bp')],
+        # reviews_bp is registered for completeness; its routes have their own bench_reviews.py
+        'benchmarked': 'flashcards_bp',
+        'models': ['models.flashcard_set', 'models.flashcard', 'models.card_state'],
+        # set_versions and presence share cache
+        'redis': ['cache', 'set_cache', 'limiter'],
+    },
+}
+JWT_SECRET_KEY = 'super-secret'
+# A closed local port: without --redis-url every Redis call fails at once and
+# the routes take their no-Redis paths, instead of each new connection
+# stalling on a DNS lookup for the compose host name 'redis'
+NO_REDIS_URL = 'redis://127.0.0.1:1/0'
+
+_loaded = None
+
+
+def load(service):
+    # Puts the service's directory on sys.path and imports it; returns its db
+    global _loaded
+    if _loaded is not None and _loaded != service:
+        raise RuntimeError(f"{_loaded} is already imported in this process; run {service} in another one")
+    if _loaded is None:
+        sys.path.insert(0, os.path.join(ROOT, SERVICES[service]['directory']))
+        _loaded = service
+    return importlib.import_module('db').db
+
+
+def benchmarked_endpoints(app, service):
+    # Every endpoint of the service's main blueprint, e.g. 'auth.login'
+    prefix = SERVICES[service]['benchmarked'] + '.'
+    return sorted({rule.endpoint for rule in app.url_map.iter_rules() if rule.endpoint.startswith(prefix)})
+
+
+def use_redis(service, url):
+    # Points the Redis clients of the service's routes module at url. Shared
+    # clients are repointed in place, so everything that shares one still does.
+    routes = importlib.import_module('routes')
+    for name in SERVICES[service]['redis']:
+        holder = getattr(routes, name)
+        client = holder if isinstance(holder, redis.Redis) else holder.redis
+        if client is None:
+            # Wired by app.py's redis_client, which the benchmark app doesn't run
+            holder.redis = redis.Redis.from_url(url, socket_connect_timeout=1)
+        else:
+            decode = client.connection_pool.connection_kwargs.get('decode_responses', False)
+            client.connection_pool = redis.ConnectionPool.from_url(url, decode_responses=decode,
+                                                                   socket_connect_timeout=1)
+
+
+def create_app(service, db_uri, redis_url=NO_REDIS_URL):
+    db = load(service)
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = db_uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['JWT_SECRET_KEY'] = JWT_SECRET_KEY
+    db.init_app(app)
+    JWTManager(app)
+    for module, name in SERVICES[service]['blueprints']:
+        app.register_blueprint(getattr(importlib.import_module(module), name))
+    use_redis(service, redis_url)
+    for module in SERVICES[service]['models']:
+        importlib.import_module(module)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def token_factory(secret=JWT_SECRET_KEY):
+    # Access tokens signed like the services sign them, for any identity
+    app = Flask(__name__)
+    app.config['JWT_SECRET_KEY'] = secret
+    JWTManager(app)
+
+    def make_token(identity):
+        with app.app_context():
+            return create_access_token(identity=identity)
+    return make_token
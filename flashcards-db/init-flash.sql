@@ -5,9 +5,15 @@ CREATE TABLE IF NOT EXISTS flashcard_sets (
     title VARCHAR(255) NOT NULL,
     subject VARCHAR(255) NOT NULL,
     creator_id INT NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    version INT NOT NULL DEFAULT 1
 );
 
+-- For databases created before sets were versioned
+ALTER TABLE flashcard_sets ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE flashcard_sets ADD COLUMN IF NOT EXISTS version INT NOT NULL DEFAULT 1;
+
 CREATE TABLE IF NOT EXISTS flashcards (
     id SERIAL PRIMARY KEY,
     set_id INT REFERENCES flashcard_sets(id) ON DELETE CASCADE,
@@ -15,8 +21,53 @@ CREATE TABLE IF NOT EXISTS flashcards (
     answer TEXT NOT NULL
 );
 
+CREATE INDEX IF NOT EXISTS ix_flashcards_set_id ON flashcards (set_id);
+
+-- Full-text search: generated tsvector columns stay in sync on every insert and update
+ALTER TABLE flashcards ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('english', coalesce(question, '') || ' ' || coalesce(answer, ''))) STORED;
+ALTER TABLE flashcard_sets ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('english', coalesce(title, '') || ' ' || coalesce(subject, ''))) STORED;
+CREATE INDEX IF NOT EXISTS ix_flashcards_search_vector ON flashcards USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS ix_flashcard_sets_search_vector ON flashcard_sets USING GIN (search_vector);
+
+-- Spaced-repetition state per (user, card)
+CREATE TABLE IF NOT EXISTS card_states (
+    user_id INT NOT NULL,
+    card_id INT NOT NULL REFERENCES flashcards(id) ON DELETE CASCADE,
+    ease DOUBLE PRECISION NOT NULL DEFAULT 2.5,
+    interval INT NOT NULL DEFAULT 0,
+    repetitions INT NOT NULL DEFAULT 0,
+    due_at TIMESTAMP NOT NULL,
+    last_reviewed_at TIMESTAMP,
+    PRIMARY KEY (user_id, card_id)
+);
+
+CREATE INDEX IF NOT EXISTS ix_card_states_user_due ON card_states (user_id, due_at);
+
 CREATE TABLE IF NOT EXISTS transactions (
     transaction_id VARCHAR(36) PRIMARY KEY,
     status VARCHAR(10) NOT NULL, -- 'pending', 'prepared', 'committed', 'aborted'
-    data JSONB -- Storing the data to commit in JSON format (for simplicity)
-);
\ No newline at end of file
+    data JSONB, -- Storing the data to commit in JSON format (for simplicity)
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- For databases created before transactions were timestamped
+ALTER TABLE transactions ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE transactions ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+
+-- Only transactions still waiting for a decision are indexed; maintenance.py
+-- times out old prepared ones through it
+CREATE INDEX IF NOT EXISTS ix_transactions_open ON transactions (created_at)
+    WHERE status IN ('pending', 'prepared');
+
+-- Committed transactions are moved here in batches by maintenance.py
+CREATE TABLE IF NOT EXISTS transactions_archive (
+    transaction_id VARCHAR(36) PRIMARY KEY,
+    status VARCHAR(10) NOT NULL,
+    data JSONB,
+    created_at TIMESTAMP,
+    updated_at TIMESTAMP,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
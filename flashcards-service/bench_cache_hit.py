@@ -0,0 +1,56 @@
+# Micro-benchmark for the cache-hit path of GET /api/flashcards/<set_id>.
+#
+#   python bench_cache_hit.py --cards 200 --iterations 5000
+#
+# "before" replays the old hit path (json.loads on the cached string, then
+# jsonify re-encoding it); "after" returns the cached encoded body as-is.
+import argparse
+import json
+import time
+from flask import Flask, jsonify
+import routes
+
+
+def timed(fn, iterations):
+    fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cards', type=int, default=200)
+    parser.add_argument('--iterations', type=int, default=5000)
+    args = parser.parse_args()
+
+    flashcard_set = {
+        "setId": 1, "title": "Bench", "subject": "Bench", "creatorId": 1,
+        "cards": [{"cardId": i, "question": f"Question {i} " * 4, "answer": f"Answer {i} " * 4} for i in range(args.cards)]
+    }
+    cached_string = json.dumps(flashcard_set)
+    cached_bytes = routes.encode_json(flashcard_set)
+
+    app = Flask(__name__)
+
+    def before():
+        data = json.loads(cached_string)
+        return jsonify({"data": data, "source": "redis"}).get_data()
+
+    def after():
+        return routes.json_bytes_response(cached_bytes, source='memory').get_data()
+
+    with app.test_request_context('/api/flashcards/1'):
+        before_us = timed(before, args.iterations)
+        after_us = timed(after, args.iterations)
+
+    encoder = 'orjson' if routes.orjson is not None else 'json'
+    print(f"{args.cards} cards, {len(cached_bytes)} byte body, encoder {encoder}")
+    print(f"before (loads + jsonify)   {before_us:9.1f} us/hit")
+    print(f"after  (cached bytes)      {after_us:9.1f} us/hit")
+    print(f"speedup                    {before_us / after_us:9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
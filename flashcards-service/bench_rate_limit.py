@@ -0,0 +1,82 @@
+# Per-request overhead of the shared rate limiter against a real Redis.
+#
+#   python bench_rate_limit.py --redis-url redis://localhost:6379/0
+#
+# Times --requests GETs of one cached set with no limiter, with a Redis round
+# trip on every check (no leasing), and with leased tokens spent locally. The
+# limit is set high enough that nothing is rejected.
+import argparse
+import os
+import statistics
+import tempfile
+import time
+import redis
+from flask import Flask
+from flask_jwt_extended import JWTManager
+from db import db
+from models.flashcard import Flashcard
+from models.flashcard_set import FlashcardSet
+from rate_limit import RateLimiter, parse_rule
+import routes
+
+
+def create_app(db_uri, limiter):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = db_uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['JWT_SECRET_KEY'] = 'super-secret'
+    db.init_app(app)
+    JWTManager(app)
+    app.register_blueprint(routes.flashcards_bp)
+    if limiter is not None:
+        limiter.init_app(app)
+    with app.app_context():
+        db.create_all()
+        if db.session.get(FlashcardSet, 1) is None:
+            flashcard_set = FlashcardSet(title='Bench', subject='Bench', creator_id=1)
+            flashcard_set.flashcards.append(Flashcard(question='Q', answer='A'))
+            db.session.add(flashcard_set)
+            db.session.commit()
+    return app
+
+
+def run(label, app, requests):
+    client = app.test_client()
+    client.get('/api/flashcards/1')
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = client.get('/api/flashcards/1')
+        timings.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.status_code
+    timings.sort()
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    print(f"{label:<20} mean {statistics.mean(timings):7.3f} ms   p50 {statistics.median(timings):7.3f} ms   "
+          f"p99 {p99:7.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--redis-url', default='redis://localhost:6379/0')
+    parser.add_argument('--db-uri')
+    parser.add_argument('--requests', type=int, default=5000)
+    args = parser.parse_args()
+
+    db_uri = args.db_uri or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'rate_limit.db')}"
+    client = redis.Redis.from_url(args.redis_url)
+    # Keep the set cache in process so the limiter is the only Redis traffic
+    routes.set_cache.redis = None
+    routes.set_versions.redis = None
+    # Far above --requests so every check is allowed
+    routes.get_flashcard_set._rate_limit = parse_rule("1000000 per minute")
+
+    run("no limiter", create_app(db_uri, None), args.requests)
+    client.delete(*client.keys('bench-ratelimit:*') or ['bench-ratelimit:none'])
+    run("redis every check", create_app(db_uri, RateLimiter(client, prefix='bench-ratelimit', max_lease=1)),
+        args.requests)
+    client.delete(*client.keys('bench-ratelimit:*') or ['bench-ratelimit:none'])
+    run("leased tokens", create_app(db_uri, RateLimiter(client, prefix='bench-ratelimit')), args.requests)
+
+
+if __name__ == '__main__':
+    main()
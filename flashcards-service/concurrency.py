@@ -0,0 +1,181 @@
+import sys
+import threading
+import time
+from functools import wraps
+from flask import jsonify
+from werkzeug.exceptions import HTTPException
+from prometheus_client import Counter, Gauge
+
+IN_FLIGHT = Gauge('concurrency_in_flight', 'Requests currently holding a concurrency slot', ['priority'])
+QUEUED = Gauge('concurrency_queued', 'Requests waiting for a concurrency slot', ['priority'])
+REJECTED = Counter('concurrency_rejected_total', 'Requests rejected by the concurrency limiter', ['priority', 'reason'])
+LIMIT = Gauge('concurrency_limit', 'Current adaptive concurrency limit')
+
+# Lower number = served first when slots free up
+PRIORITIES = {'critical': 0, 'read': 1, 'write': 2, 'bulk': 3}
+# Share of the current limit a class may occupy, so bulk work cannot take every slot
+CLASS_SHARE = {'critical': 1.0, 'read': 1.0, 'write': 0.8, 'bulk': 0.3}
+# Health checks get a few slots above the limit so they still answer under overload
+CRITICAL_HEADROOM = 2
+# Long-running classes would skew the latency signal
+SAMPLED_CLASSES = ('read', 'write')
+
+
+class Overloaded(Exception):
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def _in_green_thread():
+    # Under eventlet, blocking on a native threading primitive stalls the whole hub
+    if 'eventlet' not in sys.modules:
+        return False
+    from eventlet import greenthread
+    return isinstance(greenthread.getcurrent(), greenthread.GreenThread)
+
+
+def new_event():
+    if _in_green_thread():
+        from eventlet.green import threading as green_threading
+        return green_threading.Event()
+    return threading.Event()
+
+
+class _Waiter:
+    def __init__(self, priority):
+        self.priority = priority
+        self.event = new_event()
+        self.granted = False
+
+
+class _Token:
+    def __init__(self, priority):
+        self.priority = priority
+        self.started = time.monotonic()
+
+
+class AdaptiveLimiter:
+    # Concurrency limit that adapts to observed latency (AIMD): it grows by
+    # 1/limit per fast request while the limit is in use, and shrinks by
+    # `backoff` when requests get slower than `latency_target` or fail (at most
+    # once per `decrease_interval`). Requests over the limit wait in a bounded
+    # queue served by priority and are rejected quickly when it is full or they
+    # have waited `max_wait` seconds.
+
+    def __init__(self, initial_limit=10, min_limit=2, max_limit=64, max_queue=50, max_wait=2.0,
+                 latency_target=0.5, backoff=0.9, decrease_interval=1.0):
+        self.current_limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.decrease_interval = decrease_interval
+        self._in_flight = {priority: 0 for priority in PRIORITIES}
+        self._waiters = []
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        LIMIT.set(self.current_limit)
+
+    @property
+    def in_flight(self):
+        return sum(self._in_flight.values())
+
+    def _admissible(self, priority):
+        limit = int(self.current_limit)
+        if priority == 'critical':
+            return self.in_flight < limit + CRITICAL_HEADROOM
+        return self.in_flight < limit and self._in_flight[priority] < max(1, int(limit * CLASS_SHARE[priority]))
+
+    def _take(self, priority):
+        self._in_flight[priority] += 1
+        IN_FLIGHT.labels(priority=priority).inc()
+
+    def acquire(self, priority='read', blocking=True):
+        with self._lock:
+            # Don't overtake queued requests of the same or higher priority
+            ahead = any(PRIORITIES[w.priority] <= PRIORITIES[priority] for w in self._waiters)
+            if not ahead and self._admissible(priority):
+                self._take(priority)
+                return _Token(priority)
+            if not blocking:
+                REJECTED.labels(priority=priority, reason='busy').inc()
+                raise Overloaded('busy')
+            if len(self._waiters) >= self.max_queue:
+                REJECTED.labels(priority=priority, reason='queue_full').inc()
+                raise Overloaded('queue_full')
+            waiter = _Waiter(priority)
+            self._waiters.append(waiter)
+            self._waiters.sort(key=lambda w: PRIORITIES[w.priority])
+            QUEUED.labels(priority=priority).inc()
+
+        waiter.event.wait(self.max_wait)
+        with self._lock:
+            if not waiter.granted:
+                self._waiters.remove(waiter)
+                QUEUED.labels(priority=priority).dec()
+                REJECTED.labels(priority=priority, reason='timeout').inc()
+                raise Overloaded('timeout')
+        return _Token(priority)
+
+    def release(self, token, failed=False):
+        latency = time.monotonic() - token.started
+        with self._lock:
+            self._in_flight[token.priority] -= 1
+            IN_FLIGHT.labels(priority=token.priority).dec()
+            if token.priority in SAMPLED_CLASSES:
+                self._adapt(latency, failed)
+            self._grant_waiters()
+
+    def _adapt(self, latency, failed):
+        now = time.monotonic()
+        if failed or latency > self.latency_target:
+            if now - self._last_decrease >= self.decrease_interval:
+                self.current_limit = max(self.min_limit, self.current_limit * self.backoff)
+                self._last_decrease = now
+        elif self.in_flight + 1 >= int(self.current_limit) - 1:
+            # Only grow while the limit is actually the bottleneck
+            self.current_limit = min(self.max_limit, self.current_limit + 1.0 / self.current_limit)
+        LIMIT.set(self.current_limit)
+
+    def _grant_waiters(self):
+        # Hand free slots straight to waiters, best priority first
+        for waiter in list(self._waiters):
+            if not self._admissible(waiter.priority):
+                continue
+            self._waiters.remove(waiter)
+            QUEUED.labels(priority=waiter.priority).dec()
+            self._take(waiter.priority)
+            waiter.granted = True
+            waiter.event.set()
+
+    def limit(self, priority='read'):
+        # Route decorator: holds a slot for the duration of the view, 503 when overloaded
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                try:
+                    token = self.acquire(priority)
+                except Overloaded:
+                    response = jsonify({"error": "Service overloaded, try again later"})
+                    response.headers['Retry-After'] = '1'
+                    return response, 503
+                failed = False
+                try:
+                    result = fn(*args, **kwargs)
+                    status = result[1] if isinstance(result, tuple) and len(result) > 1 else getattr(result, 'status_code', 200)
+                    failed = isinstance(status, int) and status >= 500
+                    return result
+                except HTTPException as e:
+                    # e.g. a 404 from get_or_404 says nothing about our capacity
+                    failed = e.code is None or e.code >= 500
+                    raise
+                except Exception:
+                    failed = True
+                    raise
+                finally:
+                    self.release(token, failed=failed)
+            return wrapper
+        return decorator
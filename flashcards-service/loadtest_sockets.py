@@ -0,0 +1,121 @@
+# Socket.IO fan-out load test: opens --sockets clients (10k by default) spread
+# over the rooms of --sets existing flashcard sets, then edits those sets
+# through the REST API and measures how long notifications take to arrive.
+#
+#   pip install "python-socketio[asyncio_client]" aiohttp
+#   ulimit -n 20000
+#   python loadtest_sockets.py --url http://localhost:5001 --sets 1-50
+#
+# Point --url at the gateway or at several replicas (comma-separated) to
+# check that rooms span replicas: sockets are spread over the URLs round-robin
+# and edits go to the first one.
+import argparse
+import asyncio
+import statistics
+import time
+import aiohttp
+import socketio
+
+CHANGES_EVENT = 'flashcard_set_changes'
+
+
+def parse_range(text):
+    first, _, last = text.partition('-')
+    return list(range(int(first), int(last or first) + 1))
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return float('nan')
+    return sorted_values[min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))]
+
+
+class Stats:
+    def __init__(self):
+        self.connect_ms = []
+        self.failed = 0
+        self.delivery_ms = []
+        self.fan_out_ms = []
+        self.last_edit = {}
+
+
+async def open_socket(index, url, set_id, stats):
+    client = socketio.AsyncClient(reconnection=False)
+
+    @client.on(CHANGES_EVENT)
+    async def on_changes(payload):
+        now = time.time()
+        stats.fan_out_ms.append((now - payload['sentAt']) * 1000)
+        for change in payload['changes']:
+            edited_at = stats.last_edit.get(change['setId'])
+            if edited_at is not None:
+                stats.delivery_ms.append((now - edited_at) * 1000)
+
+    start = time.perf_counter()
+    try:
+        await client.connect(url, transports=['websocket'])
+        await client.emit('join_notification', {'user_id': index, 'room_id': set_id})
+    except Exception:
+        stats.failed += 1
+        return None
+    stats.connect_ms.append((time.perf_counter() - start) * 1000)
+    return client
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://localhost:5001')
+    parser.add_argument('--sockets', type=int, default=10_000)
+    parser.add_argument('--sets', default='1-50', help='ids of existing sets, e.g. 1-50')
+    parser.add_argument('--edits', type=int, default=200)
+    parser.add_argument('--edit-interval', type=float, default=0.01)
+    parser.add_argument('--connect-concurrency', type=int, default=500)
+    parser.add_argument('--settle', type=float, default=3.0, help='seconds to wait for the last notifications')
+    args = parser.parse_args()
+
+    urls = args.url.split(',')
+    set_ids = parse_range(args.sets)
+    stats = Stats()
+
+    semaphore = asyncio.Semaphore(args.connect_concurrency)
+
+    async def connect(index):
+        async with semaphore:
+            return await open_socket(index, urls[index % len(urls)], set_ids[index % len(set_ids)], stats)
+
+    start = time.perf_counter()
+    clients = [c for c in await asyncio.gather(*(connect(i) for i in range(args.sockets))) if c is not None]
+    elapsed = time.perf_counter() - start
+    connect_ms = sorted(stats.connect_ms)
+    print(f"connected {len(clients)}/{args.sockets} sockets in {elapsed:.1f}s "
+          f"(p50 {percentile(connect_ms, 50):.0f} ms, p99 {percentile(connect_ms, 99):.0f} ms), "
+          f"{stats.failed} failed")
+
+    async with aiohttp.ClientSession() as session:
+        for i in range(args.edits):
+            set_id = set_ids[i % len(set_ids)]
+            # Coalesced notifications carry the latest edit, so measure from that one
+            stats.last_edit[set_id] = time.time()
+            # A distinct forwarded address per edit keeps the per-client rate limit out of the way
+            headers = {'X-Forwarded-For': f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}"}
+            async with session.put(f"{urls[0]}/api/flashcards/{set_id}", json={"title": f"Load test {i}"},
+                                   headers=headers) as response:
+                if response.status != 200:
+                    print(f"edit {i} of set {set_id} failed: HTTP {response.status}")
+            await asyncio.sleep(args.edit_interval)
+    await asyncio.sleep(args.settle)
+
+    delivery_ms = sorted(stats.delivery_ms)
+    print(f"{len(delivery_ms)} notifications delivered for {args.edits} edits of {len(set_ids)} sets")
+    if delivery_ms:
+        print(f"edit -> delivery  p50 {percentile(delivery_ms, 50):.0f} ms   p95 {percentile(delivery_ms, 95):.0f} ms   "
+              f"p99 {percentile(delivery_ms, 99):.0f} ms   mean {statistics.mean(delivery_ms):.0f} ms")
+        fan_out_ms = sorted(stats.fan_out_ms)
+        print(f"flush -> delivery p50 {percentile(fan_out_ms, 50):.0f} ms   p95 {percentile(fan_out_ms, 95):.0f} ms   "
+              f"p99 {percentile(fan_out_ms, 99):.0f} ms")
+
+    await asyncio.gather(*(client.disconnect() for client in clients))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,205 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, delete, insert, func, text
+from prometheus_client import Counter, Gauge
+from db import db
+from models.transaction import Transaction, TransactionArchive
+
+# Prepared transactions whose coordinator never came back are aborted after this long
+PREPARE_TIMEOUT = int(os.getenv("TRANSACTION_PREPARE_TIMEOUT", 300))
+# Committed transactions stay in the live table this long, so retried commits
+# still find them, and are then moved to transactions_archive
+ARCHIVE_AFTER = int(os.getenv("TRANSACTION_ARCHIVE_AFTER", 3600))
+INTERVAL = int(os.getenv("TRANSACTION_MAINTENANCE_INTERVAL", 30))
+BATCH_SIZE = int(os.getenv("TRANSACTION_MAINTENANCE_BATCH_SIZE", 1000))
+
+OPEN_STATUSES = ('pending', 'prepared')
+
+ROWS = Counter('transaction_maintenance_rows_total', 'Transactions handled by the maintenance worker', ['job'])
+LAG = Gauge('transaction_maintenance_lag_seconds',
+            'How long past its deadline the oldest transaction still waiting for the job is', ['job'])
+LAST_RUN = Gauge('transaction_maintenance_last_run_timestamp_seconds', 'When the job last completed', ['job'])
+ERRORS = Counter('transaction_maintenance_errors_total', 'Failed maintenance runs', ['job'])
+
+# Postgres: each batch locks only the rows it takes and skips rows a live
+# prepare/commit/abort is holding, so maintenance never makes them wait for
+# more than one short batch.
+REAP_SQL = text("""
+    DELETE FROM transactions
+    WHERE transaction_id IN (
+        SELECT transaction_id FROM transactions
+        WHERE status IN ('pending', 'prepared') AND created_at < :cutoff
+        ORDER BY created_at
+        LIMIT :batch_size
+        FOR UPDATE SKIP LOCKED
+    )
+""")
+
+ARCHIVE_SQL = text("""
+    WITH moved AS (
+        DELETE FROM transactions
+        WHERE transaction_id IN (
+            SELECT transaction_id FROM transactions
+            WHERE status = 'committed' AND updated_at < :cutoff
+            LIMIT :batch_size
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING transaction_id, status, data, created_at, updated_at
+    )
+    INSERT INTO transactions_archive (transaction_id, status, data, created_at, updated_at)
+    SELECT transaction_id, status, data, created_at, updated_at FROM moved
+    ON CONFLICT (transaction_id) DO NOTHING
+""")
+
+OPEN_INDEX_SQL = """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_transactions_open ON transactions (created_at)
+    WHERE status IN ('pending', 'prepared')
+"""
+
+
+def utc_now():
+    # Timestamps are naive UTC, as written by the database's now()
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class TransactionMaintenance:
+    # Background worker keeping the transactions table small: it aborts
+    # prepared transactions older than prepare_timeout, moves committed ones
+    # older than archive_after to transactions_archive, and makes sure the
+    # partial index on open transactions exists. Work is done in batches of
+    # batch_size, each in its own short database transaction, so several
+    # replicas can run it at once.
+
+    def __init__(self, app, prepare_timeout=PREPARE_TIMEOUT, archive_after=ARCHIVE_AFTER,
+                 interval=INTERVAL, batch_size=BATCH_SIZE):
+        self.app = app
+        self.prepare_timeout = prepare_timeout
+        self.archive_after = archive_after
+        self.interval = interval
+        self.batch_size = batch_size
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _is_postgres(self):
+        return db.engine.dialect.name == 'postgresql'
+
+    def ensure_open_index(self):
+        if self._is_postgres():
+            # CONCURRENTLY doesn't block writes while it builds, but can't run in a transaction
+            with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                connection.execute(text(OPEN_INDEX_SQL))
+        else:
+            for index in Transaction.__table__.indexes:
+                index.create(db.engine, checkfirst=True)
+
+    def _reap_batch(self, cutoff):
+        if self._is_postgres():
+            return db.session.execute(REAP_SQL, {"cutoff": cutoff, "batch_size": self.batch_size}).rowcount
+        stale = (
+            select(Transaction.transaction_id)
+            .where(Transaction.status.in_(OPEN_STATUSES), Transaction.created_at < cutoff)
+            .order_by(Transaction.created_at)
+            .limit(self.batch_size)
+        )
+        return db.session.execute(
+            delete(Transaction)
+            .where(Transaction.transaction_id.in_(stale), Transaction.status.in_(OPEN_STATUSES))
+            .execution_options(synchronize_session=False)
+        ).rowcount
+
+    def _archive_batch(self, cutoff):
+        if self._is_postgres():
+            return db.session.execute(ARCHIVE_SQL, {"cutoff": cutoff, "batch_size": self.batch_size}).rowcount
+        transaction_ids = db.session.scalars(
+            select(Transaction.transaction_id)
+            .where(Transaction.status == 'committed', Transaction.updated_at < cutoff)
+            .limit(self.batch_size)
+        ).all()
+        if not transaction_ids:
+            return 0
+        columns = ['transaction_id', 'status', 'data', 'created_at', 'updated_at']
+        db.session.execute(
+            insert(TransactionArchive).from_select(
+                columns,
+                select(*[getattr(Transaction, name) for name in columns])
+                .where(Transaction.transaction_id.in_(transaction_ids))
+            )
+        )
+        db.session.execute(
+            delete(Transaction)
+            .where(Transaction.transaction_id.in_(transaction_ids))
+            .execution_options(synchronize_session=False)
+        )
+        return len(transaction_ids)
+
+    def _run_batches(self, job, run_batch, cutoff):
+        total = 0
+        while True:
+            try:
+                count = run_batch(cutoff)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            total += count
+            ROWS.labels(job=job).inc(count)
+            if count < self.batch_size:
+                return total
+
+    def _record_lag(self, job, oldest, limit_seconds):
+        # How far past its deadline the oldest unhandled row is; 0 when caught up
+        lag = 0.0
+        if oldest is not None:
+            lag = max(0.0, (utc_now() - oldest).total_seconds() - limit_seconds)
+        LAG.labels(job=job).set(lag)
+
+    def reap_stale_prepared(self):
+        aborted = self._run_batches('abort', self._reap_batch, utc_now() - timedelta(seconds=self.prepare_timeout))
+        oldest = db.session.scalar(
+            select(func.min(Transaction.created_at)).where(Transaction.status.in_(OPEN_STATUSES))
+        )
+        self._record_lag('abort', oldest, self.prepare_timeout)
+        return aborted
+
+    def archive_committed(self):
+        archived = self._run_batches('archive', self._archive_batch,
+                                     utc_now() - timedelta(seconds=self.archive_after))
+        oldest = db.session.scalar(
+            select(func.min(Transaction.updated_at)).where(Transaction.status == 'committed')
+        )
+        self._record_lag('archive', oldest, self.archive_after)
+        return archived
+
+    def run_once(self):
+        results = {}
+        with self.app.app_context():
+            for job, run in (('abort', self.reap_stale_prepared), ('archive', self.archive_committed)):
+                try:
+                    results[job] = run()
+                    LAST_RUN.labels(job=job).set(time.time())
+                except Exception as e:
+                    ERRORS.labels(job=job).inc()
+                    print(f"Transaction maintenance job {job} failed: {e}")
+            db.session.remove()
+        return results
+
+    def _loop(self):
+        with self.app.app_context():
+            try:
+                self.ensure_open_index()
+            except Exception as e:
+                ERRORS.labels(job='index').inc()
+                print(f"Could not create ix_transactions_open: {e}")
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='transaction-maintenance', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,16 @@
+from db import db
+
+class CardState(db.Model):
+    __tablename__ = 'card_states'
+
+    # One row per (user, card) being studied
+    user_id = db.Column(db.Integer, primary_key=True)
+    card_id = db.Column(db.Integer, db.ForeignKey('flashcards.id', ondelete='CASCADE'), primary_key=True)
+    ease = db.Column(db.Float, nullable=False, default=2.5)
+    interval = db.Column(db.Integer, nullable=False, default=0)  # days
+    repetitions = db.Column(db.Integer, nullable=False, default=0)
+    due_at = db.Column(db.DateTime, nullable=False)  # naive UTC
+    last_reviewed_at = db.Column(db.DateTime, nullable=True)
+
+    # Serves "next N due cards for a user" as an index range scan
+    __table_args__ = (db.Index('ix_card_states_user_due', 'user_id', 'due_at'),)
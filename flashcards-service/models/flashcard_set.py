@@ -9,5 +9,10 @@ class FlashcardSet(db.Model):
     subject = db.Column(db.String(255), nullable=False)
     creator_id = db.Column(db.Integer, nullable=False) 
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    # Bumped by SQLAlchemy on every UPDATE of the row; used for ETags and optimistic locking
+    version = db.Column(db.Integer, nullable=False, default=1)
     # Relationship with Flashcards
     flashcards = db.relationship('Flashcard', backref='flashcard_set', lazy=True, cascade="all, delete-orphan")
+
+    __mapper_args__ = {"version_id_col": version}
@@ -5,4 +5,25 @@ class Transaction(db.Model):
 
     transaction_id = db.Column(db.String(255), primary_key=True)
     status = db.Column(db.String(255), nullable=False)  # 'pending', 'prepared', 'committed', 'aborted'
-    data = db.Column(db.JSON, nullable=True)  # Stores the transaction data as JSON for simplicity
\ No newline at end of file
+    data = db.Column(db.JSON, nullable=True)  # Stores the transaction data as JSON for simplicity
+    created_at = db.Column(db.DateTime, default=db.func.now())
+    updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now())
+
+    # Transactions that haven't reached a final state, oldest first; finished
+    # ones (the bulk of the table) stay out of the index
+    __table_args__ = (
+        db.Index('ix_transactions_open', 'created_at',
+                 postgresql_where=db.text("status IN ('pending', 'prepared')"),
+                 sqlite_where=db.text("status IN ('pending', 'prepared')")),
+    )
+
+class TransactionArchive(db.Model):
+    __tablename__ = 'transactions_archive'
+
+    # Committed transactions moved out of the live table by maintenance.py
+    transaction_id = db.Column(db.String(255), primary_key=True)
+    status = db.Column(db.String(255), nullable=False)
+    data = db.Column(db.JSON, nullable=True)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=db.func.now())
@@ -0,0 +1,318 @@
+import json
+import threading
+import time
+import redis
+from flask_socketio import SocketIO
+from prometheus_client import Counter, Gauge, Histogram
+
+# Initialised in app.py with a Redis message queue, so an emit from any
+# replica reaches clients connected to every replica
+socketio = SocketIO()
+
+# Clients in a set's room get its changes; creations go to every client
+CHANGES_EVENT = 'flashcard_set_changes'
+# A later change to the same set within one batch replaces the earlier one,
+# except that a creation stays a creation until the set is deleted
+MERGED_KIND = {('created', 'updated'): 'created'}
+
+
+def set_room(set_id):
+    # Same room names clients join with join_notification
+    return str(set_id)
+
+
+# Labelled by kind ('room' or 'broadcast') rather than set id, which would
+# give every set its own time series
+FANOUT_SECONDS = Histogram('socket_fanout_seconds', 'Time to hand one change batch to every local client',
+                           ['kind'])
+DROPPED = Counter('socket_notifications_dropped_total',
+                  'Changes replaced by a newer change to the same set before a slow client received them')
+LAGGING_CONNECTIONS = Gauge('socket_lagging_connections', 'Local clients with changes held back for them')
+
+
+def _send(sid, payload, callback):
+    # Nothing to deliver to when Socket.IO isn't set up (tests, scripts).
+    # ignore_queue: the client is on this replica, and acks only work locally.
+    if socketio.server is None:
+        return
+    socketio.emit(CHANGES_EVENT, payload, to=sid, callback=callback, ignore_queue=True)
+
+
+def _start_task(target):
+    if socketio.server is not None:
+        socketio.start_background_task(target)
+    else:
+        threading.Thread(target=target, name='set-change-notifier', daemon=True).start()
+
+
+class Connection:
+    # One client's delivery state: batches it hasn't acknowledged yet, and
+    # the changes held back while it has too many of those
+    def __init__(self, sid, user_id=None):
+        self.sid = sid
+        self.user_id = user_id
+        self.rooms = set()
+        self.in_flight = {}
+        self.held = {}
+        self.next_id = 0
+
+
+class Fanout:
+    # Delivers change batches to the clients connected to this replica, with
+    # a bound on how far any one client can fall behind.
+    #
+    # Batches are published on a Redis channel and every replica sends them
+    # to its own clients, asking each to acknowledge. A client with
+    # max_in_flight unacknowledged batches gets nothing more; its changes are
+    # held instead, one per set, so a newer change to a set replaces the one
+    # it would have received. Held changes go out as one batch once the
+    # client catches up. An unacknowledged batch stops counting after
+    # ack_timeout, so clients that never ack still get (coalesced) updates.
+
+    def __init__(self, redis_client=None, channel='flashcard_set_fanout', send=_send, start_task=_start_task,
+                 max_in_flight=8, ack_timeout=5.0):
+        self.redis = redis_client
+        self.channel = channel
+        self.send = send
+        self.start_task = start_task
+        self.max_in_flight = max_in_flight
+        self.ack_timeout = ack_timeout
+        self._connections = {}
+        self._rooms = {}
+        self._lock = threading.Lock()
+        self._listener = None
+        self._sweeper = None
+
+    def init_app(self, redis_client=None):
+        if redis_client is not None:
+            self.redis = redis_client
+
+    def start(self):
+        # Receives batches published by every replica
+        if self.redis is not None and self._listener is None:
+            self._listener = threading.Thread(target=self._listen, name='set-change-fanout', daemon=True)
+            self._listener.start()
+
+    def connect(self, sid):
+        with self._lock:
+            self._connections.setdefault(sid, Connection(sid))
+
+    def join(self, sid, room, user_id):
+        with self._lock:
+            connection = self._connections.setdefault(sid, Connection(sid))
+            connection.user_id = user_id
+            connection.rooms.add(room)
+            self._rooms.setdefault(room, set()).add(sid)
+
+    def leave(self, sid, room):
+        # True when no other local client of the same user is still in the room
+        with self._lock:
+            connection = self._connections.get(sid)
+            if connection is None:
+                return True
+            connection.rooms.discard(room)
+            self._discard(room, sid)
+            return not self._user_in_room(room, connection.user_id)
+
+    def disconnect(self, sid):
+        # [(room, user_id)] for the rooms the user has no other local client in
+        with self._lock:
+            connection = self._connections.pop(sid, None)
+            if connection is None:
+                return []
+            for room in connection.rooms:
+                self._discard(room, sid)
+            self._update_lagging()
+            return [(room, connection.user_id) for room in connection.rooms
+                    if not self._user_in_room(room, connection.user_id)]
+
+    def _discard(self, room, sid):
+        sids = self._rooms.get(room)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self._rooms[room]
+
+    def _user_in_room(self, room, user_id):
+        return any(self._connections[sid].user_id == user_id for sid in self._rooms.get(room, ()))
+
+    def local_rooms(self):
+        # {room: [user ids]} for this replica's clients, refreshed into presence
+        with self._lock:
+            return {room: list({self._connections[sid].user_id for sid in sids})
+                    for room, sids in self._rooms.items()}
+
+    def publish(self, payload, room=None):
+        # room=None sends to every client
+        if self.redis is not None:
+            try:
+                self.redis.publish(self.channel, json.dumps({"room": room, "payload": payload}))
+                return
+            except redis.RedisError:
+                # Other replicas miss this batch; this replica's clients still get it
+                pass
+        self.deliver(payload, room)
+
+    def _listen(self):
+        backoff = 1
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                backoff = 1
+                for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        batch = json.loads(message['data'])
+                        self.deliver(batch['payload'], batch['room'])
+            except redis.RedisError:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def deliver(self, payload, room=None):
+        start = time.perf_counter()
+        now = time.time()
+        sends = []
+        with self._lock:
+            if room is None:
+                connections = list(self._connections.values())
+            else:
+                connections = [self._connections[sid] for sid in self._rooms.get(room, ())]
+            for connection in connections:
+                self._expire(connection, now)
+                if connection.held or len(connection.in_flight) >= self.max_in_flight:
+                    self._hold(connection, payload['changes'])
+                else:
+                    sends.append(self._prepare(connection, payload, now))
+            self._update_lagging()
+        for send in sends:
+            self.send(*send)
+        FANOUT_SECONDS.labels(kind='broadcast' if room is None else 'room').observe(time.perf_counter() - start)
+
+    def _expire(self, connection, now):
+        for batch_id, sent_at in list(connection.in_flight.items()):
+            if now - sent_at > self.ack_timeout:
+                del connection.in_flight[batch_id]
+
+    def _hold(self, connection, changes):
+        for change in changes:
+            previous = connection.held.pop(change['setId'], None)
+            if previous is not None:
+                DROPPED.inc()
+                change = dict(change, change=MERGED_KIND.get((previous['change'], change['change']),
+                                                             change['change']))
+            connection.held[change['setId']] = change
+        self._ensure_sweeper()
+
+    def _prepare(self, connection, payload, now):
+        batch_id = connection.next_id
+        connection.next_id += 1
+        connection.in_flight[batch_id] = now
+        return connection.sid, payload, lambda *args: self._acked(connection, batch_id)
+
+    def _release(self, connection, now):
+        # The held changes as one batch, if the client has room for it
+        if not connection.held or len(connection.in_flight) >= self.max_in_flight:
+            return None
+        payload = {"changes": list(connection.held.values()), "sentAt": now}
+        connection.held = {}
+        return self._prepare(connection, payload, now)
+
+    def _acked(self, connection, batch_id):
+        with self._lock:
+            connection.in_flight.pop(batch_id, None)
+            send = self._release(connection, time.time()) if connection.sid in self._connections else None
+            self._update_lagging()
+        if send is not None:
+            self.send(*send)
+
+    def sweep(self):
+        # Sends held changes to clients whose unacknowledged batches have timed out
+        now = time.time()
+        with self._lock:
+            sends = []
+            for connection in self._connections.values():
+                if connection.held:
+                    self._expire(connection, now)
+                    send = self._release(connection, now)
+                    if send is not None:
+                        sends.append(send)
+            self._update_lagging()
+            lagging = any(connection.held for connection in self._connections.values())
+        for send in sends:
+            self.send(*send)
+        return lagging
+
+    def _ensure_sweeper(self):
+        # Called with the lock held; runs only while some client is lagging
+        if self._sweeper is None:
+            self._sweeper = True
+            self.start_task(self._sweep_loop)
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.ack_timeout / 5)
+            if not self.sweep():
+                with self._lock:
+                    if not any(connection.held for connection in self._connections.values()):
+                        self._sweeper = None
+                        return
+
+    def _update_lagging(self):
+        LAGGING_CONNECTIONS.set(sum(1 for connection in self._connections.values() if connection.held))
+
+
+fanout = Fanout()
+
+
+def _emit(event, payload, to=None):
+    # Every change batch is CHANGES_EVENT; rooms are set rooms, None is everyone
+    fanout.publish(payload, room=to)
+
+
+class ChangeNotifier:
+    # Coalesces flashcard set changes made through the REST routes into one
+    # batched event per room every `interval` seconds, so a burst of edits to
+    # a set produces a single notification carrying its latest state. The
+    # first change after a quiet period schedules a flush; changes arriving
+    # before it runs join that batch.
+
+    def __init__(self, emit=_emit, start_task=_start_task, interval=0.25):
+        self.emit = emit
+        self.start_task = start_task
+        self.interval = interval
+        self._pending = {}
+        self._scheduled = False
+        self._lock = threading.Lock()
+
+    def set_changed(self, set_id, kind, **fields):
+        # kind is 'created', 'updated' or 'deleted'; fields go into the payload as-is
+        with self._lock:
+            previous = self._pending.get(set_id)
+            if previous is not None:
+                kind = MERGED_KIND.get((previous['change'], kind), kind)
+            self._pending[set_id] = dict(fields, setId=set_id, change=kind)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self.start_task(self._flush_later)
+
+    def _flush_later(self):
+        time.sleep(self.interval)
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._scheduled = False
+        if not pending:
+            return
+        sent_at = time.time()
+        created = [change for change in pending.values() if change['change'] == 'created']
+        if created:
+            self.emit(CHANGES_EVENT, {"changes": created, "sentAt": sent_at})
+        for set_id, change in pending.items():
+            if change['change'] != 'created':
+                self.emit(CHANGES_EVENT, {"changes": [change], "sentAt": sent_at}, to=set_room(set_id))
+
+
+notifier = ChangeNotifier()
@@ -0,0 +1,84 @@
+import threading
+import time
+import redis
+
+
+class PresenceTracker:
+    # Who is in each set's room, across every replica. Each room is a Redis
+    # sorted set of user ids scored by when their presence expires. Replicas
+    # refresh their own connections every ttl/3 seconds, so members of a
+    # replica that dies drop out after at most `ttl` seconds.
+
+    def __init__(self, redis_client, prefix='presence:', ttl=60):
+        self.redis = redis_client
+        self.prefix = prefix
+        self.ttl = ttl
+        self._heartbeat = None
+        self._heartbeat_lock = threading.Lock()
+
+    def key(self, room):
+        return f"{self.prefix}{room}"
+
+    def _add(self, pipe, room, members, now):
+        key = self.key(room)
+        pipe.zadd(key, {str(member): now + self.ttl for member in members})
+        pipe.zremrangebyscore(key, '-inf', now)
+        pipe.expire(key, self.ttl * 2)
+
+    def join(self, room, member):
+        if self.redis is None:
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            self._add(pipe, room, [member], time.time())
+            pipe.execute()
+        except redis.RedisError:
+            pass
+
+    def leave(self, room, member):
+        if self.redis is None:
+            return
+        try:
+            self.redis.zrem(self.key(room), str(member))
+        except redis.RedisError:
+            pass
+
+    def refresh(self, rooms):
+        # rooms: {room: [members]}, all refreshed in one round trip
+        if self.redis is None or not rooms:
+            return
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=False)
+        for room, members in rooms.items():
+            if members:
+                self._add(pipe, room, members, now)
+        pipe.execute()
+
+    def members(self, room, limit=100):
+        # (count, first `limit` members); raises RedisError when Redis is down
+        if self.redis is None:
+            return 0, []
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zcount(self.key(room), now, '+inf')
+        pipe.zrangebyscore(self.key(room), now, '+inf', start=0, num=limit)
+        count, members = pipe.execute()
+        return count, [member.decode('utf-8') if isinstance(member, bytes) else member for member in members]
+
+    def start_heartbeats(self, local_rooms):
+        # local_rooms() -> {room: [members]} for this replica's connections
+        if self.redis is None or self._heartbeat is not None:
+            return
+        with self._heartbeat_lock:
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._beat, args=(local_rooms,),
+                                                   name='presence-heartbeat', daemon=True)
+                self._heartbeat.start()
+
+    def _beat(self, local_rooms):
+        while True:
+            time.sleep(self.ttl / 3)
+            try:
+                self.refresh(local_rooms())
+            except redis.RedisError:
+                pass
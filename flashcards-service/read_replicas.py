@@ -0,0 +1,178 @@
+import functools
+import itertools
+import os
+import threading
+import time
+import redis
+from flask import g, request, current_app, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import text
+from prometheus_client import Counter, Gauge
+from rate_limit import get_rate_limit_identity
+
+# Replicas further behind the primary than this get no reads
+MAX_REPLICA_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", 5))
+# After a write, the same client reads from the primary for this long
+STICKY_SECONDS = int(os.getenv("DB_REPLICA_STICKY_SECONDS", 10))
+LAG_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_LAG_CHECK_INTERVAL", 2))
+
+REPLICA_LAG = Gauge('db_replica_lag_seconds', 'Replication lag last measured on each replica', ['engine'])
+READS = Counter('db_routed_reads_total', 'Read-only requests by where their queries went', ['target'])
+
+# Postgres standby: seconds behind the primary, 0 when it has replayed everything it
+# received. NULL when its WAL receiver isn't streaming: having replayed all it
+# received then says nothing about how far behind the primary it is.
+POSTGRES_LAG_SQL = text("""
+    SELECT CASE WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN NULL
+                WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END
+""")
+
+
+def replica_urls_from_env():
+    # SQLALCHEMY_BINDS for DB_REPLICA_URLS (comma-separated); empty when there are none
+    urls = [url.strip() for url in os.getenv("DB_REPLICA_URLS", "").split(",") if url.strip()]
+    return {f"replica_{i}": url for i, url in enumerate(urls)}
+
+
+def postgres_lag(engine):
+    if engine.dialect.name != 'postgresql':
+        return 0.0
+    with engine.connect() as connection:
+        lag = connection.execute(POSTGRES_LAG_SQL).scalar()
+    # Disconnected from the primary: treated as too far behind
+    return float('inf') if lag is None else float(lag)
+
+
+def read_only(fn):
+    # Marks a route handler whose queries may go to a replica
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        g.db_read_only = True
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+def served_by_replica():
+    # Whether the current request's queries went to a replica
+    return g.get('db_replica') is not None
+
+
+class RoutingSession(Session):
+    # Sends the queries of read_only handlers to a replica picked by the
+    # app's ReplicaRouter; everything else goes where Flask-SQLAlchemy sends it
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context() and g.get('db_read_only'):
+            router = current_app.extensions.get('replica_router')
+            engine = router.engine_for_request() if router is not None else None
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class ReplicaRouter:
+    # Chooses the engine for read-only requests. Replicas are the binds
+    # named replica_*; they take turns, skipping any whose measured lag is
+    # over max_lag or that couldn't be measured. A client that wrote (any
+    # successful POST/PUT/PATCH/DELETE) reads from the primary for
+    # sticky_seconds afterwards, on every service replica: the marker is
+    # kept in Redis as well as locally.
+
+    def __init__(self, max_lag=MAX_REPLICA_LAG, sticky_seconds=STICKY_SECONDS, interval=LAG_CHECK_INTERVAL,
+                 lag_probe=postgres_lag, redis_client=None, prefix='db_sticky:'):
+        self.max_lag = max_lag
+        self.sticky_seconds = sticky_seconds
+        self.interval = interval
+        self.lag_probe = lag_probe
+        self.redis = redis_client
+        self.prefix = prefix
+        self.replicas = {}
+        self._healthy = []
+        self._turn = itertools.count()
+        self._sticky = {}
+        self._lock = threading.Lock()
+        self._monitor = None
+
+    def init_app(self, app, db, redis_client=None):
+        if redis_client is not None:
+            self.redis = redis_client
+        with app.app_context():
+            self.replicas = {key: engine for key, engine in db.engines.items()
+                             if key is not None and key.startswith('replica')}
+        app.extensions['replica_router'] = self
+        app.after_request(self._remember_write)
+
+    def check_lag(self):
+        # Measures every replica once; only replicas within max_lag get reads
+        healthy = []
+        for name, engine in self.replicas.items():
+            try:
+                lag = self.lag_probe(engine)
+            except Exception:
+                lag = float('inf')
+            REPLICA_LAG.labels(engine=name).set(lag)
+            if lag <= self.max_lag:
+                healthy.append(engine)
+        self._healthy = healthy
+
+    def _ensure_monitor(self):
+        # Until the first measurement, reads stay on the primary
+        if self._monitor is not None:
+            return
+        with self._lock:
+            if self._monitor is None:
+                self._monitor = threading.Thread(target=self._watch, name='replica-lag', daemon=True)
+                self._monitor.start()
+
+    def _watch(self):
+        while True:
+            self.check_lag()
+            time.sleep(self.interval)
+
+    def engine_for_request(self):
+        # Decided once per request, so all of its queries see the same database
+        if 'db_replica' not in g:
+            g.db_replica = self._choose()
+        return g.db_replica
+
+    def _choose(self):
+        if not self.replicas:
+            return None
+        self._ensure_monitor()
+        if self.is_sticky(get_rate_limit_identity()):
+            READS.labels(target='primary_after_write').inc()
+            return None
+        healthy = self._healthy
+        if not healthy:
+            READS.labels(target='primary_replicas_lagging').inc()
+            return None
+        READS.labels(target='replica').inc()
+        return healthy[next(self._turn) % len(healthy)]
+
+    def is_sticky(self, identity):
+        until = self._sticky.get(identity)
+        if until is not None and until > time.time():
+            return True
+        if self.redis is None:
+            return False
+        try:
+            return self.redis.exists(self.prefix + identity) > 0
+        except redis.RedisError:
+            return False
+
+    def mark_sticky(self, identity):
+        now = time.time()
+        with self._lock:
+            self._sticky[identity] = now + self.sticky_seconds
+            if len(self._sticky) > 10000:
+                self._sticky = {key: until for key, until in self._sticky.items() if until > now}
+        if self.redis is not None:
+            try:
+                self.redis.set(self.prefix + identity, 1, ex=self.sticky_seconds)
+            except redis.RedisError:
+                pass
+
+    def _remember_write(self, response):
+        if self.replicas and request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+            self.mark_sticky(get_rate_limit_identity())
+        return response
@@ -0,0 +1,140 @@
+from datetime import datetime, timezone
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import select, insert, update, and_
+from db import db
+from models.card_state import CardState
+from models.flashcard import Flashcard
+from routes import limiter, concurrency_limiter
+import scheduler
+
+reviews_bp = Blueprint('reviews_bp', __name__)
+
+DEFAULT_DUE_LIMIT = 20
+MAX_DUE_LIMIT = 200
+MAX_REVIEWS_PER_BATCH = 1000
+
+
+def utc_now():
+    # card_states stores naive UTC timestamps
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# Start studying every card of a set; cards already being studied are left alone
+@reviews_bp.route('/api/reviews/sets/<int:set_id>', methods=['POST'])
+@limiter.limit("5 per minute")
+@jwt_required()
+@concurrency_limiter.limit("write")
+def enroll_set(set_id):
+    user_id = get_jwt_identity()
+    # A single INSERT ... SELECT, however many cards the set has
+    new_cards = (
+        select(
+            Flashcard.id, db.literal(user_id), db.literal(scheduler.DEFAULT_EASE),
+            db.literal(0), db.literal(0), db.literal(utc_now())
+        )
+        .outerjoin(CardState, and_(CardState.card_id == Flashcard.id, CardState.user_id == user_id))
+        .where(Flashcard.set_id == set_id, CardState.card_id.is_(None))
+    )
+    enrolled = db.session.execute(
+        insert(CardState).from_select(
+            ['card_id', 'user_id', 'ease', 'interval', 'repetitions', 'due_at'], new_cards
+        )
+    ).rowcount
+    db.session.commit()
+    return jsonify({"setId": set_id, "enrolled": enrolled}), 201
+
+
+# Next cards due for review, most overdue first
+@reviews_bp.route('/api/reviews/due', methods=['GET'])
+@limiter.limit("5 per minute")
+@jwt_required()
+@concurrency_limiter.limit("read")
+def get_due_cards():
+    user_id = get_jwt_identity()
+    limit = max(1, min(request.args.get('limit', DEFAULT_DUE_LIMIT, type=int), MAX_DUE_LIMIT))
+
+    # Range scan on ix_card_states_user_due, then primary-key lookups for the cards
+    rows = db.session.execute(
+        select(CardState.card_id, CardState.due_at, CardState.interval, CardState.ease,
+               Flashcard.set_id, Flashcard.question, Flashcard.answer)
+        .join(Flashcard, Flashcard.id == CardState.card_id)
+        .where(CardState.user_id == user_id, CardState.due_at <= utc_now())
+        .order_by(CardState.due_at)
+        .limit(limit)
+    )
+    cards = [
+        {
+            "cardId": row.card_id,
+            "setId": row.set_id,
+            "question": row.question,
+            "answer": row.answer,
+            "dueAt": row.due_at.isoformat(),
+            "interval": row.interval,
+            "ease": round(row.ease, 2)
+        }
+        for row in rows
+    ]
+    return jsonify({"cards": cards}), 200
+
+
+# Apply a batch of grades in one transaction
+@reviews_bp.route('/api/reviews', methods=['POST'])
+@limiter.limit("5 per minute")
+@jwt_required()
+@concurrency_limiter.limit("write")
+def submit_reviews():
+    user_id = get_jwt_identity()
+    reviews = (request.get_json(silent=True) or {}).get('reviews')
+    if not isinstance(reviews, list) or not reviews:
+        return jsonify({"error": "reviews must be a non-empty list"}), 400
+    if len(reviews) > MAX_REVIEWS_PER_BATCH:
+        return jsonify({"error": f"At most {MAX_REVIEWS_PER_BATCH} reviews per request"}), 400
+
+    # Later grades for the same card win
+    grades = {}
+    for review in reviews:
+        card_id, grade = review.get('cardId'), review.get('grade')
+        if not isinstance(card_id, int) or not isinstance(grade, int) or not 0 <= grade <= 5:
+            return jsonify({"error": "Each review needs an integer cardId and a grade from 0 to 5"}), 400
+        grades[card_id] = grade
+
+    # One query tells us which cards exist and which of them already have a state
+    rows = db.session.execute(
+        select(Flashcard.id, CardState.ease, CardState.interval, CardState.repetitions)
+        .outerjoin(CardState, and_(CardState.card_id == Flashcard.id, CardState.user_id == user_id))
+        .where(Flashcard.id.in_(grades))
+    ).all()
+    if len(rows) != len(grades):
+        missing = sorted(set(grades) - {row.id for row in rows})
+        return jsonify({"error": "Unknown cards", "cardIds": missing}), 404
+
+    existing = [row.ease is not None for row in rows]
+    ease, interval, repetitions = scheduler.schedule(
+        [row.ease if row.ease is not None else scheduler.DEFAULT_EASE for row in rows],
+        [row.interval or 0 for row in rows],
+        [row.repetitions or 0 for row in rows],
+        [grades[row.id] for row in rows]
+    )
+    now = utc_now()
+    due = scheduler.due_dates(now, interval)
+
+    updated, created = [], []
+    for i, row in enumerate(rows):
+        state = {
+            "user_id": user_id, "card_id": row.id, "ease": float(ease[i]), "interval": int(interval[i]),
+            "repetitions": int(repetitions[i]), "due_at": due[i], "last_reviewed_at": now
+        }
+        (updated if existing[i] else created).append(state)
+
+    if updated:
+        db.session.execute(update(CardState), updated)
+    if created:
+        db.session.execute(insert(CardState), created)
+    db.session.commit()
+
+    results = [
+        {"cardId": state["card_id"], "interval": state["interval"], "dueAt": state["due_at"].isoformat()}
+        for state in updated + created
+    ]
+    return jsonify({"reviewed": len(results), "cards": results}), 200
@@ -0,0 +1,128 @@
+import threading
+import time
+import redis
+from prometheus_client import Counter, Gauge
+
+REVOKED_TOKENS = Gauge('jwt_revoked_tokens', 'Unexpired revoked tokens held in the local denylist')
+REVOCATIONS = Counter('jwt_revocations_total', 'Tokens revoked through this replica')
+
+
+def _text(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+class TokenDenylist:
+    # Revoked token ids (jti), checked on every authenticated request.
+    #
+    # The check is a dict lookup: every replica keeps the unexpired revoked
+    # jtis in memory. Revocations are written to Redis with a TTL equal to the
+    # token's remaining lifetime and broadcast over pub/sub, so other replicas
+    # (in both services) pick them up without a round trip per request. After
+    # a (re)connect the local set is rebuilt from the Redis keys, so nothing
+    # published while disconnected is missed. Until the first rebuild has
+    # finished, tokens missing from the local set are looked up in Redis.
+
+    def __init__(self, redis_client=None, prefix='revoked_jti:', channel='revoked_tokens', sweep_interval=60):
+        self.redis = redis_client
+        self.prefix = prefix
+        self.channel = channel
+        self.sweep_interval = sweep_interval
+        self._revoked = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.time()
+        self._listener = None
+        self._listener_lock = threading.Lock()
+        self._synced = threading.Event()
+
+    def init_app(self, jwt_manager, redis_client=None):
+        if redis_client is not None:
+            self.redis = redis_client
+
+        @jwt_manager.token_in_blocklist_loader
+        def check_if_token_revoked(jwt_header, jwt_payload):
+            return self.is_revoked(jwt_payload['jti'])
+
+    def _add(self, jti, expires_at):
+        with self._lock:
+            self._revoked[jti] = expires_at
+            REVOKED_TOKENS.set(len(self._revoked))
+
+    def _sweep(self, now):
+        # Expired tokens are rejected on their own; drop them so the set stays small
+        with self._lock:
+            self._revoked = {jti: exp for jti, exp in self._revoked.items() if exp > now}
+            self._last_sweep = now
+            REVOKED_TOKENS.set(len(self._revoked))
+
+    def is_revoked(self, jti):
+        self._ensure_listener()
+        now = time.time()
+        if now - self._last_sweep > self.sweep_interval:
+            self._sweep(now)
+        expires_at = self._revoked.get(jti)
+        if expires_at is None and self.redis is not None and not self._synced.is_set():
+            expires_at = self._lookup(jti)
+        return expires_at is not None and expires_at > now
+
+    def revoke(self, payload):
+        # payload is the decoded token (get_jwt())
+        jti, expires_at = payload['jti'], payload['exp']
+        ttl = int(expires_at - time.time()) + 1
+        if ttl <= 0:
+            return
+        self._add(jti, expires_at)
+        REVOCATIONS.inc()
+        if self.redis is None:
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.set(self.prefix + jti, expires_at, ex=ttl)
+            pipe.publish(self.channel, f"{jti} {expires_at}")
+            pipe.execute()
+        except redis.RedisError:
+            # Still revoked on this replica; the others see it after their next resync
+            pass
+
+    def _lookup(self, jti):
+        try:
+            expires_at = self.redis.get(self.prefix + jti)
+        except redis.RedisError:
+            # Nothing better to go on than the local set
+            return None
+        if expires_at is None:
+            return None
+        self._add(jti, float(expires_at))
+        return float(expires_at)
+
+    def _resync(self):
+        keys = list(self.redis.scan_iter(match=self.prefix + '*', count=1000))
+        if keys:
+            for key, expires_at in zip(keys, self.redis.mget(keys)):
+                if expires_at is not None:
+                    self._add(_text(key)[len(self.prefix):], float(expires_at))
+        self._synced.set()
+
+    def _ensure_listener(self):
+        if self.redis is None or self._listener is not None:
+            return
+        with self._listener_lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='token-revocations', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        backoff = 1
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # Subscribe first, then load, so nothing falls between the two
+                self._resync()
+                backoff = 1
+                for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        jti, expires_at = _text(message['data']).split()
+                        self._add(jti, float(expires_at))
+            except redis.RedisError:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
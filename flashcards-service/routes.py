@@ -1,44 +1,117 @@
+import csv
 import json
-import redis, time
-from flask import Blueprint, request, jsonify
+import redis
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 from db import db
 from models.flashcard_set import FlashcardSet
 from models.flashcard import Flashcard
-from sqlalchemy import text
+from sqlalchemy import text, select, insert, update, delete, values, column, Integer, Text
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.exc import StaleDataError
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from flask_limiter import Limiter  
-from flask_limiter.util import get_remote_address
-import threading
-import uuid
-from models.transaction import Transaction
+from datetime import datetime, timezone
+import two_phase
+from two_phase import GroupCommitter
+from set_cache import SetCache
+from set_versions import SetVersions
+from search import search_flashcards
+from rate_limit import RateLimiter
+from concurrency import AdaptiveLimiter, Overloaded
+from notifications import notifier, set_room
+from presence import PresenceTracker
+from read_replicas import read_only, served_by_replica
+from uploads import text_reader
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 max_concurrent_tasks = 10
-semaphore = threading.BoundedSemaphore(value=max_concurrent_tasks)
+# Starts at max_concurrent_tasks and adapts to observed latency; see concurrency.py
+concurrency_limiter = AdaptiveLimiter(initial_limit=max_concurrent_tasks)
+
+# Shares database commits between concurrent prepare/commit/abort calls
+group_committer = GroupCommitter()
+
+EXPORT_BATCH_SIZE = 500
+IMPORT_BATCH_SIZE = 1000
 
 
 flashcards_bp = Blueprint('flashcards_bp', __name__)
 
-limiter = Limiter(get_remote_address)
+limiter = RateLimiter()
 
 cache = redis.Redis(host='redis', port=6379, decode_responses=True)
-CACHE_KEY_PREFIX = 'flashcard_set_'
+# v2: values carry the load time in front of the body, which earlier replicas can't read
+CACHE_KEY_PREFIX = 'flashcard_set_v2_'
+# The set cache stores encoded response bodies, so it uses a client without decode_responses
+set_cache = SetCache(redis.Redis(host='redis', port=6379), prefix=CACHE_KEY_PREFIX, ttl=300)
+set_versions = SetVersions(cache)
+set_cache.on_invalidate(lambda set_id: set_versions.forget(set_id))
+# Who has each set's Socket.IO room open, kept up by the socket handlers in app.py
+presence = PresenceTracker(cache)
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_BATCH_IDS = 100
+MAX_SEARCH_OFFSET = 1000
+MAX_PRESENCE_USERS = 100
+
+
+def encode_json(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+def json_bytes_response(body, status=200, source=None):
+    # body is already-encoded JSON; skip jsonify so it is not parsed and re-encoded
+    response = Response(body, status=status, mimetype='application/json')
+    if source:
+        response.headers['X-Cache'] = source
+    return response
+
+
+def set_etag(set_id, version):
+    return f"set-{set_id}-v{version}"
 
 
+def not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
 
+
+def serialize_flashcard_set(flashcard_set):
+    return {
+        "setId": flashcard_set.id,
+        "version": flashcard_set.version,
+        "title": flashcard_set.title,
+        "subject": flashcard_set.subject,
+        "creatorId": flashcard_set.creator_id,
+        "cards": [{"cardId": card.id, "question": card.question, "answer": card.answer} for card in flashcard_set.flashcards]
+    }
+
+
+
+# Two-phase commit participant. Single-transaction calls from concurrent
+# requests share database commits through the group committer; the batch
+# variants apply all their transactions in one database transaction.
 @flashcards_bp.route("/api/flashcards/prepare", methods=["POST"])
 def prepare():
     transaction_id = request.json.get("transaction_id")
     data = request.json.get("data")
+    if not isinstance(transaction_id, str) or not transaction_id:
+        return jsonify({"error": "transaction_id is required"}), 400
 
     try:
-        # Create and save transaction as "prepared"
-        transaction = Transaction(transaction_id=transaction_id, status="prepared", data=data)
-        db.session.add(transaction)
-        db.session.commit()
-
-        return jsonify({"transaction_id": transaction_id, "status": "prepared"}), 200
+        # Preparing again returns the state the transaction is already in
+        status = group_committer.submit("prepare", transaction_id, data)
+        return jsonify({"transaction_id": transaction_id, "status": status}), 200
+    except two_phase.InvalidOperation as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
 @flashcards_bp.route("/api/flashcards/commit", methods=["POST"])
@@ -46,16 +119,14 @@ def commit():
     transaction_id = request.json.get("transaction_id")
 
     try:
-        transaction = Transaction.query.get(transaction_id)
-        if transaction and transaction.status == "prepared":
-            # Update status to "committed"
-            transaction.status = "committed"
-            db.session.commit()
+        status = group_committer.submit("commit", transaction_id)
+        if status == "committed":
             return jsonify({"status": "committed"}), 200
         else:
             return jsonify({"error": "Transaction not found or not prepared"}), 404
+    except two_phase.InvalidOperation as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
 @flashcards_bp.route("/api/flashcards/abort", methods=["POST"])
@@ -63,174 +134,481 @@ def abort():
     transaction_id = request.json.get("transaction_id")
 
     try:
-        # Retrieve the transaction by ID
-        transaction = Transaction.query.get(transaction_id)
-        if transaction:
-            # Update status to "aborted" and commit
-            transaction.status = "aborted"
-            db.session.commit()
-
-            # Delete the transaction entry from the table
-            Transaction.query.filter_by(transaction_id=transaction_id).delete()
-            db.session.commit()
-
+        # The row is deleted in the same statement that aborts it
+        status = group_committer.submit("abort", transaction_id)
+        if status == "aborted":
             return jsonify({"status": "aborted and deleted"}), 200
+        elif status == "committed":
+            return jsonify({"error": "Transaction already committed"}), 409
         else:
             return jsonify({"error": "Transaction not found"}), 404
+    except two_phase.InvalidOperation as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
+def transaction_ids_from_request():
+    transaction_ids = (request.get_json(silent=True) or {}).get("transaction_ids")
+    if not isinstance(transaction_ids, list) or not all(isinstance(t, str) and t for t in transaction_ids):
+        return None
+    return list(dict.fromkeys(transaction_ids))
+
+@flashcards_bp.route("/api/flashcards/prepare/batch", methods=["POST"])
+def prepare_batch():
+    transactions = (request.get_json(silent=True) or {}).get("transactions")
+    if not isinstance(transactions, list) or not all(
+            isinstance(t, dict) and isinstance(t.get("transaction_id"), str) and t["transaction_id"]
+            for t in transactions):
+        return jsonify({"error": "transactions must be a list of {transaction_id, data} objects"}), 400
+    if len(transactions) > two_phase.MAX_BATCH_IDS:
+        return jsonify({"error": f"At most {two_phase.MAX_BATCH_IDS} transactions per request"}), 400
+
+    operations = [("prepare", t["transaction_id"], t.get("data")) for t in transactions]
+    try:
+        statuses = two_phase.apply_batch(operations)
+    except two_phase.InvalidOperation as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    return jsonify({"results": {op[1]: status for op, status in zip(operations, statuses)}}), 200
 
-# Get all flashcard sets
+@flashcards_bp.route("/api/flashcards/commit/batch", methods=["POST"])
+def commit_batch():
+    return apply_transaction_batch("commit")
+
+@flashcards_bp.route("/api/flashcards/abort/batch", methods=["POST"])
+def abort_batch():
+    return apply_transaction_batch("abort")
+
+def apply_transaction_batch(kind):
+    transaction_ids = transaction_ids_from_request()
+    if transaction_ids is None:
+        return jsonify({"error": "transaction_ids must be a list of strings"}), 400
+    if len(transaction_ids) > two_phase.MAX_BATCH_IDS:
+        return jsonify({"error": f"At most {two_phase.MAX_BATCH_IDS} transactions per request"}), 400
+
+    try:
+        statuses = two_phase.apply_batch([(kind, t, None) for t in transaction_ids])
+    except two_phase.InvalidOperation as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    return jsonify({"results": dict(zip(transaction_ids, statuses))}), 200
+
+
+# Get a page of flashcard sets, ordered by id (keyset pagination)
 @flashcards_bp.route('/api/flashcards', methods=['GET'])
 @limiter.limit("5 per minute")
+@concurrency_limiter.limit("read")
+@read_only
 def get_flashcard_sets():
+    cursor = request.args.get('cursor', type=int)
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    # The catalogue version changes on every write, so it identifies the page contents
+    etag = None
+    catalogue_version = set_versions.catalogue_version()
+    if catalogue_version is not None:
+        etag = f"sets-{catalogue_version}-{cursor}-{limit}"
+        if request.if_none_match.contains(etag):
+            return not_modified(etag)
+
+    # Cards are loaded with one extra IN query per page instead of one query per set
+    query = FlashcardSet.query.options(selectinload(FlashcardSet.flashcards)).order_by(FlashcardSet.id)
+    if cursor is not None:
+        query = query.filter(FlashcardSet.id > cursor)
+    # Fetch one extra row to know whether there is a next page
+    flashcard_sets = query.limit(limit + 1).all()
+
+    next_cursor = None
+    if len(flashcard_sets) > limit:
+        flashcard_sets = flashcard_sets[:limit]
+        next_cursor = flashcard_sets[-1].id
+
+    results = [serialize_flashcard_set(fs) for fs in flashcard_sets]
+    response = jsonify({"flashcardSets": results, "next_cursor": next_cursor})
+    # A lagging replica can return the page as it was before the write that
+    # set the catalogue version; tagged with it, clients would keep the stale
+    # page until the next write
+    if etag and not served_by_replica():
+        response.set_etag(etag)
+    return response, 200
+
+# Export every flashcard set as NDJSON, one set per line
+@flashcards_bp.route('/api/flashcards/export', methods=['GET'])
+@limiter.limit("5 per minute")
+@read_only
+def export_flashcard_sets():
+    # Exports hold a bulk-class slot for the whole stream. Bulk work may only use
+    # a share of the limit and is served last, so it never starves short requests.
     try:
-        semaphore.acquire()
-        flashcard_sets = FlashcardSet.query.all()
-        # time.sleep(6)  # Simulate a slow request
-        results = [
-            {
-                "setId": fs.id,
-                "title": fs.title,
-                "subject": fs.subject,
-                "creatorId": fs.creator_id,
-                "cards": [{"cardId": card.id, "question": card.question, "answer": card.answer} for card in fs.flashcards]
-            }
-            for fs in flashcard_sets
-        ]
-        return jsonify({"flashcardSets": results}), 200
-    finally:
-        semaphore.release()
+        token = concurrency_limiter.acquire('bulk', blocking=False)
+    except Overloaded:
+        return jsonify({"error": "Too many exports in progress, try again later"}), 503
+
+    def generate():
+        try:
+            # yield_per streams rows through a server-side cursor; cards are
+            # loaded with one IN query per batch of sets
+            query = (
+                select(FlashcardSet)
+                .options(selectinload(FlashcardSet.flashcards))
+                .order_by(FlashcardSet.id)
+                .execution_options(yield_per=EXPORT_BATCH_SIZE)
+            )
+            for flashcard_set in db.session.scalars(query):
+                yield json.dumps(serialize_flashcard_set(flashcard_set)) + "\n"
+        finally:
+            db.session.close()
+
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    # Released when the server closes the response, i.e. after the last line
+    # has been sent or the client has gone away
+    response.call_on_close(lambda: concurrency_limiter.release(token))
+    return response, 200
+
+# Full-text search over card questions/answers and set titles/subjects
+@flashcards_bp.route('/api/flashcards/search', methods=['GET'])
+@limiter.limit("5 per minute")
+@concurrency_limiter.limit("read")
+@read_only
+def search_flashcard_sets():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "Query parameter q is required"}), 400
+    limit = max(1, min(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+    offset = max(0, min(request.args.get('offset', 0, type=int), MAX_SEARCH_OFFSET))
+
+    # Ask for one extra hit to know whether there is another page
+    hits = search_flashcards(query, limit + 1, offset)
+    next_offset = offset + limit if len(hits) > limit else None
+    results = [
+        {
+            "cardId": hit["card_id"],
+            "setId": hit["set_id"],
+            "question": hit["question"],
+            "answer": hit["answer"],
+            "setTitle": hit["title"],
+            "subject": hit["subject"],
+            "rank": round(float(hit["rank"]), 6)
+        }
+        for hit in hits[:limit]
+    ]
+    return jsonify({"results": results, "next_offset": next_offset}), 200
 
 # Get a single flashcard set by ID
 @flashcards_bp.route('/api/flashcards/<int:set_id>', methods=['GET'])
 @limiter.limit("5 per minute")
+@concurrency_limiter.limit("read")
 def get_flashcard_set(set_id):
-    try:
-        semaphore.acquire()
-        cache_key = f"{CACHE_KEY_PREFIX}{set_id}"
+    # Answer conditional requests from the version map, before touching the cache or Postgres
+    current_version = set_versions.get(set_id)
+    if current_version is not None and request.if_none_match.contains(set_etag(set_id, current_version)):
+        return not_modified(set_etag(set_id, current_version))
 
-        # Check if flashcard set exists in cache
-        cached_flashcard_set = cache.get(cache_key)
-        
-        if cached_flashcard_set:
-            flashcard_set_data = json.loads(cached_flashcard_set)
-            return jsonify({"data": flashcard_set_data, "source": "redis"}), 200
-        
+    def load_flashcard_set():
         flashcard_set = FlashcardSet.query.get_or_404(set_id)
-        result = {
-            "setId": flashcard_set.id,
-            "title": flashcard_set.title,
-            "subject": flashcard_set.subject,
-            "creatorId": flashcard_set.creator_id,
-            "cards": [{"cardId": card.id, "question": card.question, "answer": card.answer} for card in flashcard_set.flashcards]
-        }
-
-        cache.setex(cache_key, 300, json.dumps(result))
-        return jsonify(result), 200
-    finally:
-        semaphore.release()
+        set_versions.remember(set_id, flashcard_set.version)
+        # The version travels with the cached body so the ETag always matches it
+        return b"%d\n" % flashcard_set.version + encode_json(serialize_flashcard_set(flashcard_set))
+
+    # Hits and misses return the same body; where it came from is in X-Cache
+    cached, source = set_cache.get_or_load(set_id, load_flashcard_set)
+    version, _, body = cached.partition(b"\n")
+    response = json_bytes_response(body, source=source)
+    response.set_etag(set_etag(set_id, int(version)))
+    return response
+
+# Who is studying a set right now: clients in its room on any replica
+@flashcards_bp.route('/api/flashcards/<int:set_id>/presence', methods=['GET'])
+def get_flashcard_set_presence(set_id):
+    try:
+        count, users = presence.members(set_room(set_id), limit=MAX_PRESENCE_USERS)
+    except redis.RedisError:
+        return jsonify({"error": "Presence is unavailable, try again later"}), 503
+    # users lists at most MAX_PRESENCE_USERS of them; count covers everyone
+    return jsonify({"setId": set_id, "count": count, "users": users}), 200
+
+# Get several flashcard sets by ID in one call, in the order they were requested
+@flashcards_bp.route('/api/flashcards/batch', methods=['POST'])
+@limiter.limit("5 per minute")
+@concurrency_limiter.limit("read")
+def get_flashcard_sets_batch():
+    data = request.get_json(silent=True) or {}
+    requested = data.get('ids')
+    if not isinstance(requested, list) or not all(isinstance(set_id, int) for set_id in requested):
+        return jsonify({"error": "ids must be a list of integers"}), 400
+    if len(requested) > MAX_BATCH_IDS:
+        return jsonify({"error": f"At most {MAX_BATCH_IDS} ids per request"}), 400
+
+    def load_flashcard_sets(missing_ids):
+        # One IN query for the sets plus one for all of their cards
+        flashcard_sets = (
+            FlashcardSet.query.options(selectinload(FlashcardSet.flashcards))
+            .filter(FlashcardSet.id.in_(missing_ids))
+            .all()
+        )
+        set_versions.remember_many({flashcard_set.id: flashcard_set.version for flashcard_set in flashcard_sets})
+        loaded = {}
+        for flashcard_set in flashcard_sets:
+            loaded[flashcard_set.id] = b"%d\n" % flashcard_set.version + encode_json(serialize_flashcard_set(flashcard_set))
+        return loaded
+
+    found = set_cache.get_many(list(dict.fromkeys(requested)), load_flashcard_sets)
+
+    # Splice the cached bodies together instead of decoding and re-encoding them
+    parts = []
+    for set_id in requested:
+        if set_id in found:
+            parts.append(found[set_id][0].partition(b"\n")[2])
+        else:
+            parts.append(encode_json({"setId": set_id, "notFound": True}))
+    return json_bytes_response(b'{"flashcardSets":[' + b",".join(parts) + b"]}")
 
 # Create a new flashcard set
 @flashcards_bp.route('/api/flashcards', methods=['POST'])
 @limiter.limit("5 per minute")
 @jwt_required()
+@concurrency_limiter.limit("write")
 def create_flashcard_set():
-    try:
-        semaphore.acquire()
-        data = request.get_json()
-        title = data.get('title')
-        subject = data.get('subject')
-        cards_data = data.get('cards', [])
+    data = request.get_json()
+    title = data.get('title')
+    subject = data.get('subject')
+    cards_data = data.get('cards', [])
 
-        creator_id = get_jwt_identity()
+    creator_id = get_jwt_identity()
 
-        new_flashcard_set = FlashcardSet(title=title, subject=subject, creator_id=creator_id)
-        db.session.add(new_flashcard_set)
-        db.session.commit()
+    new_flashcard_set = FlashcardSet(title=title, subject=subject, creator_id=creator_id)
+    db.session.add(new_flashcard_set)
+    db.session.commit()
 
-        # Add the flashcards to the set
-        for card in cards_data:
-            new_flashcard = Flashcard(set_id=new_flashcard_set.id, question=card['question'], answer=card['answer'])
-            db.session.add(new_flashcard)
+    # Add the flashcards to the set
+    for card in cards_data:
+        new_flashcard = Flashcard(set_id=new_flashcard_set.id, question=card['question'], answer=card['answer'])
+        db.session.add(new_flashcard)
         
-        db.session.commit()
-
-        return jsonify({"message": "Flashcard set created successfully", "title": title}), 201
-    finally:
-        semaphore.release()
-
-# Update a flashcard set
+    db.session.commit()
+    set_versions.changed(new_flashcard_set.id, new_flashcard_set.version)
+    notifier.set_changed(new_flashcard_set.id, 'created', title=title, subject=subject,
+                         version=new_flashcard_set.version)
+
+    return jsonify({"message": "Flashcard set created successfully", "title": title}), 201
+
+def parse_import_rows(stream, content_type, delimiter):
+    # Yields (line_number, question, answer) without reading the whole upload into memory
+    text_stream = text_reader(stream)
+    if content_type in ('application/x-ndjson', 'application/jsonl', 'application/json-lines'):
+        for line_number, line in enumerate(text_stream, start=1):
+            if not line.strip():
+                continue
+            card = json.loads(line)
+            if not isinstance(card, dict):
+                raise ValueError(f"line {line_number} is not a JSON object")
+            yield line_number, card.get('question'), card.get('answer')
+    else:
+        for line_number, row in enumerate(csv.reader(text_stream, delimiter=delimiter), start=1):
+            if not row:
+                continue
+            # Skip an optional header row
+            if line_number == 1 and [col.strip().lower() for col in row[:2]] == ['question', 'answer']:
+                continue
+            yield line_number, row[0] if len(row) > 0 else None, row[1] if len(row) > 1 else None
+
+# Import a whole deck from a CSV or JSON-lines upload
+@flashcards_bp.route('/api/flashcards/import', methods=['POST'])
+@limiter.limit("5 per minute")
+@jwt_required()
+@concurrency_limiter.limit("bulk")
+def import_flashcard_set():
+    title = request.args.get('title') or request.form.get('title')
+    subject = request.args.get('subject') or request.form.get('subject')
+    if not title or not subject:
+        return jsonify({"error": "title and subject are required"}), 400
+
+    upload = request.files.get('file')
+    if upload:
+        stream, content_type = upload.stream, upload.mimetype
+    else:
+        stream, content_type = request.stream, request.mimetype
+    delimiter = '\t' if content_type == 'text/tab-separated-values' else request.args.get('delimiter', ',')
+
+    creator_id = get_jwt_identity()
+    new_flashcard_set = FlashcardSet(title=title, subject=subject, creator_id=creator_id)
+    db.session.add(new_flashcard_set)
+    db.session.flush()
+
+    # Cards go in through executemany batches in the same transaction as the set
+    card_count = 0
+    batch = []
+    try:
+        for line_number, question, answer in parse_import_rows(stream, content_type, delimiter):
+            if not question or not answer:
+                db.session.rollback()
+                return jsonify({"error": f"Line {line_number}: question and answer are required"}), 400
+            batch.append({"set_id": new_flashcard_set.id, "question": question, "answer": answer})
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                db.session.execute(insert(Flashcard), batch)
+                card_count += len(batch)
+                batch = []
+        if batch:
+            db.session.execute(insert(Flashcard), batch)
+            card_count += len(batch)
+    except (ValueError, csv.Error) as e:
+        db.session.rollback()
+        return jsonify({"error": f"Could not parse upload: {e}"}), 400
+
+    db.session.commit()
+    set_versions.changed(new_flashcard_set.id, new_flashcard_set.version)
+    notifier.set_changed(new_flashcard_set.id, 'created', title=title, subject=subject,
+                         version=new_flashcard_set.version)
+    return jsonify({"message": "Flashcard set imported successfully", "setId": new_flashcard_set.id, "cardCount": card_count}), 201
+
+def bulk_update_cards(card_rows):
+    if not card_rows:
+        return
+    if db.engine.dialect.name == 'postgresql':
+        # One UPDATE ... FROM (VALUES ...) statement, whatever the number of cards
+        card_updates = values(
+            column('id', Integer), column('question', Text), column('answer', Text), name='card_updates'
+        ).data([(row['id'], row['question'], row['answer']) for row in card_rows])
+        db.session.execute(
+            update(Flashcard.__table__)
+            .where(Flashcard.__table__.c.id == card_updates.c.id)
+            .values(question=card_updates.c.question, answer=card_updates.c.answer)
+        )
+    else:
+        # Bulk UPDATE by primary key, sent as a single executemany
+        db.session.execute(update(Flashcard), card_rows)
+
+def concurrently_modified():
+    return jsonify({"error": "Flashcard set was modified concurrently, retry the update"}), 409
+
+# Update a flashcard set, upserting and deleting its cards in batches
 @flashcards_bp.route('/api/flashcards/<int:set_id>', methods=['PUT'])
 @limiter.limit("5 per minute")
+@concurrency_limiter.limit("write")
 def update_flashcard_set(set_id):
+    flashcard_set = FlashcardSet.query.get_or_404(set_id)
+    data = request.get_json()
+    delete_ids = data.get('deleteCardIds', [])
+    if not isinstance(delete_ids, list) or not all(isinstance(card_id, int) for card_id in delete_ids):
+        return jsonify({"error": "deleteCardIds must be a list of integers"}), 400
+
+    flashcard_set.title = data.get('title', flashcard_set.title)
+    flashcard_set.subject = data.get('subject', flashcard_set.subject)
+    # Always dirty the set row so card-only edits bump its version too
+    flashcard_set.updated_at = datetime.now(timezone.utc)
+    # Write it now: a concurrent update shows up here as a version mismatch,
+    # rather than in the autoflush of the card query below, outside any handler
     try:
-        semaphore.acquire()
-        flashcard_set = FlashcardSet.query.get_or_404(set_id)
-        data = request.get_json()
+        db.session.flush()
+    except StaleDataError:
+        db.session.rollback()
+        return concurrently_modified()
+
+    cards_data = data.get('cards', [])
+    delete_ids = set(delete_ids)
+
+    # Load every referenced card of this set with a single IN query
+    referenced_ids = {card_data['cardId'] for card_data in cards_data if card_data.get('cardId') is not None}
+    existing = {}
+    if referenced_ids:
+        rows = db.session.execute(
+            select(Flashcard.id, Flashcard.question, Flashcard.answer)
+            .where(Flashcard.set_id == set_id, Flashcard.id.in_(referenced_ids))
+        )
+        existing = {row.id: row for row in rows}
+
+    updated_rows = {}
+    new_rows = []
+    for card_data in cards_data:
+        card_id = card_data.get('cardId')
+        if card_id in delete_ids:
+            continue
+        if card_id in existing:
+            current = updated_rows.get(card_id) or {
+                "id": card_id, "question": existing[card_id].question, "answer": existing[card_id].answer
+            }
+            current["question"] = card_data.get('question', current["question"])
+            current["answer"] = card_data.get('answer', current["answer"])
+            updated_rows[card_id] = current
+        else:
+            if not card_data.get('question') or not card_data.get('answer'):
+                db.session.rollback()
+                return jsonify({"error": "New cards need a question and an answer"}), 400
+            new_rows.append({"set_id": set_id, "question": card_data['question'], "answer": card_data['answer']})
+
+    bulk_update_cards(list(updated_rows.values()))
 
-        flashcard_set.title = data.get('title', flashcard_set.title)
-        flashcard_set.subject = data.get('subject', flashcard_set.subject)
+    if new_rows:
+        db.session.execute(insert(Flashcard).values(new_rows))
 
-        # Update or create flashcards
-        for card_data in data.get('cards', []):
-            flashcard = Flashcard.query.filter_by(id=card_data['cardId'], set_id=set_id).first()
-            if flashcard:
-                flashcard.question = card_data.get('question', flashcard.question)
-                flashcard.answer = card_data.get('answer', flashcard.answer)
-            else:
-                new_card = Flashcard(set_id=set_id, question=card_data['question'], answer=card_data['answer'])
-                db.session.add(new_card)
+    deleted = 0
+    if delete_ids:
+        deleted = db.session.execute(
+            delete(Flashcard).where(Flashcard.set_id == set_id, Flashcard.id.in_(delete_ids))
+        ).rowcount
 
+    # Read before the commit expires them
+    title, subject = flashcard_set.title, flashcard_set.subject
+    try:
+        db.session.flush()
+        new_version = flashcard_set.version
         db.session.commit()
-        cache.delete(f"{CACHE_KEY_PREFIX}{set_id}")
-        return jsonify({"message": "Flashcard set updated successfully"}), 200
-    finally:
-        semaphore.release()
+    except StaleDataError:
+        db.session.rollback()
+        return concurrently_modified()
+    set_versions.changed(set_id, new_version)
+    set_cache.invalidate(set_id)
+    notifier.set_changed(set_id, 'updated', title=title, subject=subject, version=new_version)
+    response = jsonify({
+        "message": "Flashcard set updated successfully",
+        "inserted": len(new_rows),
+        "updated": len(updated_rows),
+        "deleted": deleted
+    })
+    response.set_etag(set_etag(set_id, new_version))
+    return response, 200
 
 # Delete a flashcard set
 @flashcards_bp.route('/api/flashcards/<int:set_id>', methods=['DELETE'])
 @limiter.limit("5 per minute")
+@concurrency_limiter.limit("write")
 def delete_flashcard_set(set_id):
-    try:
-        semaphore.acquire()
-        flashcard_set = FlashcardSet.query.get_or_404(set_id)
-        db.session.delete(flashcard_set)
-        db.session.commit()
-        return jsonify({"message": "Flashcard set deleted successfully"}), 200
-    finally:
-        semaphore.release()
+    flashcard_set = FlashcardSet.query.get_or_404(set_id)
+    db.session.delete(flashcard_set)
+    db.session.commit()
+    set_versions.changed(set_id)
+    set_cache.invalidate(set_id)
+    notifier.set_changed(set_id, 'deleted')
+    return jsonify({"message": "Flashcard set deleted successfully"}), 200
 
 
 
 @flashcards_bp.route('/api/flashcards/status', methods=['GET'])
 @limiter.limit("5 per minute")
+@concurrency_limiter.limit("critical")
 def status():
     try:
-        semaphore.acquire()
-        try:
-            with db.engine.connect() as connection:
-                result = connection.execute(text('SELECT 1')).fetchone()
-            if result and result[0] == 1:
-                return jsonify({
-                    "service": "flashcards",
-                    "status": "running"
-                }), 200
-            else:
-                return jsonify({
-                    "service": "flashcards",
-                    "status": "ERROR",
-                    "database": "Connected but query returned unexpected result"
-                }), 500
-        except Exception as e:
+        with db.engine.connect() as connection:
+            result = connection.execute(text('SELECT 1')).fetchone()
+        if result and result[0] == 1:
+            return jsonify({
+                "service": "flashcards",
+                "status": "running"
+            }), 200
+        else:
             return jsonify({
                 "service": "flashcards",
                 "status": "ERROR",
-                "database": "Not connected",
-                "error": str(e)
+                "database": "Connected but query returned unexpected result"
             }), 500
-    finally:
-        semaphore.release()
+    except Exception as e:
+        return jsonify({
+            "service": "flashcards",
+            "status": "ERROR",
+            "database": "Not connected",
+            "error": str(e)
+        }), 500
 
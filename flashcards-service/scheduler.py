@@ -0,0 +1,34 @@
+import numpy as np
+
+MIN_EASE = 1.3
+DEFAULT_EASE = 2.5
+PASSING_GRADE = 3
+
+
+def schedule(ease, interval, repetitions, grades):
+    # SM-2 over a whole batch of reviews at once. All arguments are equal-length
+    # sequences; grades run from 0 (blackout) to 5 (perfect recall). Returns
+    # (ease, interval_days, repetitions) as numpy arrays.
+    ease = np.asarray(ease, dtype=np.float64)
+    interval = np.asarray(interval, dtype=np.int64)
+    repetitions = np.asarray(repetitions, dtype=np.int64)
+    grades = np.asarray(grades, dtype=np.int64)
+
+    passed = grades >= PASSING_GRADE
+    next_interval = np.select(
+        [repetitions == 0, repetitions == 1],
+        [1, 6],
+        np.rint(interval * ease).astype(np.int64)
+    )
+    new_interval = np.where(passed, np.maximum(next_interval, 1), 1)
+    new_repetitions = np.where(passed, repetitions + 1, 0)
+
+    miss = 5 - grades
+    new_ease = np.maximum(MIN_EASE, ease + (0.1 - miss * (0.08 + miss * 0.02)))
+    return new_ease, new_interval, new_repetitions
+
+
+def due_dates(now, interval_days):
+    # now is a naive UTC datetime; returns a list of naive UTC datetimes
+    due = np.datetime64(now, 'us') + np.asarray(interval_days, dtype=np.int64).astype('timedelta64[D]')
+    return due.astype('datetime64[us]').tolist()
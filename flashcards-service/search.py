@@ -0,0 +1,177 @@
+import math
+import re
+import threading
+import weakref
+from collections import defaultdict
+from sqlalchemy import event, text, select
+from db import db
+from models.flashcard import Flashcard
+from models.flashcard_set import FlashcardSet
+
+# Weight of a match on the set's title/subject relative to a match on the card itself
+SET_MATCH_WEIGHT = 0.5
+
+# On Postgres, flashcards.search_vector and flashcard_sets.search_vector are
+# generated tsvector columns with GIN indexes (see flashcards-db/init-flash.sql),
+# so they are kept up to date by the database on every insert and update. They
+# are not mapped on the models so the SQLite test setup can still create_all().
+POSTGRES_SEARCH_SQL = text("""
+WITH q AS (SELECT websearch_to_tsquery('english', :query) AS query),
+matches AS (
+    SELECT f.id FROM flashcards f, q WHERE f.search_vector @@ q.query
+    UNION
+    SELECT f.id FROM flashcard_sets s JOIN flashcards f ON f.set_id = s.id, q
+    WHERE s.search_vector @@ q.query
+)
+SELECT f.id AS card_id, f.set_id, f.question, f.answer, s.title, s.subject,
+       ts_rank(f.search_vector, q.query) + :set_weight * ts_rank(s.search_vector, q.query) AS rank
+FROM matches m
+JOIN flashcards f ON f.id = m.id
+JOIN flashcard_sets s ON s.id = f.set_id, q
+ORDER BY rank DESC, f.id
+LIMIT :limit OFFSET :offset
+""")
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+STOP_WORDS = frozenset("a an and are as at be by for from in is it of on or that the to was what which who with".split())
+
+
+def tokenize(value):
+    return [token for token in TOKEN_RE.findall((value or '').lower()) if token not in STOP_WORDS]
+
+
+QUERY_TERM_RE = re.compile(r'(-?)"([^"]*)"?|(\S+)')
+
+
+def parse_query(query):
+    # websearch_to_tsquery's syntax: every term has to match, "quoted words"
+    # form one term, "or" between two terms lets either match and a leading -
+    # excludes a term. Returns one (negated, alternatives) clause per term that
+    # has to match, alternatives being a list of word lists.
+    clauses, either = [], False
+    for match in QUERY_TERM_RE.finditer(query or ''):
+        if match.group(3) is None:
+            negated, words = bool(match.group(1)), tokenize(match.group(2))
+        elif match.group(3).lower() == 'or':
+            either = True
+            continue
+        else:
+            negated, words = match.group(3).startswith('-'), tokenize(match.group(3))
+        if not words:
+            continue
+        if either and clauses and not negated and not clauses[-1][0]:
+            clauses[-1][1].append(words)
+        else:
+            clauses.append((negated, [words]))
+        either = False
+    return clauses
+
+
+class InvertedIndex:
+    # In-process fallback used when the database has no full-text search (SQLite
+    # in tests). Built from the tables on first use and rebuilt lazily after any
+    # write to flashcards or flashcard_sets. Queries use websearch_to_tsquery's
+    # syntax, but words are not stemmed and quoted words only have to appear
+    # somewhere in the card or its set, not next to each other.
+
+    def __init__(self):
+        self.dirty = True
+        self._lock = threading.Lock()
+        self._card_postings = {}
+        self._set_postings = {}
+        self._cards = {}
+        self._sets = {}
+        self._set_cards = {}
+
+    def _rebuild(self, session):
+        # Cleared first so a write that lands during the rebuild marks it dirty again
+        self.dirty = False
+        card_postings = defaultdict(dict)
+        set_postings = defaultdict(set)
+        cards, sets, set_cards = {}, {}, defaultdict(list)
+
+        for set_id, title, subject in session.execute(select(FlashcardSet.id, FlashcardSet.title, FlashcardSet.subject)):
+            sets[set_id] = (title, subject)
+            for token in tokenize(f"{title} {subject}"):
+                set_postings[token].add(set_id)
+
+        for card_id, set_id, question, answer in session.execute(
+                select(Flashcard.id, Flashcard.set_id, Flashcard.question, Flashcard.answer)):
+            cards[card_id] = (set_id, question, answer)
+            set_cards[set_id].append(card_id)
+            tokens = tokenize(f"{question} {answer}")
+            for token in tokens:
+                card_postings[token][card_id] = card_postings[token].get(card_id, 0) + 1
+
+        self._card_postings, self._set_postings = dict(card_postings), dict(set_postings)
+        self._cards, self._sets, self._set_cards = cards, sets, dict(set_cards)
+
+    def search(self, session, query, limit, offset):
+        clauses = parse_query(query)
+        if not clauses:
+            return []
+        terms = {word for _, alternatives in clauses for words in alternatives for word in words}
+        with self._lock:
+            if self.dirty:
+                self._rebuild(session)
+
+            total_cards = max(len(self._cards), 1)
+            scores = defaultdict(float)
+            matched_terms = defaultdict(set)
+            for term in terms:
+                postings = self._card_postings.get(term, {})
+                idf = math.log(1 + total_cards / (1 + len(postings)))
+                for card_id, tf in postings.items():
+                    scores[card_id] += tf * idf
+                    matched_terms[card_id].add(term)
+                for set_id in self._set_postings.get(term, ()):
+                    for card_id in self._set_cards.get(set_id, ()):
+                        scores[card_id] += SET_MATCH_WEIGHT * idf
+                        matched_terms[card_id].add(term)
+
+            def matches(card_id):
+                matched = matched_terms.get(card_id, ())
+                return all(any(all(word in matched for word in words) for words in alternatives) != negated
+                           for negated, alternatives in clauses)
+
+            # A query of exclusions only matches every card without them, as in Postgres
+            candidates = matched_terms if any(not negated for negated, _ in clauses) else self._cards
+            ranked = sorted(filter(matches, candidates), key=lambda card_id: (-scores[card_id], card_id))
+            results = []
+            for card_id in ranked[offset:offset + limit]:
+                set_id, question, answer = self._cards[card_id]
+                title, subject = self._sets[set_id]
+                results.append({
+                    "card_id": card_id, "set_id": set_id, "question": question, "answer": answer,
+                    "title": title, "subject": subject, "rank": scores[card_id]
+                })
+            return results
+
+
+_fallback_indexes = weakref.WeakKeyDictionary()
+_fallback_lock = threading.Lock()
+WRITE_RE = re.compile(r"^\s*(INSERT|UPDATE|DELETE)\b.*\b(flashcards|flashcard_sets)\b", re.IGNORECASE | re.DOTALL)
+
+
+def _fallback_index(engine):
+    with _fallback_lock:
+        index = _fallback_indexes.get(engine)
+        if index is None:
+            index = _fallback_indexes[engine] = InvertedIndex()
+
+            # Catches ORM flushes as well as Core bulk inserts and updates
+            @event.listens_for(engine, "after_cursor_execute")
+            def mark_dirty(conn, cursor, statement, parameters, context, executemany):
+                if WRITE_RE.match(statement):
+                    index.dirty = True
+        return index
+
+
+def search_flashcards(query, limit, offset):
+    engine = db.engine
+    if engine.dialect.name == 'postgresql':
+        rows = db.session.execute(POSTGRES_SEARCH_SQL, {
+            "query": query, "limit": limit, "offset": offset, "set_weight": SET_MATCH_WEIGHT
+        }).mappings()
+        return [dict(row) for row in rows]
+    return _fallback_index(engine).search(db.session, query, limit, offset)
@@ -0,0 +1,138 @@
+# Production server for the service in this directory: a pre-fork gunicorn
+# master running app.py's Flask app in several worker processes.
+#
+#   python serve.py --bind 0.0.0.0:5000 --workers 4 --worker-class sync
+#
+# Every option also reads a SERVER_* environment variable (SERVER_WORKERS,
+# SERVER_WORKER_CLASS, ...), which the command line overrides.
+#
+# The app is imported once in the master (--preload, the default) and the
+# workers are forked from it, so they share its memory pages and start fast.
+# Not with the eventlet worker class: importing flashcards-service's app
+# monkey-patches the process, and a patched master dies on the first signal
+# it gets (HUP, or a worker exiting after --max-requests). Eventlet workers
+# import the app themselves, after the worker has patched itself.
+# Anything that doesn't survive a fork is redone in each worker: the database
+# pools are discarded and app.start_background_tasks() starts that worker's
+# threads. Each worker also (re)registers with Consul, which is idempotent.
+#
+# Workers are recycled after --max-requests requests (plus up to
+# --max-requests-jitter, so they don't all restart together); a recycled
+# worker finishes the requests it has and the master forks a replacement.
+# The sync and eventlet workers recycle without losing anything; gunicorn's
+# gthread worker closes connections it has accepted but not yet read from
+# when it stops, so use it with --max-requests 0.
+#
+# Reloading without dropping connections:
+#   kill -HUP <master>   new workers replace the old ones, which finish their
+#                        requests first. Picks up new settings; new code only
+#                        with --no-preload (always the case for eventlet).
+#   kill -USR2 <master>  starts a second master on new code alongside the old
+#                        one; then kill -TERM <old master> once it is up.
+#
+# flashcards-service runs the eventlet worker class for Socket.IO. Clients
+# must use the websocket transport when there is more than one worker, since
+# long-polling requests can land on a worker that doesn't know the session.
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+from gunicorn.app.base import BaseApplication
+
+
+def env_int(name, default):
+    return int(os.getenv(name, default))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bind', default=os.getenv('SERVER_BIND', '0.0.0.0:5000'))
+    parser.add_argument('--workers', type=int, default=env_int('SERVER_WORKERS', multiprocessing.cpu_count()))
+    parser.add_argument('--worker-class', default=os.getenv('SERVER_WORKER_CLASS', 'sync'),
+                        help="sync, gthread (threads per worker) or eventlet (green threads)")
+    parser.add_argument('--threads', type=int, default=env_int('SERVER_THREADS', 8),
+                        help="threads per gthread worker")
+    parser.add_argument('--worker-connections', type=int, default=env_int('SERVER_WORKER_CONNECTIONS', 1000),
+                        help="concurrent connections per eventlet worker")
+    parser.add_argument('--max-requests', type=int, default=env_int('SERVER_MAX_REQUESTS', 10000),
+                        help="recycle a worker after this many requests; 0 never does")
+    parser.add_argument('--max-requests-jitter', type=int, default=env_int('SERVER_MAX_REQUESTS_JITTER', 1000))
+    parser.add_argument('--timeout', type=int, default=env_int('SERVER_TIMEOUT', 30))
+    parser.add_argument('--graceful-timeout', type=int, default=env_int('SERVER_GRACEFUL_TIMEOUT', 30))
+    parser.add_argument('--keepalive', type=int, default=env_int('SERVER_KEEPALIVE', 5))
+    parser.add_argument('--no-preload', dest='preload', action='store_false',
+                        default=os.getenv('SERVER_PRELOAD', '1') != '0')
+    parser.add_argument('--no-register', dest='register', action='store_false',
+                        default=os.getenv('SERVER_REGISTER', '1') != '0',
+                        help="don't register with Consul (benchmarks, local runs)")
+    return parser.parse_args(argv)
+
+
+def load_app_module():
+    import app
+    return app
+
+
+def post_fork(server, worker):
+    module = load_app_module()
+    from db import db
+    with module.app.app_context():
+        # Connections opened by the master would be shared with every worker
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    if os.getenv('SERVER_REGISTER', '1') != '0':
+        module.register_service_with_consul()
+    module.start_background_tasks()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+class Server(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return load_app_module().app
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Each worker writes its metrics here and /metrics adds them up; must be
+    # set before prometheus_client is imported, and start out empty
+    metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', tempfile.mkdtemp(prefix='prometheus-'))
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+    # Imported now: child_exit runs in a signal handler, where a first import
+    # can be interrupted by the next worker's exit and fail half-initialized
+    import prometheus_client.multiprocess
+    options = {
+        'bind': args.bind,
+        'workers': args.workers,
+        'worker_class': args.worker_class,
+        'threads': args.threads,
+        'worker_connections': args.worker_connections,
+        'max_requests': args.max_requests,
+        'max_requests_jitter': args.max_requests_jitter,
+        'timeout': args.timeout,
+        'graceful_timeout': args.graceful_timeout,
+        'keepalive': args.keepalive,
+        'preload_app': args.preload and args.worker_class != 'eventlet',
+        'post_fork': post_fork,
+        'child_exit': child_exit,
+    }
+    # Read by the workers, and by the new master after a USR2
+    os.environ['SERVER_REGISTER'] = '1' if args.register else '0'
+    Server(options).run()
+
+
+if __name__ == '__main__':
+    main()
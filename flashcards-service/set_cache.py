@@ -0,0 +1,297 @@
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+import redis
+from prometheus_client import Counter
+
+# Registered on the default prometheus_client registry, which is what the
+# app's PrometheusMetrics exports on /metrics
+CACHE_HITS = Counter('flashcard_set_cache_hits_total', 'Flashcard set cache hits', ['tier'])
+CACHE_MISSES = Counter('flashcard_set_cache_misses_total', 'Flashcard set cache misses')
+CACHE_COALESCED = Counter('flashcard_set_cache_coalesced_total',
+                          'Requests that waited for an in-flight load instead of querying the database')
+CACHE_EARLY_REFRESHES = Counter('flashcard_set_cache_early_refreshes_total',
+                                'Entries recomputed before expiry by probabilistic early expiration')
+
+
+class LocalCache:
+    # Bounded LRU with a per-entry expiry time. Entries are (value, expires_at, delta).
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, expires_at, delta):
+        with self._lock:
+            self._entries[key] = (value, expires_at, delta)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _decode(raw):
+    # Redis values are b"<delta>|<body>"; anything else (such as an entry
+    # written in another format) is treated as missing
+    delta, separator, value = raw.partition(b'|')
+    try:
+        return value, float(delta) if separator else None
+    except ValueError:
+        return value, None
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.stale = False
+
+
+class SetCache:
+    # Read-through cache for serialised flashcard sets. Values are the encoded
+    # response bodies (bytes), so hits can be written out without re-encoding.
+    #
+    # Lookups go in-process LRU -> Redis -> loader. Concurrent misses for the same
+    # key share a single loader call, entries are refreshed early with probability
+    # growing towards expiry (XFetch) so hot keys do not all expire at once, and
+    # invalidations are broadcast over Redis pub/sub so every replica drops its
+    # local copy.
+
+    def __init__(self, redis_client, prefix='flashcard_set_v2_', ttl=300, local_ttl=30,
+                 local_max_entries=1024, beta=1.0, channel='flashcard_set_invalidations',
+                 load_timeout=10):
+        self.redis = redis_client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.beta = beta
+        self.channel = channel
+        self.load_timeout = load_timeout
+        self.local = LocalCache(local_max_entries)
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        self._listener = None
+        self._listener_lock = threading.Lock()
+        self._invalidation_callbacks = []
+
+    def key(self, set_id):
+        return f"{self.prefix}{set_id}"
+
+    def _should_refresh_early(self, expires_at, delta):
+        # XFetch: recompute once now - delta * beta * ln(rand) passes the expiry
+        return time.time() - delta * self.beta * math.log(1.0 - random.random()) >= expires_at
+
+    def _read_redis(self, key):
+        if self.redis is None:
+            return None
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.get(key)
+            pipe.pttl(key)
+            raw, pttl = pipe.execute()
+        except redis.RedisError:
+            return None
+        if raw is None or pttl is None or pttl < 0:
+            return None
+        value, delta = _decode(raw)
+        if delta is None:
+            return None
+        return value, time.time() + pttl / 1000.0, delta
+
+    def _write(self, key, value, delta):
+        expires_at = time.time() + self.ttl
+        self.local.set(key, value, min(expires_at, time.time() + self.local_ttl), delta)
+        if self.redis is None:
+            return
+        try:
+            self.redis.setex(key, self.ttl, b"%.6f|" % delta + value)
+        except redis.RedisError:
+            pass
+
+    def get_or_load(self, set_id, loader):
+        # Returns (value, source) where source is 'memory', 'redis' or 'database'
+        self._ensure_listener()
+        key = self.key(set_id)
+
+        entry = self.local.get(key)
+        if entry and not self._should_refresh_early(entry[1], entry[2]):
+            CACHE_HITS.labels(tier='memory').inc()
+            return entry[0], 'memory'
+
+        stale = entry
+        if stale is None:
+            cached = self._read_redis(key)
+            if cached:
+                value, expires_at, delta = cached
+                self.local.set(key, value, min(expires_at, time.time() + self.local_ttl), delta)
+                if not self._should_refresh_early(expires_at, delta):
+                    CACHE_HITS.labels(tier='redis').inc()
+                    return value, 'redis'
+                stale = cached
+
+        return self._load(key, loader, stale)
+
+    def get_many(self, set_ids, loader):
+        # Batch lookup: local tier, then one MGET, then loader(missing_ids) -> {set_id: value}
+        # for everything still missing, written back with one pipeline. Returns
+        # {set_id: (value, source)}; ids the loader did not return are left out.
+        self._ensure_listener()
+        results = {}
+        missing = []
+        for set_id in set_ids:
+            entry = self.local.get(self.key(set_id))
+            if entry:
+                CACHE_HITS.labels(tier='memory').inc()
+                results[set_id] = (entry[0], 'memory')
+            else:
+                missing.append(set_id)
+
+        if missing and self.redis is not None:
+            try:
+                raw_values = self.redis.mget([self.key(set_id) for set_id in missing])
+            except redis.RedisError:
+                raw_values = [None] * len(missing)
+            still_missing = []
+            for set_id, raw in zip(missing, raw_values):
+                value, delta = _decode(raw) if raw is not None else (None, None)
+                if delta is None:
+                    still_missing.append(set_id)
+                    continue
+                self.local.set(self.key(set_id), value, time.time() + self.local_ttl, delta)
+                CACHE_HITS.labels(tier='redis').inc()
+                results[set_id] = (value, 'redis')
+            missing = still_missing
+
+        if not missing:
+            return results
+
+        CACHE_MISSES.inc(len(missing))
+        start = time.time()
+        loaded = loader(missing)
+        delta = (time.time() - start) / len(missing)
+        for set_id, value in loaded.items():
+            self.local.set(self.key(set_id), value, time.time() + self.local_ttl, delta)
+            results[set_id] = (value, 'database')
+        if loaded and self.redis is not None:
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                for set_id, value in loaded.items():
+                    pipe.setex(self.key(set_id), self.ttl, b"%.6f|" % delta + value)
+                pipe.execute()
+            except redis.RedisError:
+                pass
+        return results
+
+    def _load(self, key, loader, stale):
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            # Someone is already refreshing this key; serve what we have or wait for it
+            if stale is not None:
+                CACHE_HITS.labels(tier='stale').inc()
+                return stale[0], 'memory'
+            CACHE_COALESCED.inc()
+            if not flight.done.wait(self.load_timeout):
+                raise TimeoutError(f"Timed out waiting for {key} to load")
+            if flight.error is not None:
+                raise flight.error
+            return flight.value, 'database'
+
+        if stale is None:
+            CACHE_MISSES.inc()
+        else:
+            CACHE_EARLY_REFRESHES.inc()
+        try:
+            start = time.time()
+            flight.value = loader()
+            if not flight.stale:
+                self._write(key, flight.value, time.time() - start)
+            return flight.value, 'database'
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def on_invalidate(self, callback):
+        # callback(set_id) runs on every replica when a set is invalidated, and
+        # callback(None) when invalidations may have been missed
+        self._invalidation_callbacks.append(callback)
+
+    def _drop_local(self, set_id):
+        if set_id is None:
+            self.local.clear()
+        else:
+            self.local.delete(self.key(set_id))
+        for callback in self._invalidation_callbacks:
+            callback(set_id)
+
+    def invalidate(self, set_id):
+        key = self.key(set_id)
+        self._drop_local(set_id)
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            if flight:
+                # A load that started before the change must not write its result back
+                flight.stale = True
+        if self.redis is None:
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.delete(key)
+            pipe.publish(self.channel, str(set_id))
+            pipe.execute()
+        except redis.RedisError:
+            pass
+
+    def _ensure_listener(self):
+        if self.redis is None or self._listener is not None:
+            return
+        with self._listener_lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='set-cache-invalidations', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        backoff = 1
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # Anything published while we were disconnected is lost, so start clean
+                self._drop_local(None)
+                backoff = 1
+                for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self._drop_local(int(message['data']))
+            except redis.RedisError:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
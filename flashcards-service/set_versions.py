@@ -0,0 +1,116 @@
+import threading
+import time
+import redis
+
+# Only ever raises the stored version, so a slow reader cannot roll back a newer bump
+REMEMBER_VERSION_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+if not current or tonumber(current) < tonumber(ARGV[2]) then
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+end
+return 1
+"""
+
+
+class SetVersions:
+    # Current version of each flashcard set, plus a catalogue-wide version that
+    # changes whenever any set is created, changed or deleted. Used to answer
+    # If-None-Match without loading anything from Postgres.
+    #
+    # Set version lookups go through a local dict first and then a Redis hash;
+    # the local copies are dropped through the set cache's cross-replica
+    # invalidations. The catalogue version is read from Redis every time:
+    # creating a set invalidates nothing, so a local copy would go stale on
+    # every other replica. Without Redis both live in this process only.
+
+    def __init__(self, redis_client, key='flashcard_set_versions', catalogue_key='flashcard_catalogue_version'):
+        self.redis = redis_client
+        self.key = key
+        self.catalogue_key = catalogue_key
+        self._versions = {}
+        self._catalogue_version = None
+        self._lock = threading.Lock()
+        self._remember_script = redis_client.register_script(REMEMBER_VERSION_SCRIPT) if redis_client else None
+
+    def get(self, set_id):
+        with self._lock:
+            version = self._versions.get(set_id)
+        if version is not None or self.redis is None:
+            return version
+        try:
+            version = self.redis.hget(self.key, set_id)
+        except redis.RedisError:
+            return None
+        if version is None:
+            return None
+        version = int(version)
+        self._remember_local(set_id, version)
+        return version
+
+    def _remember_local(self, set_id, version):
+        with self._lock:
+            if self._versions.get(set_id, 0) < version:
+                self._versions[set_id] = version
+
+    def remember(self, set_id, version):
+        # Record a version read from the database
+        self.remember_many({set_id: version})
+
+    def remember_many(self, versions):
+        for set_id, version in versions.items():
+            self._remember_local(set_id, version)
+        if self.redis is None or not versions:
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for set_id, version in versions.items():
+                self._remember_script(keys=[self.key], args=[set_id, version], client=pipe)
+            pipe.execute()
+        except redis.RedisError:
+            pass
+
+    def changed(self, set_id, version=None):
+        # Call after committing a change; version is None when the set was deleted
+        with self._lock:
+            if self.redis is None and self._catalogue_version is not None:
+                self._catalogue_version += 1
+            if version is None:
+                self._versions.pop(set_id, None)
+            else:
+                self._versions[set_id] = version
+        if self.redis is None:
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            if version is None:
+                pipe.hdel(self.key, set_id)
+            else:
+                pipe.hset(self.key, set_id, version)
+            pipe.incr(self.catalogue_key)
+            pipe.execute()
+        except redis.RedisError:
+            pass
+
+    def catalogue_version(self):
+        if self.redis is None:
+            with self._lock:
+                if self._catalogue_version is None:
+                    self._catalogue_version = int(time.time() * 1000)
+                return self._catalogue_version
+        try:
+            # Seed from the clock so a Redis restart cannot hand out a version
+            # that old clients already hold ETags for
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.set(self.catalogue_key, int(time.time() * 1000), nx=True)
+            pipe.get(self.catalogue_key)
+            return int(pipe.execute()[1])
+        except (redis.RedisError, TypeError):
+            return None
+
+    def forget(self, set_id):
+        # Drop local copies after an invalidation from another replica
+        with self._lock:
+            if set_id is None:
+                self._versions.clear()
+            else:
+                self._versions.pop(set_id, None)
@@ -0,0 +1,928 @@
+import http.client
+import io
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import pytest
+from flask import Flask, Request
+from flask_jwt_extended import JWTManager, create_access_token
+from sqlalchemy import event
+from sqlalchemy.orm.attributes import set_committed_value
+from db import db
+import routes
+from routes import flashcards_bp
+from review_routes import reviews_bp
+from models.flashcard_set import FlashcardSet
+from models.flashcard import Flashcard
+from set_cache import SetCache
+from set_versions import SetVersions
+from concurrency import AdaptiveLimiter, Overloaded
+from rate_limit import RateLimiter, parse_rule
+from notifications import ChangeNotifier, Fanout, CHANGES_EVENT
+from presence import PresenceTracker
+from sql_metrics import SqlMetrics, TimedQueuePool
+from profiling import RequestProfiler
+from read_replicas import ReplicaRouter
+from sqlalchemy import create_engine, text
+from prometheus_client import REGISTRY
+from models.card_state import CardState
+import scheduler
+
+# Define a test configuration for the Flask app
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+
+    # Configure in-memory SQLite for testing
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['JWT_SECRET_KEY'] = 'super-secret'
+
+    # Initialize the database and JWT manager
+    db.init_app(app)
+    jwt = JWTManager(app)
+
+    # Register blueprints (routes)
+    app.register_blueprint(flashcards_bp)
+    app.register_blueprint(reviews_bp)
+
+    # Create the in-memory database
+    with app.app_context():
+        db.create_all()
+
+    # The set cache is module-level; don't leak entries between tests
+    routes.set_cache.local.clear()
+
+    yield app
+
+    # Clean up the database after the test
+    with app.app_context():
+        db.drop_all()
+
+# Create a test client fixture
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+def seed_sets(app, count, cards_per_set=3):
+    with app.app_context():
+        for i in range(count):
+            flashcard_set = FlashcardSet(title=f"Set {i}", subject="Math", creator_id=1)
+            for j in range(cards_per_set):
+                flashcard_set.flashcards.append(Flashcard(question=f"Q{i}-{j}", answer=f"A{i}-{j}"))
+            db.session.add(flashcard_set)
+        db.session.commit()
+
+def auth_headers(app, user_id=1):
+    with app.app_context():
+        access_token = create_access_token(identity=user_id)
+    return {'Authorization': f'Bearer {access_token}'}
+
+def count_queries(app, fn):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        fn()
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return len(statements)
+
+def test_get_flashcard_sets_paginates(app, client):
+    seed_sets(app, 5)
+
+    response = client.get('/api/flashcards?limit=2')
+    assert response.status_code == 200
+    page = response.get_json()
+    assert [fs['setId'] for fs in page['flashcardSets']] == [1, 2]
+    assert len(page['flashcardSets'][0]['cards']) == 3
+    assert page['next_cursor'] == 2
+
+    response = client.get(f"/api/flashcards?limit=2&cursor={page['next_cursor']}")
+    page = response.get_json()
+    assert [fs['setId'] for fs in page['flashcardSets']] == [3, 4]
+
+    response = client.get(f"/api/flashcards?limit=2&cursor={page['next_cursor']}")
+    page = response.get_json()
+    assert [fs['setId'] for fs in page['flashcardSets']] == [5]
+    assert page['next_cursor'] is None
+
+def test_get_flashcard_sets_page_size_is_bounded(app, client, monkeypatch):
+    monkeypatch.setattr(routes, 'MAX_PAGE_SIZE', 3)
+    seed_sets(app, 5, cards_per_set=0)
+
+    response = client.get('/api/flashcards?limit=100000')
+    assert response.status_code == 200
+    page = response.get_json()
+    assert len(page['flashcardSets']) == routes.MAX_PAGE_SIZE
+    assert page['next_cursor'] == page['flashcardSets'][-1]['setId']
+
+def test_get_flashcard_sets_query_count_is_constant(app, client):
+    seed_sets(app, 2)
+    small = count_queries(app, lambda: client.get('/api/flashcards?limit=50'))
+
+    seed_sets(app, 40)
+    large = count_queries(app, lambda: client.get('/api/flashcards?limit=50'))
+
+    assert large == small
+
+def test_export_flashcard_sets_streams_ndjson(app, client):
+    seed_sets(app, 3, cards_per_set=2)
+
+    response = client.get('/api/flashcards/export')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [line['setId'] for line in lines] == [1, 2, 3]
+    assert all(len(line['cards']) == 2 for line in lines)
+
+    # The export slot is given back once the stream is closed
+    response.close()
+    assert routes.concurrency_limiter.in_flight == 0
+
+def test_import_flashcard_set_from_csv(app, client):
+    body = "question,answer\n" + "".join(f"Q{i},A{i}\n" for i in range(2500))
+
+    response = client.post('/api/flashcards/import?title=Deck&subject=History', data=body,
+                           content_type='text/csv', headers=auth_headers(app))
+    assert response.status_code == 201
+    assert response.get_json()['cardCount'] == 2500
+
+    set_id = response.get_json()['setId']
+    with app.app_context():
+        assert Flashcard.query.filter_by(set_id=set_id).count() == 2500
+        assert db.session.get(FlashcardSet, set_id).creator_id == 1
+
+def test_import_flashcard_set_from_ndjson(app, client):
+    body = '{"question": "Q1", "answer": "A1"}\n{"question": "Q2", "answer": "A2"}\n'
+
+    response = client.post('/api/flashcards/import?title=Deck&subject=History', data=body,
+                           content_type='application/x-ndjson', headers=auth_headers(app))
+    assert response.status_code == 201
+    assert response.get_json()['cardCount'] == 2
+
+class UnreadableSpool:
+    # Like tempfile.SpooledTemporaryFile before Python 3.11, which Werkzeug
+    # spools multipart parts to: no readable(), so io.TextIOWrapper rejects it
+    def __init__(self):
+        self._file = io.BytesIO()
+
+    def write(self, data):
+        return self._file.write(data)
+
+    def seek(self, *args):
+        return self._file.seek(*args)
+
+    def read(self, *args):
+        return self._file.read(*args)
+
+    def readline(self, *args):
+        return self._file.readline(*args)
+
+    def close(self):
+        self._file.close()
+
+def test_import_flashcard_set_from_multipart_upload(app, client, monkeypatch):
+    monkeypatch.setattr(Request, '_get_file_stream', lambda self, *args, **kwargs: UnreadableSpool())
+    body = "question,answer\n" + "".join(f"Q{i},A{i}\n" for i in range(50))
+
+    response = client.post('/api/flashcards/import', data={
+        'title': 'Deck', 'subject': 'History', 'file': (io.BytesIO(body.encode()), 'deck.csv', 'text/csv')
+    }, content_type='multipart/form-data', headers=auth_headers(app))
+    assert response.status_code == 201
+    assert response.get_json()['cardCount'] == 50
+
+def test_import_flashcard_set_rejects_bad_rows(app, client):
+    body = "Q1,A1\nQ2\n"
+
+    response = client.post('/api/flashcards/import?title=Deck&subject=History', data=body,
+                           content_type='text/csv', headers=auth_headers(app))
+    assert response.status_code == 400
+    with app.app_context():
+        assert FlashcardSet.query.count() == 0
+
+def test_update_flashcard_set_upserts_and_deletes_cards(app, client):
+    seed_sets(app, 1, cards_per_set=3)
+
+    response = client.put('/api/flashcards/1', json={
+        'title': 'Renamed',
+        'cards': [
+            {'cardId': 1, 'question': 'New Q1'},
+            {'cardId': 2, 'answer': 'New A2'},
+            {'question': 'Q new', 'answer': 'A new'}
+        ],
+        'deleteCardIds': [3]
+    })
+    assert response.status_code == 200
+    body = response.get_json()
+    assert (body['inserted'], body['updated'], body['deleted']) == (1, 2, 1)
+
+    with app.app_context():
+        cards = {card.id: (card.question, card.answer) for card in Flashcard.query.filter_by(set_id=1)}
+        assert cards == {1: ('New Q1', 'A0-0'), 2: ('Q0-1', 'New A2'), 4: ('Q new', 'A new')}
+        assert db.session.get(FlashcardSet, 1).title == 'Renamed'
+
+def test_update_flashcard_set_rejects_bad_delete_ids(app, client):
+    seed_sets(app, 1, cards_per_set=3)
+
+    for delete_ids in ('12', [{'cardId': 1}], [[1]], 1):
+        response = client.put('/api/flashcards/1', json={'title': 'Renamed', 'deleteCardIds': delete_ids})
+        assert response.status_code == 400
+    with app.app_context():
+        flashcard_set = db.session.get(FlashcardSet, 1)
+        assert flashcard_set.title == 'Set 0' and len(flashcard_set.flashcards) == 3
+
+def test_update_flashcard_set_query_count_is_constant(app, client):
+    seed_sets(app, 2, cards_per_set=60)
+
+    def update_payload(set_id, first_card, count):
+        return {
+            'cards': [{'cardId': first_card + i, 'question': f'Edited {i}'} for i in range(count)]
+                     + [{'question': f'Added {i}', 'answer': 'A'} for i in range(count)],
+            'deleteCardIds': [first_card + count + i for i in range(count)]
+        }
+
+    small = count_queries(app, lambda: client.put('/api/flashcards/1', json=update_payload(1, 1, 2)))
+    large = count_queries(app, lambda: client.put('/api/flashcards/2', json=update_payload(2, 61, 25)))
+
+    assert large == small
+
+def test_get_flashcard_set_is_served_from_cache(app, client):
+    seed_sets(app, 1, cards_per_set=2)
+
+    response = client.get('/api/flashcards/1')
+    assert response.status_code == 200
+    assert response.headers['X-Cache'] == 'database'
+    miss_body = response.get_json()
+    assert miss_body['title'] == 'Set 0'
+
+    responses = []
+    queries = count_queries(app, lambda: responses.append(client.get('/api/flashcards/1')))
+    assert queries == 0
+    assert responses[0].headers['X-Cache'] == 'memory'
+    assert responses[0].mimetype == 'application/json'
+    assert responses[0].get_json() == miss_body
+
+def test_delete_flashcard_set_invalidates_cache(app, client):
+    seed_sets(app, 1)
+    client.get('/api/flashcards/1')
+
+    response = client.delete('/api/flashcards/1')
+    assert response.status_code == 200
+    assert client.get('/api/flashcards/1').status_code == 404
+
+def test_set_cache_coalesces_concurrent_misses():
+    set_cache = SetCache(None)
+    calls = []
+    release = threading.Event()
+
+    def loader():
+        calls.append(1)
+        release.wait(5)
+        return b'value'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(set_cache.get_or_load(1, loader)[0])) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == [b'value'] * 5
+    assert len(calls) == 1
+
+def test_set_cache_local_tier_is_bounded():
+    set_cache = SetCache(None, local_max_entries=2)
+    for set_id in range(3):
+        set_cache.get_or_load(set_id, lambda: b'value')
+
+    assert set_cache.local.get(set_cache.key(0)) is None
+    assert set_cache.local.get(set_cache.key(2)) is not None
+
+class OldFormatRedis:
+    # Holds a set cached as plain JSON, as before the load time was stored with it
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def get(self, key):
+        self.results = [self.data.get(key), 60000]
+
+    def pttl(self, key):
+        pass
+
+    def execute(self):
+        return self.results
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def setex(self, key, ttl, value):
+        self.data[key] = value
+
+def test_set_cache_treats_unreadable_entries_as_misses():
+    fake_redis = OldFormatRedis()
+    set_cache = SetCache(fake_redis)
+    set_cache._listener = threading.current_thread()
+    fake_redis.data[set_cache.key(1)] = b'{"setId": 1}'
+    fake_redis.data[set_cache.key(2)] = b'{"title": "a|b"}'
+
+    assert set_cache.get_or_load(1, lambda: b'fresh') == (b'fresh', 'database')
+    set_cache.local.clear()
+    assert set_cache.get_or_load(1, lambda: b'unused') == (b'fresh', 'redis')
+    assert set_cache.get_many([2], lambda ids: {2: b'loaded'}) == {2: (b'loaded', 'database')}
+
+@pytest.fixture
+def local_versions(monkeypatch):
+    # Keep versions in-process so ETags work without Redis
+    set_versions = SetVersions(None)
+    monkeypatch.setattr(routes, 'set_versions', set_versions)
+    return set_versions
+
+def test_get_flashcard_set_conditional_get(app, client, local_versions):
+    seed_sets(app, 1)
+
+    response = client.get('/api/flashcards/1')
+    etag = response.headers['ETag']
+    assert etag == '"set-1-v1"'
+
+    responses = []
+    queries = count_queries(app, lambda: responses.append(client.get('/api/flashcards/1', headers={'If-None-Match': etag})))
+    assert responses[0].status_code == 304
+    assert queries == 0
+
+    # Card-only edits bump the version and change the ETag
+    response = client.put('/api/flashcards/1', json={'cards': [{'cardId': 1, 'question': 'Changed'}]})
+    assert response.headers['ETag'] == '"set-1-v2"'
+
+    response = client.get('/api/flashcards/1', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] == '"set-1-v2"'
+    assert response.get_json()['version'] == 2
+
+def test_update_conflicts_with_a_concurrent_update(app, client, local_versions):
+    seed_sets(app, 1)
+
+    # Another writer bumps the version between this request's load and its write
+    def loaded_before_concurrent_update(target, context):
+        set_committed_value(target, 'version', target.version - 1)
+    event.listen(FlashcardSet, 'load', loaded_before_concurrent_update)
+    try:
+        response = client.put('/api/flashcards/1', json={'title': 'Mine', 'cards': [{'cardId': 1, 'question': 'Q'}]})
+    finally:
+        event.remove(FlashcardSet, 'load', loaded_before_concurrent_update)
+    assert response.status_code == 409
+
+    fs = client.get('/api/flashcards/1').get_json()
+    assert fs['title'] == 'Set 0' and fs['version'] == 1
+
+def test_get_flashcard_sets_conditional_get(app, client, local_versions):
+    seed_sets(app, 2)
+
+    response = client.get('/api/flashcards')
+    etag = response.headers['ETag']
+    assert client.get('/api/flashcards', headers={'If-None-Match': etag}).status_code == 304
+
+    client.delete('/api/flashcards/2')
+    response = client.get('/api/flashcards', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert len(response.get_json()['flashcardSets']) == 1
+
+def test_replica_served_listing_has_no_etag(tmp_path, local_versions):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'primary.db'}"
+    app.config['SQLALCHEMY_BINDS'] = {'replica': f"sqlite:///{tmp_path / 'replica.db'}"}
+    app.config['JWT_SECRET_KEY'] = 'super-secret'
+    db.init_app(app)
+    JWTManager(app)
+    app.register_blueprint(flashcards_bp)
+    lag = {'seconds': 0.0}
+    router = ReplicaRouter(max_lag=5, lag_probe=lambda engine: lag['seconds'])
+    router.init_app(app, db)
+    with app.app_context():
+        db.create_all()
+        db.metadata.create_all(db.engines['replica'])
+    seed_sets(app, 1)
+    client = app.test_client()
+    try:
+        # The replica may not have the write behind the current catalogue version yet
+        router.check_lag()
+        response = client.get('/api/flashcards')
+        assert response.get_json()['flashcardSets'] == []
+        assert 'ETag' not in response.headers
+
+        lag['seconds'] = 30
+        router.check_lag()
+        response = client.get('/api/flashcards')
+        assert len(response.get_json()['flashcardSets']) == 1
+        assert client.get('/api/flashcards', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    finally:
+        # init_app gave db a metadata for the bind; other tests' apps don't configure it
+        del db.metadatas['replica']
+
+def test_get_flashcard_sets_batch(app, client):
+    seed_sets(app, 3, cards_per_set=2)
+    # Warm one entry so the batch mixes cache hits and database loads
+    client.get('/api/flashcards/2')
+
+    response = client.post('/api/flashcards/batch', json={'ids': [3, 99, 2, 1]})
+    assert response.status_code == 200
+    sets = response.get_json()['flashcardSets']
+    assert [fs['setId'] for fs in sets] == [3, 99, 2, 1]
+    assert sets[1] == {'setId': 99, 'notFound': True}
+    assert len(sets[0]['cards']) == 2
+
+def test_get_flashcard_sets_batch_query_count_is_constant(app, client):
+    seed_sets(app, 30)
+
+    small = count_queries(app, lambda: client.post('/api/flashcards/batch', json={'ids': [1, 2]}))
+    large = count_queries(app, lambda: client.post('/api/flashcards/batch', json={'ids': list(range(3, 31))}))
+    assert large == small
+
+def test_get_flashcard_sets_batch_rejects_bad_ids(client):
+    assert client.post('/api/flashcards/batch', json={'ids': 'abc'}).status_code == 400
+    assert client.post('/api/flashcards/batch', json={'ids': list(range(101))}).status_code == 400
+
+def test_search_flashcards(app, client):
+    with app.app_context():
+        biology = FlashcardSet(title='Cell biology', subject='Biology', creator_id=1)
+        biology.flashcards.append(Flashcard(question='What is the powerhouse of the cell?', answer='Mitochondria'))
+        biology.flashcards.append(Flashcard(question='What do ribosomes make?', answer='Proteins'))
+        history = FlashcardSet(title='Rome', subject='History', creator_id=1)
+        history.flashcards.append(Flashcard(question='Who crossed the Rubicon?', answer='Caesar'))
+        db.session.add_all([biology, history])
+        db.session.commit()
+
+    response = client.get('/api/flashcards/search?q=mitochondria')
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert [result['answer'] for result in results] == ['Mitochondria']
+    assert results[0]['setTitle'] == 'Cell biology'
+
+    # Set titles match too, but cards matching on their own text rank first
+    results = client.get('/api/flashcards/search?q=cell').get_json()['results']
+    assert [result['answer'] for result in results] == ['Mitochondria', 'Proteins']
+
+    # Writes through the API are picked up by the index
+    client.put('/api/flashcards/2', json={'cards': [{'question': 'Who was Cicero?', 'answer': 'An orator'}]})
+    results = client.get('/api/flashcards/search?q=cicero').get_json()['results']
+    assert [result['setId'] for result in results] == [2]
+
+def test_search_flashcards_understands_websearch_syntax(app, client):
+    with app.app_context():
+        history = FlashcardSet(title='Rome', subject='History', creator_id=1)
+        history.flashcards.append(Flashcard(question='Who crossed the Rubicon?', answer='Julius Caesar'))
+        history.flashcards.append(Flashcard(question='Who founded Rome?', answer='Romulus'))
+        history.flashcards.append(Flashcard(question='Who was the first emperor?', answer='Augustus Caesar'))
+        db.session.add(history)
+        db.session.commit()
+
+    def answers(query):
+        response = client.get('/api/flashcards/search', query_string={'q': query})
+        return sorted(result['answer'] for result in response.get_json()['results'])
+
+    assert answers('caesar') == ['Augustus Caesar', 'Julius Caesar']
+    assert answers('caesar -augustus') == ['Julius Caesar']
+    assert answers('romulus or augustus') == ['Augustus Caesar', 'Romulus']
+    assert answers('"julius caesar"') == ['Julius Caesar']
+    assert answers('-caesar') == ['Romulus']
+    assert answers('caesar romulus') == []
+
+def test_search_flashcards_paginates(app, client):
+    with app.app_context():
+        flashcard_set = FlashcardSet(title='Vocabulary', subject='French', creator_id=1)
+        for i in range(5):
+            flashcard_set.flashcards.append(Flashcard(question=f'Word {i}', answer='bonjour'))
+        db.session.add(flashcard_set)
+        db.session.commit()
+
+    page = client.get('/api/flashcards/search?q=bonjour&limit=3').get_json()
+    assert len(page['results']) == 3
+    assert page['next_offset'] == 3
+
+    page = client.get('/api/flashcards/search?q=bonjour&limit=3&offset=3').get_json()
+    assert len(page['results']) == 2
+    assert page['next_offset'] is None
+
+    assert client.get('/api/flashcards/search').status_code == 400
+
+def test_scheduler_applies_sm2_to_a_batch():
+    ease, interval, repetitions = scheduler.schedule(
+        [2.5, 2.5, 2.5, 2.0], [0, 1, 6, 10], [0, 1, 2, 3], [5, 4, 3, 1]
+    )
+    assert list(interval) == [1, 6, 15, 1]
+    assert list(repetitions) == [1, 2, 3, 0]
+    assert [round(value, 2) for value in ease] == [2.6, 2.5, 2.36, 1.46]
+
+def test_review_flow(app, client):
+    seed_sets(app, 2, cards_per_set=3)
+    headers = auth_headers(app)
+
+    response = client.post('/api/reviews/sets/1', headers=headers)
+    assert response.status_code == 201
+    assert response.get_json()['enrolled'] == 3
+    # Enrolling again does not duplicate states
+    assert client.post('/api/reviews/sets/1', headers=headers).get_json()['enrolled'] == 0
+
+    due = client.get('/api/reviews/due', headers=headers).get_json()['cards']
+    assert sorted(card['cardId'] for card in due) == [1, 2, 3]
+
+    # Card 4 was never enrolled; reviewing it creates its state
+    response = client.post('/api/reviews', json={'reviews': [
+        {'cardId': 1, 'grade': 5}, {'cardId': 2, 'grade': 1}, {'cardId': 4, 'grade': 4}
+    ]}, headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['reviewed'] == 3
+
+    with app.app_context():
+        states = {state.card_id: state for state in CardState.query.filter_by(user_id=1)}
+        assert set(states) == {1, 2, 3, 4}
+        assert (states[1].interval, states[1].repetitions) == (1, 1)
+        assert (states[2].interval, states[2].repetitions) == (1, 0)
+
+    # Reviewed cards are scheduled for later, card 3 is still due
+    due = client.get('/api/reviews/due', headers=headers).get_json()['cards']
+    assert [card['cardId'] for card in due] == [3]
+
+    # Other users have their own queue
+    assert client.get('/api/reviews/due', headers=auth_headers(app, user_id=2)).get_json()['cards'] == []
+
+def test_submit_reviews_rejects_unknown_cards(app, client):
+    seed_sets(app, 1, cards_per_set=1)
+    response = client.post('/api/reviews', json={'reviews': [{'cardId': 99, 'grade': 3}]}, headers=auth_headers(app))
+    assert response.status_code == 404
+    assert response.get_json()['cardIds'] == [99]
+
+    response = client.post('/api/reviews', json={'reviews': [{'cardId': 1, 'grade': 7}]}, headers=auth_headers(app))
+    assert response.status_code == 400
+
+def test_concurrency_limiter_rejects_when_queue_is_full():
+    limiter = AdaptiveLimiter(initial_limit=2, min_limit=1, max_queue=0)
+    tokens = [limiter.acquire('read'), limiter.acquire('read')]
+
+    with pytest.raises(Overloaded) as exc:
+        limiter.acquire('read')
+    assert exc.value.reason == 'queue_full'
+
+    # Health checks still get through above the limit
+    tokens.append(limiter.acquire('critical'))
+    for token in tokens:
+        limiter.release(token)
+    assert limiter.in_flight == 0
+
+def test_concurrency_limiter_serves_waiters_by_priority():
+    limiter = AdaptiveLimiter(initial_limit=2, max_wait=5)
+    tokens = [limiter.acquire('read'), limiter.acquire('read')]
+    order = []
+
+    def wait_for_slot(priority):
+        token = limiter.acquire(priority)
+        order.append(priority)
+        limiter.release(token)
+
+    threads = [threading.Thread(target=wait_for_slot, args=(priority,)) for priority in ('write', 'read')]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    limiter.release(tokens.pop())
+    for thread in threads:
+        thread.join()
+    limiter.release(tokens.pop())
+
+    assert order == ['read', 'write']
+
+def test_concurrency_limiter_backs_off_when_slow():
+    limiter = AdaptiveLimiter(initial_limit=10, latency_target=0.0, decrease_interval=0)
+    for _ in range(5):
+        limiter.release(limiter.acquire('read'))
+    assert limiter.current_limit < 10
+
+def test_concurrency_limiter_bulk_share_is_capped():
+    limiter = AdaptiveLimiter(initial_limit=10)
+    tokens = [limiter.acquire('bulk', blocking=False) for _ in range(3)]
+    with pytest.raises(Overloaded):
+        limiter.acquire('bulk', blocking=False)
+    # Reads are not blocked behind bulk work
+    tokens.append(limiter.acquire('read', blocking=False))
+    for token in tokens:
+        limiter.release(token)
+
+class FixedWindowScript:
+    # Stands in for the Redis script: grants up to `wanted` from a fixed budget per key
+    def __init__(self):
+        self.used = {}
+        self.calls = 0
+
+    def __call__(self, keys, args):
+        self.calls += 1
+        interval_ms, period_ms, wanted = args
+        budget = int(round(period_ms / interval_ms)) - self.used.get(keys[0], 0)
+        granted = max(0, min(wanted, budget))
+        self.used[keys[0]] = self.used.get(keys[0], 0) + granted
+        return [granted, 0 if granted else 1500]
+
+def test_parse_rate_limit_rule():
+    assert parse_rule("5 per minute") == (5, 60)
+    assert parse_rule("100/hour") == (100, 3600)
+    assert parse_rule("10 per 30 seconds") == (10, 30)
+    with pytest.raises(ValueError):
+        parse_rule("lots")
+
+def test_rate_limiter_spends_leased_tokens_locally():
+    limiter = RateLimiter(lease_fraction=0.1, max_lease=10)
+    limiter._script = FixedWindowScript()
+    results = [limiter.hit("key", 100, 60) for _ in range(105)]
+    assert results.count(0) == 100
+    assert results[-1] == 2
+    # One round trip per lease of 10, plus the rejected checks
+    assert limiter._script.calls == 15
+
+def test_rate_limiter_rejects_with_retry_after(app, client):
+    limiter = RateLimiter()
+    limiter._script = FixedWindowScript()
+    view = app.view_functions['flashcards_bp.get_flashcard_set']
+    assert view._rate_limit == (5, 60)
+    app.before_request(limiter._check_request)
+    seed_sets(app, 1)
+
+    statuses = [client.get('/api/flashcards/1').status_code for _ in range(6)]
+    assert statuses == [200] * 5 + [429]
+    response = client.get('/api/flashcards/1')
+    assert response.headers['Retry-After'] == '2'
+    # Limits are kept per client, so another address still gets through
+    assert client.get('/api/flashcards/1', headers={'X-Forwarded-For': '10.0.0.2'}).status_code == 200
+
+@pytest.fixture
+def notifications(monkeypatch):
+    # Records what would be emitted; flushes only when the test says so
+    emitted = []
+    notifier = ChangeNotifier(emit=lambda event, payload, to=None: emitted.append((event, payload, to)),
+                              start_task=lambda target: None)
+    monkeypatch.setattr(routes, 'notifier', notifier)
+    return notifier, emitted
+
+def test_rest_changes_are_notified_in_batches(app, client, notifications):
+    notifier, emitted = notifications
+    headers = auth_headers(app)
+    for title in ("First", "Second"):
+        client.post('/api/flashcards', json={"title": title, "subject": "Math", "cards": []}, headers=headers)
+    for question in ("Q1", "Q2", "Q3"):
+        client.put('/api/flashcards/1', json={"cards": [{"question": question, "answer": "A"}]})
+    client.delete('/api/flashcards/2')
+    assert emitted == []
+
+    notifier.flush()
+    # One broadcast for the creation that survived, one event per changed set's room
+    assert [(event, to) for event, _, to in emitted] == [(CHANGES_EVENT, None), (CHANGES_EVENT, '2')]
+    assert [(c['setId'], c['change'], c['version']) for c in emitted[0][1]['changes']] == [(1, 'created', 4)]
+    assert emitted[1][1]['changes'] == [{"setId": 2, "change": "deleted"}]
+
+    notifier.flush()
+    assert len(emitted) == 2
+
+def test_change_notifier_schedules_one_flush_per_batch():
+    started = []
+    notifier = ChangeNotifier(emit=lambda *args, **kwargs: None, start_task=started.append)
+    notifier.set_changed(1, 'updated', version=2)
+    notifier.set_changed(1, 'updated', version=3)
+    notifier.set_changed(2, 'updated', version=5)
+    assert len(started) == 1
+    notifier.flush()
+    notifier.set_changed(1, 'deleted')
+    assert len(started) == 2
+
+def test_fanout_coalesces_changes_for_slow_clients():
+    sent = []
+    fanout = Fanout(send=lambda sid, payload, callback: sent.append((sid, payload, callback)),
+                    start_task=lambda target: None, max_in_flight=1)
+    fanout.connect('fast')
+    fanout.join('slow', '1', 7)
+    fanout.join('other', '2', 8)
+
+    fanout.deliver({"changes": [{"setId": 1, "change": "updated", "version": 2}], "sentAt": 0}, '1')
+    # 'slow' hasn't acked, so these are held, and the second replaces the first
+    fanout.deliver({"changes": [{"setId": 1, "change": "updated", "version": 3}], "sentAt": 0}, '1')
+    fanout.deliver({"changes": [{"setId": 1, "change": "updated", "version": 4}], "sentAt": 0}, '1')
+    fanout.deliver({"changes": [{"setId": 5, "change": "created"}], "sentAt": 0})
+    assert [sid for sid, _, _ in sent] == ['slow', 'fast', 'other']
+
+    # Acknowledging releases everything held as one batch with the latest version
+    sent[0][2]()
+    assert sent[-1][0] == 'slow'
+    assert [(c['setId'], c.get('version')) for c in sent[-1][1]['changes']] == [(1, 4), (5, None)]
+    assert fanout.local_rooms() == {'1': [7], '2': [8]}
+    assert fanout.disconnect('slow') == [('1', 7)]
+
+class ZSetRedis:
+    # The sorted-set commands PresenceTracker uses
+    def __init__(self):
+        self.zsets = {}
+
+    def pipeline(self, transaction=True):
+        return ZSetPipeline(self)
+
+    def zadd(self, key, mapping):
+        self.zsets.setdefault(key, {}).update(mapping)
+
+    def zrem(self, key, member):
+        self.zsets.get(key, {}).pop(member, None)
+
+    def zremrangebyscore(self, key, low, high):
+        zset = self.zsets.get(key, {})
+        for member in [m for m, score in zset.items() if score <= high]:
+            del zset[member]
+
+    def expire(self, key, seconds):
+        pass
+
+    def zrangebyscore(self, key, low, high, start=0, num=None):
+        members = sorted(m for m, score in self.zsets.get(key, {}).items() if score >= low)
+        return members[start:] if num is None else members[start:start + num]
+
+    def zcount(self, key, low, high):
+        return len(self.zrangebyscore(key, low, high))
+
+class ZSetPipeline:
+    def __init__(self, redis_client):
+        self.redis = redis_client
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+    def execute(self):
+        return [getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+def test_presence_endpoint_counts_members_until_they_expire(client, monkeypatch):
+    tracker = PresenceTracker(ZSetRedis(), ttl=60)
+    monkeypatch.setattr(routes, 'presence', tracker)
+    tracker.join('1', 7)
+    tracker.join('1', 8)
+    tracker.join('2', 7)
+    tracker.leave('1', 8)
+
+    response = client.get('/api/flashcards/1/presence')
+    assert response.get_json() == {"setId": 1, "count": 1, "users": ["7"]}
+
+    # A replica that stops refreshing its members loses them after ttl
+    tracker.redis.zsets['presence:1']['7'] = time.time() - 1
+    assert client.get('/api/flashcards/1/presence').get_json()['count'] == 0
+    tracker.refresh({'1': [7, 9]})
+    assert client.get('/api/flashcards/1/presence').get_json()['users'] == ['7', '9']
+
+class KeyValueRedis:
+    # The string and hash commands SetVersions uses, shared by several "replicas"
+    def __init__(self):
+        self.values = {}
+
+    def register_script(self, script):
+        return lambda keys, args, client=None: None
+
+    def pipeline(self, transaction=True):
+        return ZSetPipeline(self)
+
+    def set(self, key, value, nx=False):
+        if not (nx and key in self.values):
+            self.values[key] = str(value)
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def incr(self, key):
+        self.values[key] = str(int(self.values.get(key, 0)) + 1)
+
+    def hset(self, key, field, value):
+        self.values.setdefault(key, {})[field] = value
+
+    def hdel(self, key, field):
+        self.values.get(key, {}).pop(field, None)
+
+def test_catalogue_version_changes_on_every_replica_when_a_set_is_created():
+    shared = KeyValueRedis()
+    creator, other = SetVersions(shared), SetVersions(shared)
+    before = other.catalogue_version()
+    assert creator.catalogue_version() == before
+
+    # A create publishes no invalidation; the other replica must still see the new version
+    creator.changed(42, 1)
+    assert other.catalogue_version() != before
+    assert other.catalogue_version() == creator.catalogue_version()
+
+def test_sql_metrics_pool_gauges(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", poolclass=TimedQueuePool, pool_size=2, max_overflow=1)
+    SqlMetrics().instrument(engine, 'pool_test')
+    labels = {'engine': 'pool_test'}
+    waits_before = REGISTRY.get_sample_value('db_pool_wait_seconds_count', labels) or 0
+
+    connections = [engine.connect() for _ in range(3)]
+    assert REGISTRY.get_sample_value('db_pool_size', labels) == 2
+    assert REGISTRY.get_sample_value('db_pool_checked_out', labels) == 3
+    assert REGISTRY.get_sample_value('db_pool_overflow', labels) == 1
+    for connection in connections:
+        connection.execute(text('SELECT 1'))
+        connection.close()
+    assert REGISTRY.get_sample_value('db_pool_checked_out', labels) == 0
+    assert REGISTRY.get_sample_value('db_pool_checkouts_total', labels) == 3
+    assert REGISTRY.get_sample_value('db_pool_wait_seconds_count', labels) == waits_before + 3
+    engine.dispose()
+
+def test_profiler_flags_lazy_loads_as_n_plus_one(app, client, tmp_path, capsys):
+    RequestProfiler(profile_dir=str(tmp_path), sample_rate=1.0, threshold=5).init_app(app, db)
+
+    # The same listing with one lazy load per set
+    @app.route('/lazy')
+    def lazy():
+        return {"cards": sum(len(fs.flashcards) for fs in FlashcardSet.query.all())}
+
+    seed_sets(app, 10)
+    labels = {'endpoint': 'lazy'}
+    before = REGISTRY.get_sample_value('sql_repeated_statements_total', labels) or 0
+
+    response = client.get('/lazy')
+    assert response.get_json() == {"cards": 30}
+    assert REGISTRY.get_sample_value('sql_repeated_statements_total', labels) == before + 1
+    out = capsys.readouterr().out
+    assert "Likely N+1 in lazy: 10 x SELECT flashcards.id" in out
+    assert "WHERE ? = flashcards.set_id" in out
+
+    # Sampled at rate 1, so both files are there
+    profile = tmp_path / next(p.name for p in tmp_path.iterdir() if response.headers['X-Profile-Id'] in p.name)
+    sql = profile.with_suffix('.sql').read_text()
+    assert sql.splitlines()[0].split()[0] == '10'
+
+    # get_flashcard_sets loads cards with selectinload: nothing to report
+    listing = {'endpoint': 'flashcards_bp.get_flashcard_sets'}
+    before = REGISTRY.get_sample_value('sql_repeated_statements_total', listing) or 0
+    assert client.get('/api/flashcards').status_code == 200
+    assert (REGISTRY.get_sample_value('sql_repeated_statements_total', listing) or 0) == before
+
+def test_profiler_counts_statements_by_shape(app, client, capsys):
+    RequestProfiler(threshold=5).init_app(app, db)
+
+    # Each statement inlines a different id, so no two have the same text
+    @app.route('/inlined')
+    def inlined():
+        return {"found": sum(len(db.session.execute(text(f"SELECT id FROM flashcard_sets WHERE id = {i}")).all())
+                             for i in range(1, 6))}
+
+    seed_sets(app, 5)
+    labels = {'endpoint': 'inlined'}
+    before = REGISTRY.get_sample_value('sql_repeated_statements_total', labels) or 0
+    assert client.get('/inlined').get_json() == {"found": 5}
+    assert REGISTRY.get_sample_value('sql_repeated_statements_total', labels) == before + 1
+    assert "Likely N+1 in inlined: 5 x SELECT id FROM flashcard_sets WHERE id = ?" in capsys.readouterr().out
+
+def test_serve_survives_hup_and_worker_recycling(tmp_path):
+    # The Dockerfile's setup: eventlet workers, recycled every few requests
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path / 'metrics'))
+    server = subprocess.Popen([sys.executable, 'serve.py', '--bind', f'127.0.0.1:{port}', '--workers', '2',
+                               '--worker-class', 'eventlet', '--max-requests', '3', '--max-requests-jitter', '0',
+                               '--no-register'],
+                              cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    def get_metrics():
+        deadline = time.time() + 30
+        while True:
+            try:
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+                connection.request('GET', '/metrics')
+                return connection.getresponse().status
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.2)
+            finally:
+                connection.close()
+
+    try:
+        assert get_metrics() == 200
+        # Enough requests for every worker to be replaced a few times
+        assert [get_metrics() for _ in range(20)] == [200] * 20
+        server.send_signal(signal.SIGHUP)
+        time.sleep(2)
+        assert [get_metrics() for _ in range(5)] == [200] * 5
+        assert server.poll() is None
+    finally:
+        server.terminate()
+        _, stderr = server.communicate(timeout=30)
+    assert b'do not call blocking functions' not in stderr
+    assert b'Traceback' not in stderr